@@ -1,31 +1,89 @@
+import asyncio
+import json
+import math
 import os
+import sys
 import uuid
-from typing import List, Optional, Dict, Any
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import TYPE_CHECKING, Awaitable, Callable, List, Literal, Optional, Dict, Any, Tuple
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationChain
-from langchain.document_loaders import TextLoader
-from langchain.text_splitter import CharacterTextSplitter
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.vectorstores import FAISS
-from langchain.chains import RetrievalQA
-from langchain.prompts import ChatPromptTemplate
-from langchain.output_parsers import PydanticOutputParser
+from chains import ChainRegistry
+from code_analyzer import analyze_code as analyze_code_locally
+from concurrency import EndpointLimiter, run_sync
+from document_collections import CollectionError, CollectionExists, CollectionNotFound, CollectionStore, check_unique_ids
+from index_jobs import RetryJob, create_job_runner, split_for_index, write_index
+from ingestion import IncrementalSplitter, UploadError, documents_from_chunks, ingest_multipart_upload
+from observability import MetricsMiddleware, install_langchain_callbacks, render_metrics, stage, stats_collector
+from chat_memory import MEMORY_MODE, append_turn, build_history, compact_session, new_record
+from response_cache import create_response_cache, normalize_code, normalize_text
+from session_store import create_session_store
+from single_flight import create_single_flight
+from text_splitting import (
+    CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS, ChunkDeduplicator, chunk_stats, create_token_splitter,
+    ingestion_stats, split_text, splitter_settings
+)
+from upstream import UpstreamUnavailable, set_request_priority
+from vector_index import index_settings, vectorstore_from_embeddings
+from vectorstore_cache import VectorStoreCache, make_cache_key
+from warmup import create_warmup
+
+# LangChain chains, the OpenAI SDK, FAISS and the retrievers are imported where they are used
+if TYPE_CHECKING:
+    from langchain.chains import ConversationChain, RetrievalQA
+    from langchain_community.vectorstores import FAISS
 
 # Load environment variables
 load_dotenv()
 
+# Heavy modules behind each endpoint group, imported on first use or ahead of it by the warmup
+ENDPOINT_GROUPS = {
+    "chat": ("clients", "langchain_core.chat_history", "langchain.memory.buffer", "langchain.chains.conversation.base"),
+    "code": ("clients", "langchain_core.prompts.chat", "langchain_core.output_parsers.pydantic", "langchain_core.runnables.passthrough"),
+    "document_qa": (
+        "clients", "embedding_cache", "embedding_backends", "langchain_text_splitters", "hybrid_retrieval", "context_compression",
+        "langchain.chains.retrieval_qa.base", "langchain_community.vectorstores.faiss", "faiss",
+    ),
+    "collections": (
+        "clients", "embedding_cache", "embedding_backends", "langchain_text_splitters", "hybrid_retrieval",
+        "langchain.chains.retrieval_qa.base", "langchain_community.vectorstores.faiss", "langchain_community.docstore.in_memory", "faiss",
+    ),
+}
+
+# Seconds shutdown waits for the warmup step in progress
+WARMUP_STOP_TIMEOUT = float(os.getenv("WARMUP_STOP_TIMEOUT", "2"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up clients, chains and heavy imports in the background and start the job runner; close connections at shutdown
+
+    Startup does not wait for the warmup, so health checks pass as soon as the
+    app is imported, and shutdown skips whatever warmup is left. Jobs still
+    running at shutdown go back to the queue.
+    """
+    warmup_task = asyncio.create_task(startup_warmup.run())
+    job_runner.start()
+    yield
+    await job_runner.stop()
+    # Shutdown waits for the current warmup step at most briefly, never for the whole warmup
+    startup_warmup.stop()
+    await asyncio.wait({warmup_task}, timeout=WARMUP_STOP_TIMEOUT)
+    warmup_task.cancel()
+    if "clients" in sys.modules:
+        from clients import close_client_pool
+        await close_client_pool()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="LangChain API",
     description="REST API for LangChain examples including chatbot, document Q&A, and code assistant",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -37,13 +95,129 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency, per-stage spans and token counts for GET /metrics
+app.add_middleware(MetricsMiddleware)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Global storage for conversation sessions
-conversation_sessions: Dict[str, ConversationChain] = {}
+# Bounded storage for conversation history (SESSION_BACKEND selects memory, sqlite or redis)
+conversation_sessions = create_session_store()
+
+# Cache of built vector stores keyed by document content and index settings
+vectorstore_cache = VectorStoreCache(
+    max_entries=int(os.getenv("VECTORSTORE_CACHE_MAX_ENTRIES", "32")),
+    ttl_seconds=float(os.getenv("VECTORSTORE_CACHE_TTL", "3600")),
+    max_bytes=int(os.getenv("VECTORSTORE_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+    persist_dir=os.getenv("VECTORSTORE_CACHE_DIR") or None,
+)
+
+# Persistent named document collections, loaded lazily on first query
+collection_store = CollectionStore(
+    os.getenv("COLLECTIONS_DIR", os.path.join("data", "collections")),
+    max_loaded=int(os.getenv("COLLECTIONS_MAX_LOADED", "8")),
+    compact_segments=int(os.getenv("COLLECTIONS_COMPACT_SEGMENTS", "16")),
+    compact_ratio=float(os.getenv("COLLECTIONS_COMPACT_RATIO", "0.2")),
+)
+
+# Exact/semantic cache for deterministic endpoints (RESPONSE_CACHE_* env vars)
+response_cache = create_response_cache()
+
+# Per-endpoint concurrency limits (ENDPOINT_CONCURRENCY_<NAME> env vars)
+endpoint_limiter = EndpointLimiter()
+
+# Identical in-flight requests share one model call (SINGLE_FLIGHT* env vars)
+single_flight = create_single_flight()
+
+# Background indexing jobs in a SQLite queue shared by the workers (JOBS_* env vars)
+job_runner = create_job_runner()
+JOBS_EMBED_BATCH = int(os.getenv("JOBS_EMBED_BATCH", "256"))
+
+# Embeddings for document Q&A, uploads, jobs and new collections: openai, or a local backend such as hashing
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+
+# Prebuilt chains, composed once per model setting and timed per invocation
+chain_registry = ChainRegistry()
+
+# Imports ENDPOINT_GROUPS, then creates the clients and chains (WARMUP=0 leaves everything to first use)
+startup_warmup = create_warmup(ENDPOINT_GROUPS)
+startup_warmup.add_hook("clients", lambda: client_pool())
+startup_warmup.add_hook("chains", lambda: chain_registry.warmup())
+
+# Gauges read from the caches and session store whenever /metrics is scraped
+# Scrapes never create the OpenAI clients or the embedding cache; their gauges appear once something has used them
+stats_collector.add(
+    "cache_hit_ratio", "Hit ratio per cache", ("cache",),
+    lambda: {
+        ("vectorstore",): cache_hit_ratio(vectorstore_cache.stats()),
+        **embedding_cache_ratio(),
+        **{
+            (f"response_{endpoint}",): counters["hit_ratio"]
+            for endpoint, counters in response_cache.stats()["endpoints"].items()
+        },
+    }
+)
+stats_collector.add(
+    "active_sessions", "Chat sessions held in the session store", (),
+    lambda: {(): conversation_sessions.stats()["sessions"]}
+)
+stats_collector.add(
+    "embedded_tokens", "Chunk tokens embedded since startup", (),
+    lambda: {(): ingestion_stats.stats()["tokens_embedded"]}
+)
+stats_collector.add(
+    "upstream_queued", "Upstream calls waiting for admission", ("api",),
+    lambda: {
+        (api,): scheduler.stats()["queued"]
+        for api, scheduler in upstream_schedulers()
+    }
+)
+stats_collector.add(
+    "upstream_shed", "Upstream calls shed or given up after rate limiting", ("api",),
+    lambda: {
+        (api,): scheduler.shed + scheduler.failures
+        for api, scheduler in upstream_schedulers()
+    }
+)
+stats_collector.add(
+    "index_jobs", "Indexing jobs in the queue by state", ("state",),
+    lambda: {(state,): count for state, count in job_runner.store.counts().items()}
+)
+stats_collector.add(
+    "endpoint_in_flight", "Requests holding an endpoint concurrency slot", ("endpoint",),
+    lambda: {(endpoint,): stats["in_flight"] for endpoint, stats in endpoint_limiter.stats().items()}
+)
+
+# Batch endpoint limits: items per request and concurrent model calls per batch
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+
+SAMPLE_DOCUMENT_TEXT = """
+            LangChain is a framework for developing applications powered by language models.
+            
+            Key Features:
+            1. Modular Components: LangChain provides modular components for working with language models.
+            2. Memory: Built-in memory systems for maintaining conversation context.
+            3. Chains: Combine multiple components to create complex workflows.
+            4. Agents: Create autonomous agents that can use tools and make decisions.
+            5. Document Loaders: Load documents from various sources (PDF, CSV, etc.).
+            6. Vector Stores: Store and retrieve embeddings for semantic search.
+            
+            Common Use Cases:
+            - Chatbots with memory
+            - Document question answering
+            - Code generation and analysis
+            - Content creation and summarization
+            - Data analysis and reporting
+            """
 
 # Pydantic models for requests and responses
+RetrievalMode = Literal["hybrid", "vector", "lexical"]
+IndexType = Literal["auto", "flat", "sq8", "pq", "ivf", "ivf_sq8", "ivf_pq", "hnsw"]
+EmbeddingBackend = Literal["openai", "hashing"]
+RETRIEVAL_MODE_DESCRIPTION = "Retrieval mode: hybrid (BM25 + vector), vector, or lexical (no query embedding); defaults to RETRIEVAL_MODE"
+COMPRESS_DESCRIPTION = "Rerank, MMR-filter and sentence-extract retrieved chunks under a token budget; defaults to RETRIEVAL_COMPRESSION"
+
 class ChatRequest(BaseModel):
     message: str = Field(..., description="User message")
     session_id: Optional[str] = Field(None, description="Session ID for conversation memory")
@@ -55,10 +229,35 @@ class ChatResponse(BaseModel):
 class DocumentQARequest(BaseModel):
     question: str = Field(..., description="Question about the document")
     document_text: Optional[str] = Field(None, description="Document text to analyze")
+    document_id: Optional[str] = Field(None, description="ID of a document indexed by a finished indexing job; used instead of document_text")
+    retrieval_mode: Optional[RetrievalMode] = Field(None, description=RETRIEVAL_MODE_DESCRIPTION)
+    compress: Optional[bool] = Field(None, description=COMPRESS_DESCRIPTION)
 
 class DocumentQAResponse(BaseModel):
     answer: str = Field(..., description="Answer to the question")
     question: str = Field(..., description="Original question")
+    compression: Optional[Dict[str, int]] = Field(None, description="Context tokens before and after compression, if it ran")
+
+class DocumentQABatchRequest(BaseModel):
+    questions: List[str] = Field(..., min_length=1, description="Questions about the document")
+    document_text: Optional[str] = Field(None, description="Document text to analyze")
+    retrieval_mode: Optional[RetrievalMode] = Field(None, description=RETRIEVAL_MODE_DESCRIPTION)
+    compress: Optional[bool] = Field(None, description=COMPRESS_DESCRIPTION)
+    max_concurrency: Optional[int] = Field(None, ge=1, description="Maximum concurrent model calls (capped by BATCH_MAX_CONCURRENCY)")
+    stream: bool = Field(False, description="Stream results as NDJSON in completion order")
+
+class DocumentQABatchItem(BaseModel):
+    index: int = Field(..., description="Position of the question in the request")
+    question: str = Field(..., description="Original question")
+    answer: Optional[str] = Field(None, description="Answer, if the question succeeded")
+    error: Optional[str] = Field(None, description="Error message, if the question failed")
+    cached: bool = Field(False, description="Whether the answer came from the response cache")
+    compression: Optional[Dict[str, int]] = Field(None, description="Context tokens before and after compression, if it ran")
+
+class DocumentQABatchResponse(BaseModel):
+    results: List[DocumentQABatchItem] = Field(..., description="Per-question results in request order")
+    succeeded: int = Field(..., description="Number of questions answered")
+    failed: int = Field(..., description="Number of questions that failed")
 
 class CodeAnalysisRequest(BaseModel):
     code: str = Field(..., description="Code to analyze")
@@ -68,6 +267,27 @@ class CodeAnalysisResponse(BaseModel):
     complexity: str = Field(..., description="Code complexity level")
     suggestions: List[str] = Field(..., description="Improvement suggestions")
     explanation: str = Field(..., description="What the code does")
+    metrics: Dict[str, Any] = Field(default_factory=dict, description="Locally computed size and complexity metrics")
+
+class CodeInsights(BaseModel):
+    suggestions: List[str] = Field(..., description="Improvement suggestions")
+    explanation: str = Field(..., description="What the code does")
+
+class CodeAnalysisBatchRequest(BaseModel):
+    items: List[CodeAnalysisRequest] = Field(..., min_length=1, description="Code snippets to analyze")
+    max_concurrency: Optional[int] = Field(None, ge=1, description="Maximum concurrent model calls (capped by BATCH_MAX_CONCURRENCY)")
+    stream: bool = Field(False, description="Stream results as NDJSON in completion order")
+
+class CodeAnalysisBatchItem(BaseModel):
+    index: int = Field(..., description="Position of the item in the request")
+    result: Optional[CodeAnalysisResponse] = Field(None, description="Analysis, if the item succeeded")
+    error: Optional[str] = Field(None, description="Error message, if the item failed")
+    cached: bool = Field(False, description="Whether the result came from the response cache")
+
+class CodeAnalysisBatchResponse(BaseModel):
+    results: List[CodeAnalysisBatchItem] = Field(..., description="Per-item results in request order")
+    succeeded: int = Field(..., description="Number of items that succeeded")
+    failed: int = Field(..., description="Number of items that failed")
 
 class CodeGenerationRequest(BaseModel):
     requirement: str = Field(..., description="Description of code to generate")
@@ -76,26 +296,544 @@ class CodeGenerationResponse(BaseModel):
     code: str = Field(..., description="Generated code")
     explanation: str = Field(..., description="Explanation of the generated code")
 
+class CollectionCreateRequest(BaseModel):
+    name: str = Field(..., description="Collection name (letters, digits, '-' and '_')")
+    index_type: Optional[IndexType] = Field(None, description="FAISS index type for queries; defaults to VECTOR_INDEX_TYPE (auto picks by collection size)")
+    embedding_backend: Optional[EmbeddingBackend] = Field(None, description="openai, or hashing for local vectors with no network calls; defaults to EMBEDDING_BACKEND")
+
+class CollectionDocument(BaseModel):
+    id: str = Field(..., description="Document ID; upserting an existing ID replaces the document")
+    text: str = Field(..., description="Document text")
+    metadata: Dict[str, Any] = Field(default_factory=dict, description="Metadata stored with each chunk")
+
+class CollectionUpsertRequest(BaseModel):
+    documents: List[CollectionDocument] = Field(..., description="Documents to add or replace")
+
+class CollectionQueryRequest(BaseModel):
+    question: str = Field(..., description="Question about the collection")
+    k: int = Field(4, ge=1, le=50, description="Number of chunks to retrieve")
+    retrieval_mode: Optional[RetrievalMode] = Field(None, description=RETRIEVAL_MODE_DESCRIPTION)
+
+class CollectionQueryResponse(BaseModel):
+    answer: str = Field(..., description="Answer to the question")
+    question: str = Field(..., description="Original question")
+    sources: List[Dict[str, Any]] = Field(..., description="Metadata of the retrieved chunks")
+
+class IndexJobRequest(BaseModel):
+    document_text: str = Field(..., min_length=1, description="Document text to index in the background")
+
+class IndexJobResponse(BaseModel):
+    job_id: str = Field(..., description="Job ID for polling")
+    status: Literal["queued", "running", "succeeded", "failed"] = Field(..., description="Job state")
+    document_id: str = Field(..., description="Pass as document_id to /document-qa once the job has succeeded")
+    progress: Dict[str, Any] = Field(..., description="Current stage, chunks_total and chunks_embedded")
+    result: Optional[Dict[str, Any]] = Field(None, description="Chunk and token counts once the job has succeeded")
+    error: Optional[str] = Field(None, description="Why the job failed")
+    attempts: int = Field(..., description="Times a worker has started the job")
+    created_at: float = Field(..., description="Submission time (Unix seconds)")
+    started_at: Optional[float] = Field(None, description="Start time of the latest attempt")
+    finished_at: Optional[float] = Field(None, description="Completion time")
+
 class HealthResponse(BaseModel):
     status: str = Field(..., description="API status")
     message: str = Field(..., description="Status message")
 
 # Initialize LangChain components
+def client_pool():
+    """Get the shared OpenAI clients; the SDKs are imported and the metrics callback installed on first use"""
+    from clients import get_client_pool
+    install_langchain_callbacks()
+    return get_client_pool()
+
+def existing_client_pool():
+    """Get the shared OpenAI clients if something has already created them, without importing the SDKs"""
+    if "clients" not in sys.modules:
+        return None
+    from clients import peek_client_pool
+    return peek_client_pool()
+
+def upstream_schedulers():
+    """The (api, scheduler) pairs of the shared clients, or none before the clients exist"""
+    pool = existing_client_pool()
+    if pool is None:
+        return []
+    return [("chat", pool.chat_scheduler), ("embeddings", pool.embedding_scheduler)]
+
+def existing_embedding_store():
+    """Get the shared embedding cache if OpenAI embeddings have already opened it (local backends have none)"""
+    if "embedding_cache" not in sys.modules:
+        return None
+    from embedding_cache import peek_embedding_store
+    return peek_embedding_store()
+
+def embedding_cache_ratio() -> Dict[tuple, float]:
+    """The embedding cache hit ratio gauge, once the cache is open"""
+    store = existing_embedding_store()
+    return {("embedding",): cache_hit_ratio(store.counters())} if store is not None else {}
+
+def embedding_stats() -> Dict[str, Any]:
+    """Stats of the default embeddings, without creating OpenAI clients or opening the cache to report them"""
+    if EMBEDDING_BACKEND != "openai":
+        return get_embeddings().stats()
+    store = existing_embedding_store()
+    if store is None:
+        return {"backend": "openai", "started": False}
+    return {"backend": "openai", "started": True, **store.stats()}
+
 def get_llm():
-    """Get OpenAI LLM instance"""
-    return ChatOpenAI(
-        model_name="gpt-3.5-turbo",
-        temperature=0.7,
-        openai_api_key=os.getenv("OPENAI_API_KEY")
-    )
+    """Get the shared OpenAI LLM instance"""
+    return client_pool().llm("gpt-3.5-turbo", temperature=0.7)
 
 def get_qa_llm():
-    """Get OpenAI LLM for Q&A with lower temperature"""
-    return ChatOpenAI(
-        model_name="gpt-3.5-turbo",
-        temperature=0,
-        openai_api_key=os.getenv("OPENAI_API_KEY")
+    """Get the shared OpenAI LLM for Q&A with lower temperature"""
+    return client_pool().llm("gpt-3.5-turbo", temperature=0)
+
+def get_embeddings(backend: Optional[str] = None, model: Optional[str] = None):
+    """Get the embeddings of a backend (EMBEDDING_BACKEND by default); OpenAI embeddings are backed by the persistent per-chunk cache"""
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "openai":
+        from embedding_cache import cache_embeddings
+        return cache_embeddings(client_pool().embeddings(model))
+    from embedding_backends import get_local_embeddings
+    return get_local_embeddings(backend)
+
+def collection_embeddings(name: str):
+    """Get the embeddings a collection was created with, whatever this deployment's default backend"""
+    manifest = collection_store.manifest(name)
+    backend = manifest.get("settings", {}).get("embedding_backend", "openai")
+    embeddings = get_embeddings(backend, manifest["embedding_model"] if backend == "openai" else None)
+    if embeddings.model != manifest["embedding_model"]:
+        raise CollectionError(
+            f"Collection '{name}' was indexed with {manifest['embedding_model']}, but this server embeds with {embeddings.model}"
+        )
+    return embeddings
+
+def create_text_splitter():
+    """Create the token-aware splitter used for document chunks (CHUNK_TOKENS / CHUNK_OVERLAP_TOKENS)"""
+    return create_token_splitter(CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS)
+
+def split_document(document_text: str):
+    """Split a document into deduplicated chunks plus chunk/token stats (CPU-bound; run on the worker pool)"""
+    chunks, stats = split_text(document_text, create_text_splitter())
+    return documents_from_chunks(chunks), stats
+
+async def build_vectorstore(document_text: str, embeddings) -> "FAISS":
+    """Split a document and index its chunks in a new FAISS vector store of the configured index type"""
+    from hybrid_retrieval import get_lexical_index
+    
+    with stage("split"):
+        texts, _ = await run_sync(split_document, document_text)
+    
+    # Embed asynchronously, then build the index on the worker pool
+    with stage("embedding"):
+        vectors = await embeddings.aembed_documents([doc.page_content for doc in texts])
+    with stage("faiss_build"):
+        vectorstore = await run_sync(
+            vectorstore_from_embeddings,
+            [doc.page_content for doc in texts],
+            vectors,
+            embeddings,
+            metadatas=[doc.metadata for doc in texts],
+        )
+    
+    # Build the BM25 index alongside the vector index
+    with stage("lexical_index"):
+        await run_sync(get_lexical_index, vectorstore)
+    return vectorstore
+
+def cache_hit_ratio(stats: Dict[str, Any]) -> float:
+    """Hit ratio from a stats dict with hits, misses and optional disk_hits counters"""
+    hits = stats["hits"] + stats.get("disk_hits", 0)
+    total = hits + stats["misses"]
+    return hits / total if total else 0.0
+
+def document_cache_key(document_text: str, embeddings) -> str:
+    """Content-addressed key for a document and the settings used to index it"""
+    return make_cache_key(
+        document_text,
+        **splitter_settings(CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS),
+        **index_settings(),
+        embedding_model=embeddings.model,
+    )
+
+def document_qa_scope(llm, document_key: str, retrieval_mode: str, compress: bool) -> str:
+    """Semantic-cache scope for document Q&A: the exact key without the question, so both tiers agree on what may be reused"""
+    return response_cache.make_key(
+        "document_qa", llm.model_name, llm.temperature,
+        document=document_key,
+        retrieval_mode=retrieval_mode,
+        compress=compress
+    )
+
+async def get_document_vectorstore(document_text: str) -> "FAISS":
+    """Get the vector store for a document, building it only on a cache miss"""
+    embeddings = get_embeddings()
+    cache_key = document_cache_key(document_text, embeddings)
+    # Concurrent first requests for a document wait on one build; the store itself stays per worker
+    vectorstore, _ = await single_flight.do(
+        f"vectorstore:{cache_key}",
+        lambda: vectorstore_cache.aget_or_build(
+            cache_key,
+            lambda: build_vectorstore(document_text, embeddings),
+            embeddings=embeddings,
+        ),
+        local_only=True,
     )
+    return vectorstore
+
+async def get_indexed_vectorstore(document_id: str) -> "FAISS":
+    """Get the vector store an indexing job built, loading it memory-mapped on first use"""
+    vectorstore = vectorstore_cache.get(document_id)
+    if vectorstore is None:
+        vectorstore = await run_sync(job_runner.load_index, document_id, get_embeddings())
+        vectorstore_cache.put(document_id, vectorstore, persist=False)
+    return vectorstore
+
+async def run_document_index_job(job: Dict[str, Any], report) -> Dict[str, Any]:
+    """Split, embed and index a submitted document, reporting the chunks embedded as it goes
+
+    Splitting and index building run on the job process pool. A shed or
+    rate-limited embedding call puts the job back in the queue; chunks
+    embedded before that are in the embedding cache, so the retry skips them.
+    """
+    import numpy as np
+    
+    document_id = job["dedupe_key"]
+    if job_runner.has_index(document_id):
+        return {"document_id": document_id, "reused": True}
+    
+    # Indexing yields upstream capacity to interactive requests
+    set_request_priority("batch")
+    embeddings = get_embeddings()
+    
+    await report({"stage": "splitting", "chunks_total": None, "chunks_embedded": 0})
+    with stage("split"):
+        chunks, stats = await job_runner.run_in_process(
+            split_for_index, job["payload"]["document_text"], CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS
+        )
+    if not chunks:
+        raise ValueError("Document has no text to index")
+    ingestion_stats.record(stats)
+    
+    progress = {"stage": "embedding", "chunks_total": len(chunks), "chunks_embedded": 0}
+    await report(progress)
+    vectors = []
+    with stage("embedding"):
+        for start in range(0, len(chunks), JOBS_EMBED_BATCH):
+            try:
+                vectors.extend(await embeddings.aembed_documents(chunks[start:start + JOBS_EMBED_BATCH]))
+            except UpstreamUnavailable as e:
+                raise RetryJob(str(e), e.retry_after)
+            progress["chunks_embedded"] = len(vectors)
+            await report(progress)
+    
+    await report({**progress, "stage": "indexing"})
+    with stage("faiss_build"):
+        await job_runner.run_in_process(
+            write_index,
+            job_runner.index_path(document_id),
+            chunks,
+            [doc.metadata for doc in documents_from_chunks(chunks)],
+            np.asarray(vectors, dtype=np.float32),
+        )
+    await report({**progress, "stage": "done"})
+    return {"document_id": document_id, "reused": False, **stats}
+
+job_runner.register("document_index", run_document_index_job)
+
+def index_job_response(job: Dict[str, Any]) -> IndexJobResponse:
+    """Public view of a document indexing job"""
+    return IndexJobResponse(
+        document_id=job["dedupe_key"],
+        **{key: value for key, value in job.items() if key in IndexJobResponse.model_fields}
+    )
+
+def create_qa_chain(vectorstore: "FAISS", llm, retrieval_mode: Optional[str] = None, compress: Optional[bool] = None) -> "RetrievalQA":
+    """Create a RetrievalQA chain over a vector store using hybrid, vector or lexical retrieval
+
+    With compression, retrieved chunks are cut down locally before they are
+    stuffed into the prompt; the source documents record the tokens saved.
+    """
+    from langchain.chains import RetrievalQA
+    from context_compression import COMPRESSION_ENABLED, ContextCompressor
+    from hybrid_retrieval import DEFAULT_RETRIEVAL_MODE, HybridRetriever
+    
+    compress = COMPRESSION_ENABLED if compress is None else compress
+    return RetrievalQA.from_chain_type(
+        llm=llm,
+        chain_type="stuff",
+        retriever=HybridRetriever(
+            vectorstore=vectorstore,
+            mode=retrieval_mode or DEFAULT_RETRIEVAL_MODE,
+            compressor=ContextCompressor() if compress else None
+        ),
+        return_source_documents=True
+    )
+
+async def answer_question(vectorstore: "FAISS", llm, question: str, retrieval_mode: Optional[str] = None, compress: Optional[bool] = None):
+    """Answer a question with a RetrievalQA chain; returns the answer and the compression report"""
+    from context_compression import compression_report
+    result = await create_qa_chain(vectorstore, llm, retrieval_mode, compress).ainvoke({"query": question})
+    return result["result"], compression_report(result["source_documents"])
+
+async def cached_document_answer(
+    response: Response,
+    llm,
+    embeddings,
+    document_key: str,
+    question: str,
+    retrieval_mode: str,
+    compress: bool,
+    load_vectorstore: Callable[[], Awaitable["FAISS"]],
+) -> Tuple[str, Optional[dict]]:
+    """Answer a document question through the response cache and single-flight; sets the X-Cache headers
+
+    ``load_vectorstore`` is only called when the answer is neither cached nor already being computed.
+    """
+    # Deterministic requests are identified by model, document, question and retrieval settings
+    request_key = None
+    if llm.temperature == 0:
+        request_key = response_cache.make_key(
+            "document_qa", llm.model_name, llm.temperature,
+            document=document_key,
+            question=normalize_text(question).lower(),
+            retrieval_mode=retrieval_mode,
+            compress=compress
+        )
+    semantic_scope = document_qa_scope(llm, document_key, retrieval_mode, compress)
+    
+    # Answer from the response cache when possible
+    cache_key = None
+    question_vector = None
+    if response_cache.is_enabled("document_qa") and request_key is not None:
+        cache_key = request_key
+        answer = response_cache.get("document_qa", cache_key)
+        if answer is not None:
+            response.headers["X-Cache"] = "HIT"
+            return answer, None
+        
+        # Lexical retrieval never embeds the question, so it skips the semantic tier
+        if response_cache.is_semantic("document_qa") and retrieval_mode != "lexical":
+            # The query embedding is cached, so retrieval below reuses it
+            question_vector = await embeddings.aembed_query(question)
+            match = response_cache.search("document_qa", semantic_scope, question_vector)
+            if match is not None:
+                answer, similarity = match
+                response.headers["X-Cache"] = "SEMANTIC-HIT"
+                response.headers["X-Cache-Similarity"] = f"{similarity:.4f}"
+                return answer, None
+        
+        response_cache.miss("document_qa")
+    
+    async def run_qa():
+        async with endpoint_limiter.limit("document_qa"):
+            vectorstore = await load_vectorstore()
+            return await answer_question(vectorstore, llm, question, retrieval_mode, compress)
+    
+    # Identical questions already in flight share one retrieval and model call
+    (answer, compression), coalesced = await single_flight.do(
+        request_key, run_qa,
+        encode=list,
+        decode=tuple
+    )
+    if coalesced:
+        response.headers["X-Coalesced"] = "1"
+    
+    if cache_key is not None:
+        response_cache.put(cache_key, answer, scope=semantic_scope, vector=question_vector)
+        response.headers["X-Cache"] = "MISS"
+    else:
+        response.headers["X-Cache"] = "BYPASS"
+    return answer, compression
+
+def upstream_http_error(error: UpstreamUnavailable) -> HTTPException:
+    """Map a shed or rate-limited upstream call to 503 with a Retry-After hint"""
+    return HTTPException(
+        status_code=503,
+        detail=str(error),
+        headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))}
+    )
+
+def collection_http_error(error: CollectionError) -> HTTPException:
+    """Map collection errors to HTTP errors"""
+    if isinstance(error, CollectionNotFound):
+        return HTTPException(status_code=404, detail=str(error))
+    if isinstance(error, CollectionExists):
+        return HTTPException(status_code=409, detail=str(error))
+    return HTTPException(status_code=400, detail=str(error))
+
+async def load_chat_session(session_id: str) -> "ConversationChain":
+    """Build a conversation for a session from its stored history and summary"""
+    from langchain.chains import ConversationChain
+    from langchain.memory import ConversationBufferMemory
+    from langchain_core.chat_history import InMemoryChatMessageHistory
+    
+    record = await run_sync(conversation_sessions.get, session_id) or new_record()
+    memory = ConversationBufferMemory(
+        chat_memory=InMemoryChatMessageHistory(messages=build_history(record))
+    )
+    return ConversationChain(
+        llm=get_llm(),
+        memory=memory,
+        verbose=False
+    )
+
+async def save_chat_turn(session_id: str, message: str, response: str) -> None:
+    """Append a turn to the session history"""
+    await run_sync(append_turn, conversation_sessions, session_id, message, response)
+
+async def compact_chat_session(session_id: str) -> None:
+    """Fold old turns into the session summary once the session is over its token budget"""
+    await compact_session(conversation_sessions, session_id, get_qa_llm())
+
+# Prompts and parsers are immutable, so they are built once, when the first chain needs them
+@lru_cache(maxsize=None)
+def code_analysis_prompt():
+    """Build the code analysis prompt and its output parser"""
+    from langchain_core.output_parsers import PydanticOutputParser
+    from langchain_core.prompts import ChatPromptTemplate
+    
+    parser = PydanticOutputParser(pydantic_object=CodeInsights)
+    # Language and complexity come from the local analyzer, so the model only writes insights
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", """You are an expert code reviewer and programmer. 
+    The code is {language} with {complexity} complexity (cyclomatic complexity {cyclomatic_complexity}).
+    Provide:
+    1. Up to 5 concise improvement suggestions
+    2. A brief explanation of what the code does
+    
+    {format_instructions}"""),
+        ("user", "Analyze this code:\n{code}")
+    ]).partial(format_instructions=parser.get_format_instructions())
+    return prompt, parser
+
+@lru_cache(maxsize=None)
+def code_generation_prompt():
+    """Build the code generation prompt"""
+    from langchain_core.prompts import ChatPromptTemplate
+    
+    return ChatPromptTemplate.from_messages([
+        ("system", "You are an expert programmer. Generate clean, well-documented code based on the user's requirements. Also provide a brief explanation of what the code does."),
+        ("user", "Generate code for: {requirement}")
+    ])
+
+def pre_analyze_code(inputs: Dict[str, Any]) -> Dict[str, Any]:
+    """Run the local analyzer and expose its results as prompt variables"""
+    analysis = analyze_code_locally(inputs["code"])
+    return {
+        "code": inputs["code"],
+        "analysis": analysis,
+        "language": analysis["language"],
+        "complexity": analysis["complexity"],
+        "cyclomatic_complexity": analysis["metrics"]["cyclomatic_complexity"],
+    }
+
+def combine_code_analysis(inputs: Dict[str, Any]) -> CodeAnalysisResponse:
+    """Merge the local analysis with the model's insights"""
+    return CodeAnalysisResponse(**inputs["analysis"], **inputs["insights"].model_dump())
+
+def build_code_analysis_chain(llm):
+    """Compose the code analysis chain: local pre-analysis, then prompt | llm | parser for the rest"""
+    from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+    
+    prompt, parser = code_analysis_prompt()
+    return (
+        RunnableLambda(pre_analyze_code)
+        | RunnablePassthrough.assign(insights=prompt | llm | parser)
+        | RunnableLambda(combine_code_analysis)
+    )
+
+def build_code_generation_chain(llm):
+    """Compose the prompt | llm chain used for code generation"""
+    return code_generation_prompt() | llm
+
+chain_registry.register("code_analysis", build_code_analysis_chain, default_llm=lambda: get_qa_llm())
+chain_registry.register("code_generation", build_code_generation_chain, default_llm=lambda: get_llm())
+
+def code_analysis_request_key(llm, code: str) -> Optional[str]:
+    """Key identifying a deterministic analysis request, or None above temperature 0"""
+    if llm.temperature != 0:
+        return None
+    return response_cache.make_key(
+        "code_analyze", llm.model_name, llm.temperature,
+        code=normalize_code(code)
+    )
+
+def code_analysis_cache_key(llm, code: str) -> Optional[str]:
+    """Response cache key for a snippet, or None when caching does not apply"""
+    if not response_cache.is_enabled("code_analyze"):
+        return None
+    return code_analysis_request_key(llm, code)
+
+def batch_config(requested: Optional[int]) -> Dict[str, Any]:
+    """Runnable config bounding how many batch items call the model at once"""
+    return {"max_concurrency": min(requested or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)}
+
+def check_batch_size(count: int) -> None:
+    """Reject batches over BATCH_MAX_ITEMS"""
+    if count > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_ITEMS} items")
+
+async def run_batch(chain, inputs: List[Dict[str, Any]], config: Dict[str, Any], stream: bool):
+    """Yield (position, output or exception) for each input
+
+    Without streaming this is a single ``abatch`` call and results come back in
+    input order; with streaming they are yielded as each item completes.
+    """
+    if not inputs:
+        return
+    if stream:
+        async for position, output in chain.abatch_as_completed(inputs, config=config, return_exceptions=True):
+            yield position, output
+    else:
+        outputs = await chain.abatch(inputs, config=config, return_exceptions=True)
+        for position, output in enumerate(outputs):
+            yield position, output
+
+def ndjson_line(data: Dict[str, Any]) -> str:
+    """Format one line of newline-delimited JSON"""
+    return json.dumps(data) + "\n"
+
+def parse_generated_code(content: str) -> "CodeGenerationResponse":
+    """Separate the code block from the explanation in a model response"""
+    lines = content.split('\n')
+    
+    # Try to find code block
+    code_lines = []
+    explanation_lines = []
+    in_code_block = False
+    
+    for line in lines:
+        if '```' in line:
+            in_code_block = not in_code_block
+            continue
+        if in_code_block:
+            code_lines.append(line)
+        else:
+            explanation_lines.append(line)
+    
+    code = '\n'.join(code_lines).strip()
+    explanation = '\n'.join(explanation_lines).strip()
+    
+    if not code:
+        # If no code block found, treat everything as code
+        code = content
+        explanation = "Generated code based on your requirements."
+    
+    return CodeGenerationResponse(
+        code=code,
+        explanation=explanation
+    )
+
+def sse_event(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """Format a Server-Sent Event"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
 
 # API Endpoints
 
@@ -113,210 +851,686 @@ async def get_ui():
     return FileResponse("static/index.html")
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, background_tasks: BackgroundTasks):
     """Chat with AI using conversation memory"""
+    set_request_priority("interactive")
     try:
         # Get or create session
         session_id = request.session_id or str(uuid.uuid4())
         
-        if session_id not in conversation_sessions:
-            # Create new conversation
-            llm = get_llm()
-            memory = ConversationBufferMemory()
-            conversation = ConversationChain(
-                llm=llm,
-                memory=memory,
-                verbose=False
-            )
-            conversation_sessions[session_id] = conversation
-        else:
-            conversation = conversation_sessions[session_id]
+        conversation = await load_chat_session(session_id)
         
         # Get response
-        response = conversation.predict(input=request.message)
+        async with endpoint_limiter.limit("chat"):
+            response = await conversation.apredict(input=request.message)
+        
+        await save_chat_turn(session_id, request.message, response)
+        if MEMORY_MODE == "summary":
+            background_tasks.add_task(compact_chat_session, session_id)
         
         return ChatResponse(
             response=response,
             session_id=session_id
         )
     
+    except UpstreamUnavailable as e:
+        raise upstream_http_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, background_tasks: BackgroundTasks):
+    """Chat with AI, streaming tokens as Server-Sent Events"""
+    set_request_priority("interactive")
+    session_id = request.session_id or str(uuid.uuid4())
+    
+    async def event_stream():
+        try:
+            yield sse_event({"session_id": session_id}, event="start")
+            conversation = await load_chat_session(session_id)
+            
+            # Format the conversation prompt with the current history
+            inputs = conversation.prep_inputs({"input": request.message})
+            prompt_value = conversation.prompt.format_prompt(
+                **{key: inputs[key] for key in conversation.prompt.input_variables}
+            )
+            
+            async with endpoint_limiter.limit("chat"):
+                response = ""
+                async for chunk in conversation.llm.astream(prompt_value):
+                    if chunk.content:
+                        response += chunk.content
+                        yield sse_event({"token": chunk.content})
+            
+            # Update session memory once the full response is known
+            await save_chat_turn(session_id, request.message, response)
+            yield sse_event({"response": response, "session_id": session_id}, event="done")
+        
+        except UpstreamUnavailable as e:
+            yield sse_event({"detail": str(e), "retry_after": e.retry_after}, event="error")
+        except Exception as e:
+            yield sse_event({"detail": f"Chat error: {str(e)}"}, event="error")
+    
+    # Runs after the stream has finished and the turn has been saved
+    if MEMORY_MODE == "summary":
+        background_tasks.add_task(compact_chat_session, session_id)
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @app.post("/chat/reset/{session_id}")
 async def reset_chat_session(session_id: str):
     """Reset a chat session (clear memory)"""
     try:
-        if session_id in conversation_sessions:
-            del conversation_sessions[session_id]
+        await run_sync(conversation_sessions.delete, session_id)
         return {"message": f"Session {session_id} reset successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Reset error: {str(e)}")
 
 @app.post("/document-qa", response_model=DocumentQAResponse)
-async def document_qa(request: DocumentQARequest):
+async def document_qa(request: DocumentQARequest, response: Response):
     """Ask questions about documents"""
+    from context_compression import COMPRESSION_ENABLED
+    from hybrid_retrieval import DEFAULT_RETRIEVAL_MODE
+    
     try:
-        # Create sample document if no text provided
-        if not request.document_text:
-            sample_text = """
-            LangChain is a framework for developing applications powered by language models.
-            
-            Key Features:
-            1. Modular Components: LangChain provides modular components for working with language models.
-            2. Memory: Built-in memory systems for maintaining conversation context.
-            3. Chains: Combine multiple components to create complex workflows.
-            4. Agents: Create autonomous agents that can use tools and make decisions.
-            5. Document Loaders: Load documents from various sources (PDF, CSV, etc.).
-            6. Vector Stores: Store and retrieve embeddings for semantic search.
-            
-            Common Use Cases:
-            - Chatbots with memory
-            - Document question answering
-            - Code generation and analysis
-            - Content creation and summarization
-            - Data analysis and reporting
-            """
-            document_text = sample_text
+        # Use sample document if no text provided
+        document_text = request.document_text or SAMPLE_DOCUMENT_TEXT
+        retrieval_mode = request.retrieval_mode or DEFAULT_RETRIEVAL_MODE
+        
+        llm = get_qa_llm()
+        embeddings = get_embeddings()
+        if request.document_id is not None:
+            # Indexed by a background job; its ID is the document's cache key
+            if not job_runner.has_index(request.document_id):
+                raise HTTPException(status_code=404, detail=f"No finished index for document '{request.document_id}'")
+            document_key = request.document_id
         else:
-            document_text = request.document_text
+            document_key = document_cache_key(document_text, embeddings)
         
-        # Create temporary file
-        temp_file = f"temp_doc_{uuid.uuid4()}.txt"
-        with open(temp_file, "w") as f:
-            f.write(document_text)
+        compress = request.compress if request.compress is not None else COMPRESSION_ENABLED
         
-        try:
-            # Load and process document
-            loader = TextLoader(temp_file)
-            documents = loader.load()
+        async def load_vectorstore():
+            # Reuse the vector store when this document was already indexed
+            if request.document_id is not None:
+                return await get_indexed_vectorstore(request.document_id)
+            return await get_document_vectorstore(document_text)
+        
+        answer, compression = await cached_document_answer(
+            response, llm, embeddings, document_key, request.question, retrieval_mode, compress, load_vectorstore
+        )
+        
+        return DocumentQAResponse(
+            answer=answer,
+            question=request.question,
+            compression=compression
+        )
+    
+    except HTTPException:
+        raise
+    except UpstreamUnavailable as e:
+        raise upstream_http_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Document Q&A error: {str(e)}")
+
+@app.post("/document-qa/batch", response_model=DocumentQABatchResponse)
+async def document_qa_batch(request: DocumentQABatchRequest):
+    """Ask many questions about one document, indexing it only once"""
+    from context_compression import COMPRESSION_ENABLED, compression_report
+    from hybrid_retrieval import DEFAULT_RETRIEVAL_MODE
+    
+    check_batch_size(len(request.questions))
+    # Batch work yields to interactive requests when upstream calls queue
+    set_request_priority("batch")
+    try:
+        document_text = request.document_text or SAMPLE_DOCUMENT_TEXT
+        retrieval_mode = request.retrieval_mode or DEFAULT_RETRIEVAL_MODE
+        
+        llm = get_qa_llm()
+        embeddings = get_embeddings()
+        document_key = document_cache_key(document_text, embeddings)
+        compress = request.compress if request.compress is not None else COMPRESSION_ENABLED
+        semantic_scope = document_qa_scope(llm, document_key, retrieval_mode, compress)
+        
+        # Answer what the response cache already knows
+        items: List[Optional[DocumentQABatchItem]] = [None] * len(request.questions)
+        cache_keys: List[Optional[str]] = [None] * len(request.questions)
+        question_vectors: List[Optional[List[float]]] = [None] * len(request.questions)
+        if response_cache.is_enabled("document_qa") and llm.temperature == 0:
+            for index, question in enumerate(request.questions):
+                cache_keys[index] = response_cache.make_key(
+                    "document_qa", llm.model_name, llm.temperature,
+                    document=document_key,
+                    question=normalize_text(question).lower(),
+                    retrieval_mode=retrieval_mode,
+                    compress=compress
+                )
+                answer = response_cache.get("document_qa", cache_keys[index])
+                if answer is not None:
+                    items[index] = DocumentQABatchItem(index=index, question=question, answer=answer, cached=True)
             
-            # Split documents
-            text_splitter = CharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200
+            if response_cache.is_semantic("document_qa") and retrieval_mode != "lexical":
+                missing = [index for index, item in enumerate(items) if item is None]
+                vectors = await asyncio.gather(*(embeddings.aembed_query(request.questions[index]) for index in missing))
+                for index, vector in zip(missing, vectors):
+                    question_vectors[index] = vector
+                    match = response_cache.search("document_qa", semantic_scope, vector)
+                    if match is not None:
+                        items[index] = DocumentQABatchItem(
+                            index=index, question=request.questions[index], answer=match[0], cached=True
+                        )
+        
+        pending = [index for index, item in enumerate(items) if item is None]
+        for index in pending:
+            if cache_keys[index] is not None:
+                response_cache.miss("document_qa")
+        
+        def finish(position: int, output) -> DocumentQABatchItem:
+            index = pending[position]
+            question = request.questions[index]
+            if isinstance(output, Exception):
+                return DocumentQABatchItem(index=index, question=question, error=str(output))
+            answer = output["result"]
+            if cache_keys[index] is not None:
+                response_cache.put(cache_keys[index], answer, scope=semantic_scope, vector=question_vectors[index])
+            return DocumentQABatchItem(
+                index=index, question=question, answer=answer,
+                compression=compression_report(output["source_documents"])
             )
-            texts = text_splitter.split_documents(documents)
-            
-            # Create embeddings and vector store
-            embeddings = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
-            vectorstore = FAISS.from_documents(texts, embeddings)
+        
+        # Build (or reuse) the index once for every question in the batch
+        chain = None
+        if pending:
+            vectorstore = await get_document_vectorstore(document_text)
+            chain = create_qa_chain(vectorstore, llm, retrieval_mode, request.compress)
+        inputs = [{"query": request.questions[index]} for index in pending]
+        config = batch_config(request.max_concurrency)
+        
+        if request.stream:
+            async def generate():
+                for item in items:
+                    if item is not None:
+                        yield ndjson_line(item.model_dump())
+                try:
+                    async with endpoint_limiter.limit("document_qa_batch"):
+                        async for position, output in run_batch(chain, inputs, config, stream=True):
+                            yield ndjson_line(finish(position, output).model_dump())
+                except Exception as e:
+                    yield ndjson_line({"error": f"Batch document Q&A error: {str(e)}"})
             
-            # Create QA chain
-            llm = get_qa_llm()
-            qa_chain = RetrievalQA.from_chain_type(
-                llm=llm,
-                chain_type="stuff",
-                retriever=vectorstore.as_retriever()
+            return StreamingResponse(generate(), media_type="application/x-ndjson")
+        
+        async with endpoint_limiter.limit("document_qa_batch"):
+            async for position, output in run_batch(chain, inputs, config, stream=False):
+                items[pending[position]] = finish(position, output)
+        
+        failed = sum(1 for item in items if item.error is not None)
+        return DocumentQABatchResponse(results=items, succeeded=len(items) - failed, failed=failed)
+    
+    except HTTPException:
+        raise
+    except UpstreamUnavailable as e:
+        raise upstream_http_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch document Q&A error: {str(e)}")
+
+@app.post("/document-qa/upload", response_model=DocumentQAResponse)
+async def document_qa_upload(request: Request, response: Response):
+    """Ask a question about a document sent as a streamed multipart upload
+
+    Form fields: ``file`` (the document), ``question`` and the optional
+    ``retrieval_mode`` and ``compress``. The upload is split and embedded
+    incrementally while it is still being received; answers go through the
+    same response cache and single-flight as ``/document-qa``.
+    """
+    from context_compression import COMPRESSION_ENABLED
+    from hybrid_retrieval import DEFAULT_RETRIEVAL_MODE, RETRIEVAL_MODES, get_lexical_index
+    
+    try:
+        embeddings = get_embeddings()
+        
+        async with endpoint_limiter.limit("document_qa"):
+            # The streaming window is measured in characters, at roughly 4 per token
+            splitter = IncrementalSplitter(
+                create_text_splitter(), CHUNK_TOKENS * 4, deduplicator=ChunkDeduplicator()
             )
+            with stage("ingest"):
+                upload = await ingest_multipart_upload(request, embeddings, splitter)
+            
+            question = upload.fields.get("question", "").strip()
+            if not question:
+                raise HTTPException(status_code=400, detail="Missing form field 'question'")
+            retrieval_mode = upload.fields.get("retrieval_mode") or DEFAULT_RETRIEVAL_MODE
+            if retrieval_mode not in RETRIEVAL_MODES:
+                raise HTTPException(status_code=400, detail="retrieval_mode must be 'hybrid', 'vector' or 'lexical'")
+            compress_field = upload.fields.get("compress", "").strip().lower()
+            if compress_field not in ("", "true", "false", "1", "0"):
+                raise HTTPException(status_code=400, detail="compress must be 'true' or 'false'")
+            compress = compress_field in ("true", "1") if compress_field else COMPRESSION_ENABLED
+            if not upload.chunks:
+                raise HTTPException(status_code=400, detail="Uploaded document is empty")
             
-            # Get answer
-            answer = qa_chain.run(request.question)
+            ingestion_stats.record(await run_sync(chunk_stats, upload.chunks, splitter.deduplicator))
             
-            return DocumentQAResponse(
-                answer=answer,
-                question=request.question
+            cache_key = make_cache_key(
+                upload.content_hash,
+                **splitter_settings(CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS),
+                **index_settings(),
+                streamed=True,
+                embedding_model=embeddings.model,
             )
         
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
+        async def build_from_upload():
+            metadata = {"source": upload.filename or "upload"}
+            with stage("faiss_build"):
+                vectorstore = await run_sync(
+                    vectorstore_from_embeddings,
+                    upload.chunks,
+                    upload.vectors,
+                    embeddings,
+                    metadatas=[dict(metadata) for _ in upload.chunks],
+                )
+            with stage("lexical_index"):
+                await run_sync(get_lexical_index, vectorstore)
+            return vectorstore
+        
+        async def load_vectorstore():
+            return await vectorstore_cache.aget_or_build(cache_key, build_from_upload, embeddings=embeddings)
+        
+        # The upload's index key stands in for the document key, so repeated uploads reuse cached answers
+        answer, compression = await cached_document_answer(
+            response, get_qa_llm(), embeddings, cache_key, question, retrieval_mode, compress, load_vectorstore
+        )
+        return DocumentQAResponse(answer=answer, question=question, compression=compression)
     
+    except HTTPException:
+        raise
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except UpstreamUnavailable as e:
+        raise upstream_http_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Document Q&A error: {str(e)}")
 
+@app.get("/document-qa/cache")
+async def document_qa_cache_stats():
+    """Show vector store, embedding cache and chunking statistics"""
+    return {
+        "vectorstores": vectorstore_cache.stats(),
+        "embeddings": embedding_stats(),
+        "ingestion": ingestion_stats.stats(),
+        "vector_index": index_settings(),
+    }
+
+@app.post("/document-qa/jobs", response_model=IndexJobResponse, status_code=202)
+async def submit_index_job(request: IndexJobRequest):
+    """Queue a document for background indexing and return the job to poll"""
+    try:
+        document_id = document_cache_key(request.document_text, get_embeddings())
+        
+        # Resubmitting a document returns its queued, running or finished job
+        job = await job_runner.submit(
+            "document_index",
+            {"document_text": request.document_text},
+            dedupe_key=document_id,
+            progress={"stage": "queued", "chunks_total": None, "chunks_embedded": 0}
+        )
+        return index_job_response(job)
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Index job error: {str(e)}")
+
+@app.get("/document-qa/jobs")
+async def list_index_jobs(limit: int = 50):
+    """List recent indexing jobs with queue counts"""
+    jobs = await run_sync(job_runner.store.list, limit)
+    return {
+        "jobs": [index_job_response(job) for job in jobs],
+        "runner": await run_sync(job_runner.stats),
+    }
+
+@app.get("/document-qa/jobs/{job_id}", response_model=IndexJobResponse)
+async def get_index_job(job_id: str):
+    """Report an indexing job's state, progress in chunks embedded, and result"""
+    job = await run_sync(job_runner.store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return index_job_response(job)
+
+@app.post("/collections")
+async def create_collection(request: CollectionCreateRequest):
+    """Create an empty document collection"""
+    try:
+        embedding_backend = request.embedding_backend or EMBEDDING_BACKEND
+        return await run_sync(
+            collection_store.create, request.name, get_embeddings(embedding_backend).model,
+            **splitter_settings(CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS),
+            index_type=request.index_type or index_settings()["index_type"],
+            embedding_backend=embedding_backend
+        )
+    except CollectionError as e:
+        raise collection_http_error(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/collections")
+async def list_collections():
+    """List document collections"""
+    return {"collections": await run_sync(collection_store.list)}
+
+@app.get("/collections/{name}")
+async def get_collection(name: str):
+    """Describe a document collection"""
+    try:
+        return await run_sync(collection_store.describe, name)
+    except CollectionError as e:
+        raise collection_http_error(e)
+
+@app.delete("/collections/{name}")
+async def delete_collection(name: str):
+    """Delete a document collection and its index"""
+    try:
+        await run_sync(collection_store.delete, name)
+        return {"message": f"Collection {name} deleted successfully"}
+    except CollectionError as e:
+        raise collection_http_error(e)
+
+@app.post("/collections/{name}/documents")
+async def upsert_collection_documents(name: str, request: CollectionUpsertRequest):
+    """Add or replace documents in a collection, updating its index incrementally"""
+    try:
+        if not await run_sync(collection_store.exists, name):
+            raise CollectionNotFound(f"Collection '{name}' not found")
+        # Fail before paying to embed anything
+        check_unique_ids([document.id for document in request.documents])
+        embeddings = await run_sync(collection_embeddings, name)
+        
+        async with endpoint_limiter.limit("collections"):
+            # Split every document, then embed all new chunks together
+            split = [await run_sync(split_document, document.text) for document in request.documents]
+            chunked = [chunks for chunks, _ in split]
+            texts = [chunk.page_content for chunks in chunked for chunk in chunks]
+            vectors = await embeddings.aembed_documents(texts) if texts else []
+            
+            documents = []
+            offset = 0
+            for document, chunks in zip(request.documents, chunked):
+                documents.append({
+                    "id": document.id,
+                    "chunks": [chunk.page_content for chunk in chunks],
+                    "vectors": vectors[offset:offset + len(chunks)],
+                    "metadata": document.metadata,
+                })
+                offset += len(chunks)
+            
+            result = await run_sync(collection_store.upsert, name, documents)
+            result["ingestion"] = [
+                {"id": document.id, **stats} for document, (_, stats) in zip(request.documents, split)
+            ]
+            return result
+    
+    except CollectionError as e:
+        raise collection_http_error(e)
+    except UpstreamUnavailable as e:
+        raise upstream_http_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Collection error: {str(e)}")
+
+@app.delete("/collections/{name}/documents/{document_id}")
+async def delete_collection_document(name: str, document_id: str):
+    """Remove a document from a collection"""
+    try:
+        removed = await run_sync(collection_store.delete_document, name, document_id)
+        return {"message": f"Document {document_id} deleted successfully", "chunks_removed": removed}
+    except CollectionError as e:
+        raise collection_http_error(e)
+
+@app.post("/collections/{name}/query", response_model=CollectionQueryResponse)
+async def query_collection(name: str, request: CollectionQueryRequest):
+    """Ask a question about the documents in a collection"""
+    from langchain.chains import RetrievalQA
+    from hybrid_retrieval import DEFAULT_RETRIEVAL_MODE, HybridRetriever
+    
+    try:
+        async with endpoint_limiter.limit("collections"):
+            embeddings = await run_sync(collection_embeddings, name)
+            vectorstore = await run_sync(collection_store.load, name, embeddings)
+            if vectorstore is None:
+                raise HTTPException(status_code=400, detail=f"Collection '{name}' has no documents")
+            
+            qa_chain = RetrievalQA.from_chain_type(
+                llm=get_qa_llm(),
+                chain_type="stuff",
+                retriever=HybridRetriever(
+                    vectorstore=vectorstore,
+                    mode=request.retrieval_mode or DEFAULT_RETRIEVAL_MODE,
+                    k=request.k
+                ),
+                return_source_documents=True
+            )
+            result = await qa_chain.ainvoke({"query": request.question})
+        
+        return CollectionQueryResponse(
+            answer=result["result"],
+            question=request.question,
+            sources=[doc.metadata for doc in result["source_documents"]]
+        )
+    
+    except HTTPException:
+        raise
+    except CollectionError as e:
+        raise collection_http_error(e)
+    except UpstreamUnavailable as e:
+        raise upstream_http_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Collection query error: {str(e)}")
+
 @app.post("/code/analyze", response_model=CodeAnalysisResponse)
-async def analyze_code(request: CodeAnalysisRequest):
+async def analyze_code(request: CodeAnalysisRequest, response: Response):
     """Analyze code and provide insights"""
     try:
         llm = get_qa_llm()
         
-        # Create output parser
-        parser = PydanticOutputParser(pydantic_object=CodeAnalysisResponse)
-        
-        # Create prompt template
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are an expert code reviewer and programmer. 
-            Analyze the provided code and provide insights about:
-            1. Programming language
-            2. Code complexity (simple, moderate, complex)
-            3. Improvement suggestions
-            4. What the code does
-            
-            {format_instructions}"""),
-            ("user", "Analyze this code:\n{code}")
-        ])
+        # Identical snippets at temperature 0 are answered from the response cache
+        request_key = code_analysis_request_key(llm, request.code)
+        cache_key = request_key if response_cache.is_enabled("code_analyze") else None
+        if cache_key is not None:
+            cached = response_cache.get("code_analyze", cache_key)
+            if cached is not None:
+                response.headers["X-Cache"] = "HIT"
+                return cached
+            response_cache.miss("code_analyze")
+        
+        chain = chain_registry.get("code_analysis", llm)
         
-        # Create chain
-        chain = prompt | llm | parser
+        async def run_analysis() -> CodeAnalysisResponse:
+            async with endpoint_limiter.limit("code_analyze"):
+                return await chain.ainvoke({"code": request.code})
         
-        # Get analysis
-        result = chain.invoke({
-            "code": request.code,
-            "format_instructions": parser.get_format_instructions()
-        })
+        # Get analysis, sharing the call with identical requests already in flight
+        result, coalesced = await single_flight.do(
+            request_key, run_analysis,
+            encode=lambda result: result.model_dump(),
+            decode=lambda data: CodeAnalysisResponse(**data)
+        )
+        if coalesced:
+            response.headers["X-Coalesced"] = "1"
+        
+        if cache_key is not None:
+            response_cache.put(cache_key, result)
+            response.headers["X-Cache"] = "MISS"
+        else:
+            response.headers["X-Cache"] = "BYPASS"
         
         return result
     
+    except UpstreamUnavailable as e:
+        raise upstream_http_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Code analysis error: {str(e)}")
 
-@app.post("/code/generate", response_model=CodeGenerationResponse)
-async def generate_code(request: CodeGenerationRequest):
-    """Generate code from description"""
+@app.post("/code/analyze/batch", response_model=CodeAnalysisBatchResponse)
+async def analyze_code_batch(request: CodeAnalysisBatchRequest):
+    """Analyze many code snippets in one batched chain call"""
+    check_batch_size(len(request.items))
+    set_request_priority("batch")
     try:
-        llm = get_llm()
+        llm = get_qa_llm()
+        chain = chain_registry.get("code_analysis", llm)
         
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", "You are an expert programmer. Generate clean, well-documented code based on the user's requirements. Also provide a brief explanation of what the code does."),
-            ("user", "Generate code for: {requirement}")
-        ])
+        # Cached snippets are answered directly; only the rest go to the model
+        items: List[Optional[CodeAnalysisBatchItem]] = [None] * len(request.items)
+        cache_keys = [code_analysis_cache_key(llm, item.code) for item in request.items]
+        pending = []
+        for index, cache_key in enumerate(cache_keys):
+            cached = response_cache.get("code_analyze", cache_key) if cache_key else None
+            if cached is not None:
+                items[index] = CodeAnalysisBatchItem(index=index, result=cached, cached=True)
+                continue
+            if cache_key is not None:
+                response_cache.miss("code_analyze")
+            pending.append(index)
         
-        chain = prompt | llm
+        def finish(position: int, output) -> CodeAnalysisBatchItem:
+            index = pending[position]
+            if isinstance(output, Exception):
+                return CodeAnalysisBatchItem(index=index, error=str(output))
+            if cache_keys[index] is not None:
+                response_cache.put(cache_keys[index], output)
+            return CodeAnalysisBatchItem(index=index, result=output)
         
-        response = chain.invoke({"requirement": request.requirement})
+        inputs = [{"code": request.items[index].code} for index in pending]
+        config = batch_config(request.max_concurrency)
         
-        # Simple parsing to separate code and explanation
-        content = response.content
-        lines = content.split('\n')
+        if request.stream:
+            async def generate():
+                for item in items:
+                    if item is not None:
+                        yield ndjson_line(item.model_dump())
+                try:
+                    async with endpoint_limiter.limit("code_analyze_batch"):
+                        async for position, output in run_batch(chain, inputs, config, stream=True):
+                            yield ndjson_line(finish(position, output).model_dump())
+                except Exception as e:
+                    yield ndjson_line({"error": f"Batch code analysis error: {str(e)}"})
+            
+            return StreamingResponse(generate(), media_type="application/x-ndjson")
         
-        # Try to find code block
-        code_lines = []
-        explanation_lines = []
-        in_code_block = False
+        async with endpoint_limiter.limit("code_analyze_batch"):
+            async for position, output in run_batch(chain, inputs, config, stream=False):
+                items[pending[position]] = finish(position, output)
         
-        for line in lines:
-            if '```' in line:
-                in_code_block = not in_code_block
-                continue
-            if in_code_block:
-                code_lines.append(line)
-            else:
-                explanation_lines.append(line)
-        
-        code = '\n'.join(code_lines).strip()
-        explanation = '\n'.join(explanation_lines).strip()
-        
-        if not code:
-            # If no code block found, treat everything as code
-            code = content
-            explanation = "Generated code based on your requirements."
-        
-        return CodeGenerationResponse(
-            code=code,
-            explanation=explanation
-        )
+        failed = sum(1 for item in items if item.error is not None)
+        return CodeAnalysisBatchResponse(results=items, succeeded=len(items) - failed, failed=failed)
+    
+    except HTTPException:
+        raise
+    except UpstreamUnavailable as e:
+        raise upstream_http_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch code analysis error: {str(e)}")
+
+@app.post("/code/generate", response_model=CodeGenerationResponse)
+async def generate_code(request: CodeGenerationRequest):
+    """Generate code from description"""
+    set_request_priority("interactive")
+    try:
+        chain = chain_registry.get("code_generation", get_llm())
+        
+        async with endpoint_limiter.limit("code_generate"):
+            response = await chain.ainvoke({"requirement": request.requirement})
+        
+        # Simple parsing to separate code and explanation
+        return parse_generated_code(response.content)
     
+    except UpstreamUnavailable as e:
+        raise upstream_http_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Code generation error: {str(e)}")
 
+@app.post("/code/generate/stream")
+async def generate_code_stream(request: CodeGenerationRequest):
+    """Generate code from description, streaming tokens as Server-Sent Events"""
+    set_request_priority("interactive")
+    chain = chain_registry.get("code_generation", get_llm())
+    
+    async def event_stream():
+        try:
+            async with endpoint_limiter.limit("code_generate"):
+                content = ""
+                async for chunk in chain.astream({"requirement": request.requirement}):
+                    if chunk.content:
+                        content += chunk.content
+                        yield sse_event({"token": chunk.content})
+            
+            yield sse_event(parse_generated_code(content).model_dump(), event="done")
+        
+        except UpstreamUnavailable as e:
+            yield sse_event({"detail": str(e), "retry_after": e.retry_after}, event="error")
+        except Exception as e:
+            yield sse_event({"detail": f"Code generation error: {str(e)}"}, event="error")
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: request and stage latencies, token usage, cache hit ratios and sessions"""
+    content, content_type = await run_sync(render_metrics)
+    return Response(content=content, media_type=content_type)
+
+@app.get("/concurrency")
+async def concurrency_stats():
+    """Show in-flight requests and concurrency limits per endpoint"""
+    return endpoint_limiter.stats()
+
+@app.get("/coalescing")
+async def coalescing_stats():
+    """Show how many requests shared an identical in-flight call"""
+    return single_flight.stats()
+
+@app.get("/cache/responses")
+async def response_cache_stats():
+    """Show response cache hit ratios per endpoint"""
+    return response_cache.stats()
+
+@app.get("/chains")
+async def chain_stats():
+    """Get build and invoke timings of the prebuilt chains"""
+    return chain_registry.stats()
+
+@app.get("/startup")
+async def startup_stats():
+    """Show the background warmup state and what each endpoint group cost to import"""
+    return startup_warmup.stats()
+
+@app.get("/clients")
+async def client_pool_stats():
+    """Show shared HTTP connection pool metrics; the pool is not created just to report on it"""
+    pool = existing_client_pool()
+    return pool.stats() if pool is not None else {"started": False}
+
 @app.get("/sessions")
 async def list_sessions():
     """List all active chat sessions"""
+    def describe_sessions():
+        sessions = []
+        for session_id in conversation_sessions.keys():
+            record = conversation_sessions.peek(session_id)
+            if record is not None:
+                sessions.append({
+                    "session_id": session_id,
+                    "token_count": record.get("token_count", 0),
+                    "turns": len(record["messages"]) // 2,
+                    "summarized": bool(record.get("summary")),
+                })
+        return sessions
+    
+    sessions = await run_sync(describe_sessions)
     return {
-        "active_sessions": list(conversation_sessions.keys()),
-        "session_count": len(conversation_sessions)
+        "active_sessions": [session["session_id"] for session in sessions],
+        "session_count": len(sessions),
+        "memory_mode": MEMORY_MODE,
+        "sessions": sessions,
+        "store": await run_sync(conversation_sessions.stats)
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,143 @@
+"""
+Shared helpers for the benchmark scripts: deterministic embeddings,
+percentiles, peak memory, and JSON reports that can be compared across
+commits.
+"""
+
+import hashlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def deterministic_vector(text: str, dimensions: int = 1536) -> List[float]:
+    """Unit vector seeded by the text, so equal texts always embed identically"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class DeterministicEmbeddings(Embeddings):
+    """Local embeddings matching the fake OpenAI server, for micro-benchmarks"""
+
+    model = "benchmark-embeddings"
+
+    def __init__(self, dimensions: int = 1536):
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [deterministic_vector(text, self.dimensions) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return deterministic_vector(text, self.dimensions)
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Linear-interpolated percentile (q in 0..100) of a sample"""
+    return float(np.percentile(values, q)) if len(values) else 0.0
+
+
+def latency_summary(seconds: Sequence[float]) -> Dict[str, float]:
+    """p50/p95/p99/mean/max of latencies, in milliseconds"""
+    return {
+        "p50_ms": round(percentile(seconds, 50) * 1000, 3),
+        "p95_ms": round(percentile(seconds, 95) * 1000, 3),
+        "p99_ms": round(percentile(seconds, 99) * 1000, 3),
+        "mean_ms": round(float(np.mean(seconds)) * 1000, 3) if len(seconds) else 0.0,
+        "max_ms": round(max(seconds) * 1000, 3) if len(seconds) else 0.0,
+    }
+
+
+def peak_rss_mb(pid: Optional[int] = None) -> Optional[float]:
+    """Peak resident memory of a process (this one by default) in MiB"""
+    if pid is None:
+        # ru_maxrss is in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def git_commit() -> Optional[str]:
+    """Short hash of the checked-out commit, with a -dirty suffix for local changes"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report_metadata(kind: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    """Describe the run so reports from different commits can be lined up"""
+    return {
+        "kind": kind,
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()} ({os.cpu_count()} CPUs)",
+        "config": config,
+    }
+
+
+def write_report(report: Dict[str, Any], path: Optional[str]) -> None:
+    """Write a report as JSON, creating parent directories"""
+    if not path:
+        return
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"Report written to {path}")
+
+
+def _delta(current: float, baseline: float) -> str:
+    if not baseline:
+        return ""
+    change = (current - baseline) / baseline * 100
+    return f"{change:+.1f}%"
+
+
+def print_table(rows: Dict[str, Dict[str, Any]], columns: List[str], baseline: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+    """Print one row per benchmark, with the change from a baseline report when given"""
+    name_width = max([len(name) for name in rows] + [9])
+    header = f"{'benchmark':<{name_width}}" + "".join(f"{column:>14}" for column in columns)
+    print(header)
+    print("-" * len(header))
+    for name, row in rows.items():
+        line = f"{name:<{name_width}}" + "".join(f"{row.get(column, ''):>14}" for column in columns)
+        print(line)
+        if baseline and name in baseline:
+            previous = baseline[name]
+            changes = "".join(
+                f"{_delta(row[column], previous[column]) if isinstance(row.get(column), (int, float)) and isinstance(previous.get(column), (int, float)) else '':>14}"
+                for column in columns
+            )
+            print(f"{'  vs baseline':<{name_width}}{changes}")
+
+
+def load_baseline(path: Optional[str], section: str) -> Optional[Dict[str, Dict[str, Any]]]:
+    """Load one section of an earlier report to compare against"""
+    if not path:
+        return None
+    with open(path) as baseline:
+        report = json.load(baseline)
+    print(f"Comparing against {path} (commit {report.get('meta', {}).get('commit')})")
+    return report.get(section)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI API, for load tests that cost nothing.
+
+Implements ``/v1/chat/completions`` (plain and streamed) and
+``/v1/embeddings`` with a configurable first-token latency and token rate.
+Embeddings are deterministic, so caches and retrieval behave the same way on
+every run. Chat replies are shaped after the prompt: JSON for code analysis,
+a fenced code block for code generation, and plain prose otherwise. A
+fraction of chat requests can be rejected with 429 and Retry-After to
+exercise the API's retry and backpressure paths.
+
+Run it, then point the API at it:
+
+    python -m benchmarks.fake_openai --port 9100 --latency-ms 300 --tokens-per-second 80
+    OPENAI_BASE_URL=http://127.0.0.1:9100/v1 OPENAI_API_KEY=bench python start_api.py
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+import uuid
+from typing import Any, Dict, List
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from benchmarks.common import deterministic_vector
+
+WORDS = (
+    "the framework splits documents into chunks embeds them and retrieves the most relevant "
+    "passages before the model writes an answer that cites the context it was given"
+).split()
+
+
+class FakeBackend:
+    """Latency model and canned responses for the fake server"""
+
+    def __init__(self, latency_ms: float, jitter_ms: float, tokens_per_second: float,
+                 completion_tokens: int, embedding_latency_ms: float, dimensions: int, seed: int,
+                 rate_limit_fraction: float = 0.0, retry_after: float = 1.0):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.embedding_latency = embedding_latency_ms / 1000
+        self.dimensions = dimensions
+        self.random = random.Random(seed)
+        self.rate_limit_fraction = rate_limit_fraction
+        self.retry_after = retry_after
+        self.requests = {"chat": 0, "embeddings": 0, "embedded_inputs": 0, "rate_limited": 0}
+
+    def first_token_delay(self) -> float:
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def reply(self, messages: List[Dict[str, Any]]) -> str:
+        prompt = "\n".join(str(message.get("content", "")) for message in messages)
+        if '"suggestions"' in prompt and '"explanation"' in prompt:
+            return json.dumps({
+                "suggestions": ["Add type hints", "Handle errors explicitly", "Add a docstring"],
+                "explanation": "The code defines a small routine and returns its result.",
+            })
+        if "Generate code for:" in prompt:
+            return (
+                "Here is an implementation:\n```python\ndef solution(values):\n"
+                "    \"\"\"Return the values sorted in ascending order\"\"\"\n"
+                "    return sorted(values)\n```\nThe function sorts its input and returns a new list."
+            )
+        words = [WORDS[(len(prompt) + index) % len(WORDS)] for index in range(self.completion_tokens)]
+        return " ".join(words).capitalize() + "."
+
+
+def approximate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def create_app(backend: FakeBackend) -> FastAPI:
+    app = FastAPI(title="Fake OpenAI")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        backend.requests["chat"] += 1
+        if backend.random.random() < backend.rate_limit_fraction:
+            backend.requests["rate_limited"] += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status_code=429,
+                headers={"Retry-After": str(backend.retry_after)},
+            )
+        model = body.get("model", "gpt-3.5-turbo")
+        content = backend.reply(body.get("messages", []))
+        prompt_tokens = sum(approximate_tokens(str(message.get("content", ""))) for message in body.get("messages", []))
+        pieces = content.split(" ")
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(pieces),
+            "total_tokens": prompt_tokens + len(pieces),
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        token_delay = 1 / backend.tokens_per_second if backend.tokens_per_second > 0 else 0.0
+
+        await asyncio.sleep(backend.first_token_delay())
+
+        if not body.get("stream"):
+            await asyncio.sleep(token_delay * len(pieces))
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        async def stream():
+            def chunk(delta, finish_reason=None, chunk_usage=None):
+                data = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+                }
+                if chunk_usage is not None:
+                    data["usage"] = chunk_usage
+                return f"data: {json.dumps(data)}\n\n"
+
+            yield chunk({"role": "assistant", "content": ""})
+            for index, piece in enumerate(pieces):
+                yield chunk({"content": piece if index == 0 else " " + piece})
+                await asyncio.sleep(token_delay)
+            yield chunk({}, finish_reason="stop")
+            if include_usage:
+                yield chunk(None, chunk_usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"]
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        backend.requests["embeddings"] += 1
+        backend.requests["embedded_inputs"] += len(inputs)
+        await asyncio.sleep(backend.embedding_latency)
+
+        data = []
+        total_tokens = 0
+        for index, item in enumerate(inputs):
+            # LangChain may send pre-tokenized inputs; hash them the same way either way
+            text = item if isinstance(item, str) else " ".join(map(str, item))
+            total_tokens += len(item) if isinstance(item, list) else approximate_tokens(item)
+            vector = deterministic_vector(text, body.get("dimensions") or backend.dimensions)
+            if body.get("encoding_format") == "base64":
+                embedding: Any = base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+            else:
+                embedding = vector
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        return JSONResponse({
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "text-embedding-ada-002"),
+            "usage": {"prompt_tokens": total_tokens, "total_tokens": total_tokens},
+        })
+
+    @app.get("/stats")
+    async def stats():
+        return backend.requests
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=300, help="Time to first token")
+    parser.add_argument("--jitter-ms", type=float, default=50, help="Uniform jitter on the first-token latency")
+    parser.add_argument("--tokens-per-second", type=float, default=80, help="Completion token rate (0 for instant)")
+    parser.add_argument("--completion-tokens", type=int, default=60, help="Length of prose replies")
+    parser.add_argument("--embedding-latency-ms", type=float, default=50, help="Latency per embeddings request")
+    parser.add_argument("--dimensions", type=int, default=1536, help="Embedding dimensions")
+    parser.add_argument("--rate-limit-fraction", type=float, default=0.0, help="Fraction of chat requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    backend = FakeBackend(
+        args.latency_ms, args.jitter_ms, args.tokens_per_second, args.completion_tokens,
+        args.embedding_latency_ms, args.dimensions, args.seed, args.rate_limit_fraction, args.retry_after,
+    )
+    uvicorn.run(create_app(backend), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
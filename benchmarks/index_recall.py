@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Recall-vs-latency report for the FAISS index types in ``vector_index``.
+
+Each index type is built over the same vectors and compared against the
+exact flat index. Queries are held out from the vectors, so they look like
+real chunks without matching themselves. For every type and query-time
+setting (nprobe for IVF, efSearch for HNSW) the report shows:
+
+- recall@k and recall@fetch_k against the exact neighbours (the retriever
+  fetches fetch_k candidates and keeps k)
+- single-query search latency, as the API searches one question at a time
+- build time and memory per vector
+
+Run it on your own data, either a collection or any saved index or
+``.npy`` matrix of embeddings:
+
+    python -m benchmarks.index_recall --collection manual --output reports/index-recall.json
+    python -m benchmarks.index_recall --vectors embeddings.npy --types flat,ivf_sq8,hnsw
+    python -m benchmarks.index_recall --synthetic 50000 --dimensions 256
+"""
+
+import argparse
+import os
+import time
+from typing import Any, Dict, List
+
+import faiss
+import numpy as np
+
+from benchmarks.common import latency_summary, load_baseline, print_table, report_metadata, write_report
+from hybrid_retrieval import RETRIEVAL_FETCH_K, RETRIEVAL_K
+from vector_index import INDEX_TYPES, build_index, configure_search, describe_index, resolve_index_type
+
+
+def load_vectors(args) -> np.ndarray:
+    """Vectors from a collection, a saved index, an .npy file, or synthetic clusters"""
+    if args.collection:
+        from document_collections import CollectionStore
+        return CollectionStore(args.collections_dir).vectors(args.collection)
+    if args.index:
+        index = faiss.read_index(args.index)
+        if not isinstance(faiss.downcast_index(index), faiss.IndexFlat):
+            print(f"Warning: {args.index} is not a flat index; its reconstructed vectors are approximate")
+        return index.reconstruct_n(0, index.ntotal)
+    if args.vectors:
+        return np.load(args.vectors).astype(np.float32)
+    # Topic clusters in a low-dimensional space projected up, which is closer to real
+    # embeddings than uniform random vectors (the worst case for every approximate index)
+    rng = np.random.default_rng(args.seed)
+    latent_dimensions = min(64, args.dimensions)
+    centers = rng.standard_normal((max(1, args.synthetic // 200), latent_dimensions))
+    latent = centers[rng.integers(0, len(centers), args.synthetic)] + 0.5 * rng.standard_normal((args.synthetic, latent_dimensions))
+    points = latent @ rng.standard_normal((latent_dimensions, args.dimensions))
+    points += 0.05 * np.linalg.norm(points, axis=1, keepdims=True) / np.sqrt(args.dimensions) * rng.standard_normal(points.shape)
+    return (points / np.linalg.norm(points, axis=1, keepdims=True)).astype(np.float32)
+
+
+def recall(found: np.ndarray, exact: np.ndarray, k: int) -> float:
+    """Mean share of the exact top-k neighbours that the index returned in its top k"""
+    hits = sum(len(set(row[:k]) & set(truth[:k])) for row, truth in zip(found, exact))
+    return hits / (len(exact) * k)
+
+
+def search_one_by_one(index, queries: np.ndarray, k: int):
+    """Search each query separately, returning the neighbours and per-query seconds"""
+    found, seconds = [], []
+    for query in queries:
+        started = time.perf_counter()
+        _, positions = index.search(query[None, :], k)
+        seconds.append(time.perf_counter() - started)
+        found.append(positions[0])
+    return np.vstack(found), seconds
+
+
+def settings_for(index_type: str, nprobes: List[int], ef_searches: List[int]) -> List[Dict[str, int]]:
+    if index_type.startswith("ivf"):
+        return [{"nprobe": nprobe} for nprobe in nprobes]
+    if index_type == "hnsw":
+        return [{"ef_search": ef_search} for ef_search in ef_searches]
+    return [{}]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare FAISS index types against the exact index on your own vectors")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--collection", help="Collection whose vectors to use")
+    source.add_argument("--index", help="Saved .faiss index whose vectors to use")
+    source.add_argument("--vectors", help=".npy matrix of embeddings")
+    source.add_argument("--synthetic", type=int, default=20000, help="Clustered synthetic vectors when no data is given")
+    parser.add_argument("--collections-dir", default=os.getenv("COLLECTIONS_DIR", os.path.join("data", "collections")))
+    parser.add_argument("--dimensions", type=int, default=1536, help="Dimensions of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=200, help="Vectors held out as queries")
+    parser.add_argument("--types", default=",".join(INDEX_TYPES), help="Comma-separated index types")
+    parser.add_argument("--nprobe", default="1,4,16,64", help="IVF lists probed per query")
+    parser.add_argument("--ef-search", default="16,64,256", help="HNSW candidate list sizes")
+    parser.add_argument("--k", type=int, default=RETRIEVAL_K, help="Chunks kept per question")
+    parser.add_argument("--fetch-k", type=int, default=RETRIEVAL_FETCH_K, help="Candidates fetched per question")
+    parser.add_argument("--threads", type=int, default=1, help="FAISS threads (the API searches one query per request)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here")
+    parser.add_argument("--compare", help="Earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    vectors = load_vectors(args)
+    rng = np.random.default_rng(args.seed)
+    order = rng.permutation(len(vectors))
+    queries = vectors[order[:args.queries]]
+    base = np.ascontiguousarray(vectors[order[args.queries:]])
+    print(f"{len(base)} vectors of {base.shape[1]} dimensions, {len(queries)} held-out queries")
+
+    exact = faiss.IndexFlatL2(base.shape[1])
+    exact.add(base)
+    _, truth = exact.search(queries, args.fetch_k)
+    flat_bytes = base.shape[1] * 4
+
+    rows: Dict[str, Dict[str, Any]] = {}
+    for index_type in args.types.split(","):
+        resolved = resolve_index_type(index_type, len(base))
+        started = time.perf_counter()
+        index = build_index(base, index_type)
+        build_seconds = time.perf_counter() - started
+        description = describe_index(index)
+        for settings in settings_for(resolved, [int(n) for n in args.nprobe.split(",")], [int(n) for n in args.ef_search.split(",")]):
+            configure_search(index, **settings)
+            found, seconds = search_one_by_one(index, queries, args.fetch_k)
+            name = index_type if index_type == resolved else f"{index_type}->{resolved}"
+            name += "".join(f" {key}={value}" for key, value in settings.items())
+            latency = latency_summary(seconds)
+            rows[name] = {
+                "type": resolved,
+                **settings,
+                f"recall@{args.k}": round(recall(found, truth, args.k), 4),
+                f"recall@{args.fetch_k}": round(recall(found, truth, args.fetch_k), 4),
+                "p50_ms": latency["p50_ms"],
+                "p95_ms": latency["p95_ms"],
+                "build_s": round(build_seconds, 2),
+                "bytes/vector": round(description["bytes"] / max(1, description["vectors"]), 1),
+                "compression": round(flat_bytes / max(1.0, description["bytes"] / max(1, description["vectors"])), 1),
+            }
+
+    config = {key: getattr(args, key) for key in ("collection", "index", "vectors", "synthetic", "queries", "types", "nprobe", "ef_search", "k", "fetch_k", "threads", "seed")}
+    config["base_vectors"] = len(base)
+    config["dimensions"] = int(base.shape[1])
+    report = {"meta": report_metadata("index_recall", config), "indexes": rows}
+    columns = [f"recall@{args.k}", f"recall@{args.fetch_k}", "p50_ms", "p95_ms", "build_s", "bytes/vector", "compression"]
+    print_table(rows, columns, load_baseline(args.compare, "indexes"))
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
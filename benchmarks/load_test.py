@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Load generator for the API.
+
+Drives ``/chat``, ``/document-qa``, ``/code/analyze`` and ``/code/generate``
+with a weighted, seeded request mix from a fixed number of concurrent
+clients, then reports p50/p95/p99 latency, throughput and errors per
+endpoint, plus the peak RSS of the API process when it is known. With
+``--spawn`` the fake OpenAI server and the API are started locally, so a run
+needs no API key and costs nothing:
+
+    python -m benchmarks.load_test --spawn --duration 30 --concurrency 16 --output reports/load.json
+    python -m benchmarks.load_test --spawn --compare reports/load.json
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.common import latency_summary, load_baseline, peak_rss_mb, print_table, report_metadata, write_report
+
+DEFAULT_MIX = "chat=4,document_qa=3,code_analyze=2,code_generate=1"
+
+CHAT_MESSAGES = [
+    "Hi! Can you explain what a vector store is?",
+    "How does retrieval augmented generation work?",
+    "Give me three tips for writing good prompts.",
+    "What did I ask you about earlier?",
+    "Summarize our conversation so far.",
+    "What is the difference between a chain and an agent?",
+]
+QUESTIONS = [
+    "What is LangChain?",
+    "What are the key features?",
+    "What are common use cases?",
+    "How are documents loaded?",
+    "What does the memory component do?",
+    "Which vector stores are supported?",
+]
+CODE_SNIPPETS = [
+    "def add(a, b):\n    return a + b\n",
+    "def fib(n):\n    if n < 2:\n        return n\n    return fib(n - 1) + fib(n - 2)\n",
+    "function debounce(fn, ms) {\n  let t;\n  return (...args) => { clearTimeout(t); t = setTimeout(() => fn(...args), ms); };\n}\n",
+    "public class Counter {\n    private int count;\n    public void increment() { if (count < 100) { count++; } }\n}\n",
+    "SELECT name, COUNT(*) FROM orders WHERE total > 10 GROUP BY name ORDER BY 2 DESC;",
+    "for f in *.log; do\n  if grep -q ERROR \"$f\"; then echo \"$f\"; fi\ndone\n",
+]
+REQUIREMENTS = [
+    "a function that checks whether a string is a palindrome",
+    "a class implementing an LRU cache",
+    "a function that merges two sorted lists",
+    "a retry decorator with exponential backoff",
+]
+
+
+def synthetic_document(seed: int, paragraphs: int) -> str:
+    """A reproducible multi-section document of roughly paragraphs * 60 words"""
+    rng = random.Random(seed)
+    vocabulary = (
+        "index query chunk embedding retriever latency cache model token prompt answer context "
+        "document vector score rank memory session request worker pipeline batch stream"
+    ).split()
+    sections = []
+    for section in range(max(1, paragraphs // 4)):
+        body = []
+        for _ in range(4):
+            sentences = [
+                " ".join(rng.choice(vocabulary) for _ in range(rng.randint(8, 16))).capitalize() + "."
+                for _ in range(rng.randint(3, 6))
+            ]
+            body.append(" ".join(sentences))
+        sections.append(f"## Section {section + 1}\n\n" + "\n\n".join(body))
+    return "\n\n".join(sections)
+
+
+class Workload:
+    """Seeded generator of realistic requests for each endpoint"""
+
+    def __init__(self, seed: int, sessions: int, document_paragraphs: List[int]):
+        self.random = random.Random(seed)
+        self.session_ids = [str(uuid.UUID(int=self.random.getrandbits(128))) for _ in range(sessions)]
+        # None means the built-in sample document
+        self.documents: List[Optional[str]] = [None] + [
+            synthetic_document(seed + index, paragraphs) for index, paragraphs in enumerate(document_paragraphs)
+        ]
+
+    def request(self, endpoint: str) -> Tuple[str, Dict[str, Any]]:
+        choice = self.random.choice
+        if endpoint == "chat":
+            return "/chat", {"message": choice(CHAT_MESSAGES), "session_id": choice(self.session_ids)}
+        if endpoint == "document_qa":
+            payload: Dict[str, Any] = {"question": choice(QUESTIONS)}
+            document = choice(self.documents)
+            if document is not None:
+                payload["document_text"] = document
+            return "/document-qa", payload
+        if endpoint == "code_analyze":
+            return "/code/analyze", {"code": choice(CODE_SNIPPETS)}
+        if endpoint == "code_generate":
+            return "/code/generate", {"requirement": choice(REQUIREMENTS)}
+        raise ValueError(f"Unknown endpoint '{endpoint}'")
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+async def run_load(args, workload: Workload, weights: Dict[str, float]) -> Dict[str, Any]:
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    cache_hits: Dict[str, int] = defaultdict(int)
+    endpoints, endpoint_weights = list(weights), list(weights.values())
+    sent = 0
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        async def worker(deadline: float, record: bool):
+            nonlocal sent
+            while time.perf_counter() < deadline:
+                if record and args.requests and sent >= args.requests:
+                    return
+                endpoint = workload.random.choices(endpoints, endpoint_weights)[0]
+                path, payload = workload.request(endpoint)
+                if record:
+                    sent += 1
+                started = time.perf_counter()
+                try:
+                    response = await client.post(path, json=payload)
+                    failed = response.status_code >= 400
+                    hit = response.headers.get("x-cache", "").endswith("HIT")
+                except httpx.HTTPError:
+                    failed, hit = True, False
+                if not record:
+                    continue
+                latencies[endpoint].append(time.perf_counter() - started)
+                errors[endpoint] += int(failed)
+                cache_hits[endpoint] += int(hit)
+
+        if args.warmup > 0:
+            warmup_deadline = time.perf_counter() + args.warmup
+            await asyncio.gather(*(worker(warmup_deadline, record=False) for _ in range(args.concurrency)))
+
+        started = time.perf_counter()
+        deadline = started + (args.duration if not args.requests else float("inf"))
+        await asyncio.gather(*(worker(deadline, record=True) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    results = {}
+    for endpoint in endpoints:
+        samples = latencies.get(endpoint, [])
+        results[endpoint] = {
+            "requests": len(samples),
+            "errors": errors[endpoint],
+            "cache_hits": cache_hits[endpoint],
+            "rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+            **latency_summary(samples),
+        }
+    every = [latency for samples in latencies.values() for latency in samples]
+    results["total"] = {
+        "requests": len(every),
+        "errors": sum(errors.values()),
+        "cache_hits": sum(cache_hits.values()),
+        "rps": round(len(every) / elapsed, 2) if elapsed else 0.0,
+        **latency_summary(every),
+    }
+    return {"elapsed_seconds": round(elapsed, 2), "endpoints": results}
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process exited with code {process.returncode} before becoming ready: {url}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+def spawn_servers(args, workdir: str) -> List[subprocess.Popen]:
+    """Start the fake OpenAI server and the API against it, with caches in a scratch directory"""
+    fake = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.fake_openai", "--port", str(args.fake_port),
+        "--latency-ms", str(args.latency_ms), "--tokens-per-second", str(args.tokens_per_second),
+    ])
+    wait_until_ready(f"http://127.0.0.1:{args.fake_port}/stats", fake)
+
+    port = int(args.url.rsplit(":", 1)[1].split("/")[0])
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.fake_port}/v1",
+        # Send plain strings, so no tokenizer download is needed offline
+        "EMBEDDING_CHECK_CTX_LENGTH": "0",
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embeddings.sqlite3"),
+        "COLLECTIONS_DIR": os.path.join(workdir, "collections"),
+    }
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api_app:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    wait_until_ready(f"{args.url}/", api)
+    return [fake, api]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the API with a realistic request mix")
+    parser.add_argument("--url", default="http://127.0.0.1:8100", help="API base URL")
+    parser.add_argument("--spawn", action="store_true", help="Start the fake OpenAI server and the API locally")
+    parser.add_argument("--fake-port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=300, help="Fake model first-token latency (with --spawn)")
+    parser.add_argument("--tokens-per-second", type=float, default=80, help="Fake model token rate (with --spawn)")
+    parser.add_argument("--server-pid", type=int, help="API process to read peak RSS from, when not spawned")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="Measured seconds")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests instead of a duration")
+    parser.add_argument("--warmup", type=float, default=5, help="Unmeasured warmup seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Endpoint weights, e.g. chat=4,document_qa=3")
+    parser.add_argument("--sessions", type=int, default=20, help="Distinct chat sessions")
+    parser.add_argument("--documents", default="8,40", help="Paragraph counts of the synthetic documents")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here")
+    parser.add_argument("--compare", help="Earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    workload = Workload(args.seed, args.sessions, [int(count) for count in args.documents.split(",") if count])
+    processes: List[subprocess.Popen] = []
+    workdir = tempfile.mkdtemp(prefix="langchain-bench-")
+    try:
+        if args.spawn:
+            processes = spawn_servers(args, workdir)
+        server_pid = processes[-1].pid if processes else args.server_pid
+        result = asyncio.run(run_load(args, workload, weights))
+        rss = peak_rss_mb(server_pid) if server_pid else None
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    config = {
+        key: getattr(args, key)
+        for key in ("concurrency", "duration", "requests", "warmup", "mix", "sessions", "documents", "seed", "spawn")
+    }
+    if args.spawn:
+        config.update(latency_ms=args.latency_ms, tokens_per_second=args.tokens_per_second)
+    report = {
+        "meta": report_metadata("load", config),
+        "elapsed_seconds": result["elapsed_seconds"],
+        "server_peak_rss_mb": rss,
+        "endpoints": result["endpoints"],
+    }
+
+    baseline = load_baseline(args.compare, "endpoints")
+    print_table(report["endpoints"], ["requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms"], baseline)
+    print(f"\nElapsed: {result['elapsed_seconds']}s   Server peak RSS: {rss if rss is not None else 'n/a'} MiB")
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the local parts of the document pipeline.
+
+Times splitting, duplicate filtering, FAISS and BM25 index construction,
+retrieval in each mode (with and without context compression) and the local
+code analyzer on synthetic, seeded inputs. Embeddings are deterministic and
+computed up front, so only the code under test is timed.
+
+    python -m benchmarks.micro --output reports/micro.json
+    python -m benchmarks.micro --compare reports/micro.json --filter retrieval
+"""
+
+import argparse
+import gc
+import time
+from typing import Callable, Dict, List
+
+from langchain_community.vectorstores import FAISS
+
+from benchmarks.common import (
+    DeterministicEmbeddings, latency_summary, load_baseline, peak_rss_mb, print_table, report_metadata, write_report
+)
+from benchmarks.load_test import CODE_SNIPPETS, QUESTIONS, synthetic_document
+from code_analyzer import analyze_code
+from context_compression import ContextCompressor
+from hybrid_retrieval import BM25Index, HybridRetriever, get_lexical_index
+from text_splitting import ChunkDeduplicator, create_token_splitter, split_text
+
+
+def measure(func: Callable[[], object], repeat: int, min_seconds: float) -> Dict[str, float]:
+    """Run func at least `repeat` times and for at least min_seconds; summarize per-call latency"""
+    func()  # warm caches and lazy imports
+    samples: List[float] = []
+    started = time.perf_counter()
+    while len(samples) < repeat or time.perf_counter() - started < min_seconds:
+        gc.disable()
+        call_started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - call_started)
+        gc.enable()
+    return {"iterations": len(samples), **latency_summary(samples)}
+
+
+def build_benchmarks(paragraphs: int, dimensions: int) -> Dict[str, Callable[[], object]]:
+    document = synthetic_document(seed=7, paragraphs=paragraphs)
+    splitter = create_token_splitter()
+    chunks, _ = split_text(document, splitter)
+    embeddings = DeterministicEmbeddings(dimensions)
+    vectors = embeddings.embed_documents(chunks)
+    pairs = list(zip(chunks, vectors))
+    vectorstore = FAISS.from_embeddings(pairs, embeddings)
+    get_lexical_index(vectorstore)
+    raw_chunks = splitter.split_text(document)
+
+    def retrieve(mode: str, compress: bool) -> Callable[[], object]:
+        retriever = HybridRetriever(vectorstore=vectorstore, mode=mode, compressor=ContextCompressor() if compress else None)
+        questions = iter(QUESTIONS * 10_000)
+        return lambda: retriever.invoke(next(questions))
+
+    return {
+        "split/token_recursive": lambda: splitter.split_text(document),
+        "split/dedup": lambda: ChunkDeduplicator().filter(raw_chunks),
+        "index/faiss_build": lambda: FAISS.from_embeddings(pairs, embeddings),
+        "index/bm25_build": lambda: BM25Index(chunks),
+        "retrieval/vector": retrieve("vector", False),
+        "retrieval/lexical": retrieve("lexical", False),
+        "retrieval/hybrid": retrieve("hybrid", False),
+        "retrieval/hybrid_compressed": retrieve("hybrid", True),
+        "code/analyze_local": lambda: [analyze_code(snippet) for snippet in CODE_SNIPPETS],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for splitting, indexing and retrieval")
+    parser.add_argument("--paragraphs", type=int, default=200, help="Size of the synthetic document")
+    parser.add_argument("--dimensions", type=int, default=1536, help="Embedding dimensions")
+    parser.add_argument("--repeat", type=int, default=20, help="Minimum iterations per benchmark")
+    parser.add_argument("--min-seconds", type=float, default=1.0, help="Minimum time per benchmark")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--output", help="Write the JSON report here")
+    parser.add_argument("--compare", help="Earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    benchmarks = build_benchmarks(args.paragraphs, args.dimensions)
+    results = {}
+    for name, func in benchmarks.items():
+        if args.filter in name:
+            results[name] = measure(func, args.repeat, args.min_seconds)
+
+    config = {key: getattr(args, key) for key in ("paragraphs", "dimensions", "repeat", "min_seconds", "filter")}
+    report = {"meta": report_metadata("micro", config), "peak_rss_mb": peak_rss_mb(), "benchmarks": results}
+
+    baseline = load_baseline(args.compare, "benchmarks")
+    print_table(results, ["iterations", "p50_ms", "p95_ms", "p99_ms"], baseline)
+    print(f"\nPeak RSS: {report['peak_rss_mb']} MiB")
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
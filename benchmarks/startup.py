@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Startup-time report for the API.
+
+Imports ``api_app`` in a fresh interpreter under ``python -X importtime``.
+Each endpoint group listed in ``api_app.ENDPOINT_GROUPS`` is then imported on
+top of it, again in a fresh interpreter, so the report shows what each group
+adds:
+
+- wall time
+- import time summed from the importtime breakdown
+- the number of modules loaded
+- the top-level packages that cost the most
+
+With ``--serve`` the API is also started for real, and the report records how
+long it takes until the first health check passes and until the background
+warmup finishes.
+
+    python -m benchmarks.startup --output reports/startup.json
+    python -m benchmarks.startup --serve --compare reports/startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.common import load_baseline, print_table, report_metadata, write_report
+
+MARKER = "--- measured imports ---"
+
+SCRIPT = """
+import importlib, json, sys, time
+{setup}
+sys.stderr.write({marker!r} + "\\n")
+started = time.perf_counter()
+for module in {modules}:
+    importlib.import_module(module)
+print(json.dumps(time.perf_counter() - started))
+"""
+
+
+def child_env() -> Dict[str, str]:
+    # Importing the app needs a key to be set, never a valid one
+    return {**os.environ, "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "startup-report"), "PYTHONWARNINGS": "ignore"}
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int]]:
+    """(module, self microseconds) for every import logged after the marker"""
+    entries = []
+    measuring = False
+    for line in stderr.splitlines():
+        if line.strip() == MARKER:
+            measuring = True
+        elif measuring and line.startswith("import time:") and "self [us]" not in line:
+            self_us, _, name = line[len("import time:"):].split("|")
+            entries.append((name.strip(), int(self_us)))
+    return entries
+
+
+def measure_imports(setup: str, modules: List[str]) -> Tuple[float, List[Tuple[str, int]]]:
+    """Import modules after setup in a fresh interpreter; returns wall seconds and the importtime entries"""
+    script = SCRIPT.format(setup=setup, marker=MARKER, modules=modules)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        capture_output=True, text=True, env=child_env(), check=False,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {modules} failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1]), parse_importtime(result.stderr)
+
+
+def top_packages(entries: List[Tuple[str, int]], count: int) -> List[Dict[str, Any]]:
+    """Aggregate self time by top-level package, most expensive first"""
+    totals: Dict[str, int] = defaultdict(int)
+    for name, self_us in entries:
+        totals[name.split(".")[0]] += self_us
+    ranked = sorted(totals.items(), key=lambda item: -item[1])[:count]
+    return [{"package": package, "ms": round(self_us / 1000, 1)} for package, self_us in ranked]
+
+
+def profile(setup: str, modules: List[str], repeat: int, top: int) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Median wall and import time over several fresh interpreters, plus the costliest packages"""
+    walls, imports = [], []
+    for _ in range(repeat):
+        wall, entries = measure_imports(setup, modules)
+        walls.append(wall)
+        imports.append(sum(self_us for _, self_us in entries))
+    row = {
+        "wall_ms": round(statistics.median(walls) * 1000, 1),
+        "import_ms": round(statistics.median(imports) / 1000, 1),
+        "modules": len(entries),
+    }
+    return row, top_packages(entries, top)
+
+
+def measure_serve(port: int, timeout: float) -> Dict[str, Optional[float]]:
+    """Start the API and time the first passing health check and the end of the warmup"""
+    url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api_app:app", "--port", str(port), "--log-level", "warning"],
+        env=child_env(),
+    )
+    healthy = warm = None
+    try:
+        deadline = started + timeout
+        while time.perf_counter() < deadline and warm is None:
+            if process.poll() is not None:
+                raise RuntimeError(f"API exited with code {process.returncode}")
+            try:
+                if healthy is None and httpx.get(f"{url}/", timeout=1).status_code == 200:
+                    healthy = time.perf_counter() - started
+                if healthy is not None and httpx.get(f"{url}/startup", timeout=1).json()["state"] in ("ready", "failed", "disabled"):
+                    warm = time.perf_counter() - started
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.02)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return {
+        "healthy_ms": round(healthy * 1000, 1) if healthy is not None else None,
+        "warm_ms": round(warm * 1000, 1) if warm is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report what importing the API and each endpoint group costs")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters per measurement (median is reported)")
+    parser.add_argument("--top", type=int, default=5, help="Costliest packages to list per row")
+    parser.add_argument("--serve", action="store_true", help="Also time a real server start until healthy and warm")
+    parser.add_argument("--port", type=int, default=8140, help="Port for --serve")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", help="Write the JSON report here")
+    parser.add_argument("--compare", help="Earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    from api_app import ENDPOINT_GROUPS
+
+    rows: Dict[str, Dict[str, Any]] = {}
+    packages: Dict[str, List[Dict[str, Any]]] = {}
+    rows["api_app"], packages["api_app"] = profile("", ["api_app"], args.repeat, args.top)
+    for group, modules in ENDPOINT_GROUPS.items():
+        name = f"group/{group}"
+        rows[name], packages[name] = profile("import api_app", list(modules), args.repeat, args.top)
+    every_module = [module for modules in ENDPOINT_GROUPS.values() for module in modules]
+    rows["group/all"], packages["group/all"] = profile("import api_app", every_module, args.repeat, args.top)
+
+    config = {key: getattr(args, key) for key in ("repeat", "top", "serve")}
+    report = {"meta": report_metadata("startup", config), "imports": rows, "top_packages": packages}
+    if args.serve:
+        report["serve"] = {"start": measure_serve(args.port, args.timeout)}
+
+    baseline = load_baseline(args.compare, "imports")
+    print_table(rows, ["wall_ms", "import_ms", "modules"], baseline)
+    print()
+    for name, ranked in packages.items():
+        print(f"{name:<22}" + ", ".join(f"{entry['package']} {entry['ms']}ms" for entry in ranked))
+    if args.serve:
+        print()
+        print_table(report["serve"], ["healthy_ms", "warm_ms"], load_baseline(args.compare, "serve"))
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
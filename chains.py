@@ -0,0 +1,101 @@
+"""
+Registry of prebuilt, reusable chains.
+
+Prompts, output parsers and their format instructions are created once by
+the code that registers a chain. The registry composes each chain with a
+model the first time that (chain, model, temperature) combination is
+requested and then reuses it, so per-request model swaps never rebuild
+anything. Build and invoke timings are recorded per chain.
+"""
+
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    from langchain_core.runnables import Runnable
+
+
+class ChainRegistry:
+    """Build chains once per model setting and time their invocations"""
+
+    def __init__(self):
+        self._builders: Dict[str, Tuple[Callable[[Any], "Runnable"], Optional[Callable[[], Any]]]] = {}
+        self._chains: Dict[Tuple[str, str, Any], "Runnable"] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, builder: Callable[[Any], "Runnable"], default_llm: Optional[Callable[[], Any]] = None) -> None:
+        """Register a builder that composes the chain around a given model"""
+        with self._lock:
+            self._builders[name] = (builder, default_llm)
+            self._stats[name] = {
+                "builds": 0, "build_seconds": 0.0,
+                "invocations": 0, "errors": 0, "invoke_seconds": 0.0, "max_invoke_seconds": 0.0,
+            }
+
+    @staticmethod
+    def _llm_key(llm) -> Tuple[str, Any]:
+        model = getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+        return str(model), getattr(llm, "temperature", None)
+
+    def _record_run(self, name: str, run, error: bool = False) -> None:
+        if run.end_time is None:
+            return
+        elapsed = (run.end_time - run.start_time).total_seconds()
+        with self._lock:
+            stats = self._stats[name]
+            stats["invocations"] += 1
+            stats["errors"] += int(error)
+            stats["invoke_seconds"] += elapsed
+            stats["max_invoke_seconds"] = max(stats["max_invoke_seconds"], elapsed)
+
+    def get(self, name: str, llm=None) -> "Runnable":
+        """Get the chain for a model, building it on first use"""
+        builder, default_llm = self._builders[name]
+        if llm is None:
+            if default_llm is None:
+                raise ValueError(f"Chain '{name}' has no default model; pass one explicitly")
+            llm = default_llm()
+        key = (name, *self._llm_key(llm))
+        with self._lock:
+            chain = self._chains.get(key)
+        if chain is not None:
+            return chain
+
+        started = time.perf_counter()
+        chain = builder(llm).with_listeners(
+            on_end=lambda run: self._record_run(name, run),
+            on_error=lambda run: self._record_run(name, run, error=True),
+        )
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            # Another thread may have built the same chain meanwhile; keep the first
+            if key not in self._chains:
+                self._chains[key] = chain
+                self._stats[name]["builds"] += 1
+                self._stats[name]["build_seconds"] += elapsed
+            return self._chains[key]
+
+    def warmup(self) -> None:
+        """Build every registered chain for its default model"""
+        for name, (_, default_llm) in list(self._builders.items()):
+            if default_llm is not None:
+                self.get(name)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return build and invoke timings per chain"""
+        with self._lock:
+            chains = {}
+            for name, stats in self._stats.items():
+                invocations = stats["invocations"]
+                chains[name] = {
+                    "variants": [f"{model}@{temperature}" for chain_name, model, temperature in self._chains if chain_name == name],
+                    "builds": stats["builds"],
+                    "build_ms": round(stats["build_seconds"] * 1000, 3),
+                    "invocations": invocations,
+                    "errors": stats["errors"],
+                    "avg_invoke_ms": round(stats["invoke_seconds"] / invocations * 1000, 1) if invocations else 0.0,
+                    "max_invoke_ms": round(stats["max_invoke_seconds"] * 1000, 1),
+                }
+            return {"chains": chains}
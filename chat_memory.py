@@ -0,0 +1,138 @@
+"""
+Token-budgeted chat memory with incremental summarization.
+
+In ``summary`` mode each session keeps its most recent turns verbatim and
+folds older turns into a rolling summary. Only the turns evicted since the
+last compaction are summarized, and compaction runs after the response has
+been sent so it never adds latency to a chat turn.
+"""
+
+import os
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set
+
+from langchain_core.messages import BaseMessage, SystemMessage
+
+from concurrency import run_sync
+from session_store import SessionStore, messages_from_records
+
+MEMORY_MODE = os.getenv("CHAT_MEMORY_MODE", "buffer").lower()
+MEMORY_MAX_TOKENS = int(os.getenv("CHAT_MEMORY_MAX_TOKENS", "2000"))
+MEMORY_KEEP_TURNS = int(os.getenv("CHAT_MEMORY_KEEP_TURNS", "6"))
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken, falling back to a characters/4 estimate"""
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def new_record() -> Dict[str, Any]:
+    """Create an empty session record"""
+    return {"messages": [], "summary": "", "token_count": 0}
+
+
+def record_token_count(record: Dict[str, Any]) -> int:
+    """Count the tokens a session record contributes to the prompt"""
+    total = count_tokens(record.get("summary", ""))
+    for message in record["messages"]:
+        total += count_tokens(message["content"]) + 4
+    return total
+
+
+def build_history(record: Dict[str, Any]) -> List[BaseMessage]:
+    """Build prompt history: the rolling summary followed by the verbatim turns"""
+    messages = messages_from_records(record["messages"])
+    if record.get("summary"):
+        messages.insert(0, SystemMessage(content=SUMMARY_PREFIX + record["summary"]))
+    return messages
+
+
+def append_turn(store: SessionStore, session_id: str, user_message: str, ai_message: str) -> Dict[str, Any]:
+    """Append a turn to the latest stored record (blocking; run on the worker pool)"""
+    def append(record):
+        record = record or new_record()
+        record["messages"].extend([
+            {"type": "human", "content": user_message},
+            {"type": "ai", "content": ai_message},
+        ])
+        record["token_count"] = record_token_count(record)
+        return record
+
+    return store.update(session_id, append)
+
+
+def messages_to_evict(record: Dict[str, Any], max_tokens: int = MEMORY_MAX_TOKENS, keep_turns: int = MEMORY_KEEP_TURNS) -> int:
+    """Return how many of the oldest messages should be folded into the summary"""
+    messages = record["messages"]
+    token_count = record.get("token_count") or record_token_count(record)
+    evict = 0
+    # Evict whole turns, always keeping the latest turn verbatim
+    while len(messages) - evict > 2:
+        remaining_turns = (len(messages) - evict) // 2
+        if remaining_turns <= keep_turns and token_count <= max_tokens:
+            break
+        for message in messages[evict:evict + 2]:
+            token_count -= count_tokens(message["content"]) + 4
+        evict += 2
+    return evict
+
+
+async def summarize(llm, summary: str, messages: List[BaseMessage]) -> str:
+    """Extend a running summary with newly evicted messages"""
+    # Imported here: these load LangSmith and the text splitters, and only summary mode needs them
+    from langchain.memory.prompt import SUMMARY_PROMPT
+    from langchain_core.messages import get_buffer_string
+    from langchain_core.output_parsers import StrOutputParser
+
+    chain = SUMMARY_PROMPT | llm | StrOutputParser()
+    return await chain.ainvoke({
+        "summary": summary,
+        "new_lines": get_buffer_string(messages),
+    })
+
+
+_compacting: Set[str] = set()
+
+
+async def compact_session(store: SessionStore, session_id: str, llm) -> Optional[Dict[str, Any]]:
+    """Fold evicted turns into the session summary if the session is over budget"""
+    if session_id in _compacting:
+        return None
+    _compacting.add(session_id)
+    try:
+        record = await run_sync(store.get, session_id)
+        if record is None:
+            return None
+        evict = messages_to_evict(record)
+        if not evict:
+            return None
+
+        evicted = record["messages"][:evict]
+        new_summary = await summarize(llm, record.get("summary", ""), messages_from_records(evicted))
+
+        # New turns may have been appended meanwhile; only apply if the prefix is unchanged
+        def apply(current):
+            if current is None or current["messages"][:evict] != evicted:
+                return None
+            current["messages"] = current["messages"][evict:]
+            current["summary"] = new_summary
+            current["token_count"] = record_token_count(current)
+            return current
+
+        return await run_sync(store.update, session_id, apply)
+    finally:
+        _compacting.discard(session_id)
@@ -0,0 +1,284 @@
+"""
+Application-scoped OpenAI clients on a shared, tuned httpx connection pool.
+
+Every ChatOpenAI and OpenAIEmbeddings instance handed out here reuses the
+same keep-alive connections (HTTP/2 when the ``h2`` package is installed),
+so requests no longer pay a fresh TCP and TLS handshake. Their calls also
+go through the shared upstream scheduler (see ``upstream.py``), which
+rate-limits, prioritizes and retries them in place of the SDK's own retries.
+"""
+
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from pydantic import Field
+
+from chat_memory import count_tokens
+from upstream import create_upstream_scheduler
+
+DEFAULT_CHAT_MODEL = "gpt-3.5-turbo"
+# Point at any OpenAI-compatible server, e.g. the fake backend in benchmarks/
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+# Chunks are far below the embedding context limit; disabling the check skips client-side tokenization
+EMBEDDING_CHECK_CTX_LENGTH = os.getenv("EMBEDDING_CHECK_CTX_LENGTH", "1") == "1"
+# Completion tokens reserved per chat call when max_tokens is not set
+COMPLETION_TOKEN_ESTIMATE = int(os.getenv("UPSTREAM_COMPLETION_TOKEN_ESTIMATE", "256"))
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class ScheduledChatOpenAI(ChatOpenAI):
+    """ChatOpenAI whose requests are admitted and retried by an upstream scheduler"""
+
+    # upstream.UpstreamScheduler; None sends requests directly
+    scheduler: Optional[Any] = Field(default=None, exclude=True)
+
+    def _estimate_tokens(self, messages, kwargs: Dict[str, Any]) -> int:
+        prompt = sum(count_tokens(str(message.content)) for message in messages)
+        return prompt + (kwargs.get("max_tokens") or self.max_tokens or COMPLETION_TOKEN_ESTIMATE)
+
+    @staticmethod
+    def _used_tokens(result: ChatResult) -> Optional[int]:
+        usage = (result.llm_output or {}).get("token_usage") or {}
+        return usage.get("total_tokens")
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        generate = super()._generate
+        if self.scheduler is None or self.streaming:
+            return generate(messages, stop, run_manager, **kwargs)
+        estimate = self._estimate_tokens(messages, kwargs)
+        result = self.scheduler.call(lambda: generate(messages, stop, run_manager, **kwargs), estimate)
+        self.scheduler.settle(estimate, self._used_tokens(result))
+        return result
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        generate = super()._agenerate
+        # With streaming=True the parent delegates to _astream, which is scheduled itself
+        if self.scheduler is None or self.streaming:
+            return await generate(messages, stop, run_manager, **kwargs)
+        estimate = self._estimate_tokens(messages, kwargs)
+        result = await self.scheduler.acall(lambda: generate(messages, stop, run_manager, **kwargs), estimate)
+        self.scheduler.settle(estimate, self._used_tokens(result))
+        return result
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        stream = super()._stream
+        if self.scheduler is None:
+            yield from stream(messages, stop, run_manager, **kwargs)
+            return
+        yield from self.scheduler.stream(lambda: stream(messages, stop, run_manager, **kwargs), self._estimate_tokens(messages, kwargs))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        stream = super()._astream
+        if self.scheduler is None:
+            async for chunk in stream(messages, stop, run_manager, **kwargs):
+                yield chunk
+            return
+        chunks = self.scheduler.astream(lambda: stream(messages, stop, run_manager, **kwargs), self._estimate_tokens(messages, kwargs))
+        async for chunk in chunks:
+            yield chunk
+
+
+class ScheduledOpenAIEmbeddings(OpenAIEmbeddings):
+    """OpenAIEmbeddings whose requests are admitted and retried by an upstream scheduler"""
+
+    # upstream.UpstreamScheduler; None sends requests directly
+    scheduler: Optional[Any] = Field(default=None, exclude=True)
+
+    def _cost(self, texts: List[str], chunk_size: Optional[int]) -> Tuple[int, int]:
+        # The client sends one request per chunk_size texts
+        tokens = sum(count_tokens(text) for text in texts)
+        return tokens, max(1, -(-len(texts) // (chunk_size or self.chunk_size)))
+
+    def embed_documents(self, texts: List[str], chunk_size: Optional[int] = None, **kwargs: Any) -> List[List[float]]:
+        embed = super().embed_documents
+        if self.scheduler is None or not texts:
+            return embed(texts, chunk_size, **kwargs)
+        tokens, requests = self._cost(texts, chunk_size)
+        return self.scheduler.call(lambda: embed(texts, chunk_size, **kwargs), tokens, requests=requests)
+
+    async def aembed_documents(self, texts: List[str], chunk_size: Optional[int] = None, **kwargs: Any) -> List[List[float]]:
+        embed = super().aembed_documents
+        if self.scheduler is None or not texts:
+            return await embed(texts, chunk_size, **kwargs)
+        tokens, requests = self._cost(texts, chunk_size)
+        return await self.scheduler.acall(lambda: embed(texts, chunk_size, **kwargs), tokens, requests=requests)
+
+
+class ClientPool:
+    """Shared httpx clients plus cached LangChain model clients built on them"""
+
+    def __init__(self):
+        self.http2 = os.getenv("HTTP2", "1") == "1" and _http2_available()
+        limits = httpx.Limits(
+            max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "200")),
+            max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "50")),
+            keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60")),
+        )
+        timeout = httpx.Timeout(
+            float(os.getenv("HTTP_TIMEOUT", "60")),
+            connect=float(os.getenv("HTTP_CONNECT_TIMEOUT", "10")),
+        )
+
+        self.requests = 0
+        self.responses = 0
+        self.errors = 0
+        self.created_at = time.time()
+        self._lock = threading.Lock()
+
+        self.http_client = httpx.Client(
+            http2=self.http2,
+            limits=limits,
+            timeout=timeout,
+            event_hooks={"request": [self._on_request], "response": [self._on_response]},
+        )
+        self.http_async_client = httpx.AsyncClient(
+            http2=self.http2,
+            limits=limits,
+            timeout=timeout,
+            event_hooks={"request": [self._on_async_request], "response": [self._on_async_response]},
+        )
+
+        # Provider limits are set per API, so chat and embeddings get separate schedulers
+        self.chat_scheduler = create_upstream_scheduler("chat", requests_per_minute=3500, tokens_per_minute=200_000)
+        self.embedding_scheduler = create_upstream_scheduler("embeddings", requests_per_minute=3000, tokens_per_minute=1_000_000)
+
+        self._llms: Dict[Tuple[str, float], ChatOpenAI] = {}
+        self._embeddings: Dict[str, OpenAIEmbeddings] = {}
+
+    # httpx event hooks keep simple request/response counters for pool metrics
+    def _on_request(self, request: httpx.Request) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def _on_response(self, response: httpx.Response) -> None:
+        with self._lock:
+            self.responses += 1
+            if response.status_code >= 400:
+                self.errors += 1
+
+    async def _on_async_request(self, request: httpx.Request) -> None:
+        self._on_request(request)
+
+    async def _on_async_response(self, response: httpx.Response) -> None:
+        self._on_response(response)
+
+    def llm(self, model: str = DEFAULT_CHAT_MODEL, temperature: float = 0.7) -> ChatOpenAI:
+        """Get the shared chat model client for a model and temperature"""
+        key = (model, temperature)
+        with self._lock:
+            if key not in self._llms:
+                self._llms[key] = ScheduledChatOpenAI(
+                    scheduler=self.chat_scheduler,
+                    # The scheduler retries with backoff shared across requests
+                    max_retries=0,
+                    model_name=model,
+                    temperature=temperature,
+                    openai_api_key=os.getenv("OPENAI_API_KEY"),
+                    openai_api_base=OPENAI_BASE_URL,
+                    http_client=self.http_client,
+                    http_async_client=self.http_async_client,
+                )
+            return self._llms[key]
+
+    def embeddings(self, model: Optional[str] = None) -> OpenAIEmbeddings:
+        """Get the shared embeddings client for a model"""
+        model = model or os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+        with self._lock:
+            if model not in self._embeddings:
+                self._embeddings[model] = ScheduledOpenAIEmbeddings(
+                    scheduler=self.embedding_scheduler,
+                    max_retries=0,
+                    model=model,
+                    openai_api_key=os.getenv("OPENAI_API_KEY"),
+                    openai_api_base=OPENAI_BASE_URL,
+                    check_embedding_ctx_length=EMBEDDING_CHECK_CTX_LENGTH,
+                    http_client=self.http_client,
+                    http_async_client=self.http_async_client,
+                )
+            return self._embeddings[model]
+
+    @staticmethod
+    def _pool_stats(client) -> Dict[str, Any]:
+        # httpcore does not expose pool metrics publicly, so inspect defensively
+        try:
+            connections = list(client._transport._pool.connections)
+        except AttributeError:
+            return {}
+        return {
+            "connections": len(connections),
+            "idle": sum(1 for connection in connections if connection.is_idle()),
+            "http2": sum(
+                1 for connection in connections
+                if type(getattr(connection, "_connection", None)).__name__.endswith("HTTP2Connection")
+            ),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Return request counters and connection pool metrics"""
+        with self._lock:
+            counters = {
+                "requests": self.requests,
+                "responses": self.responses,
+                "errors": self.errors,
+                "in_flight": self.requests - self.responses,
+            }
+            model_clients = {
+                "chat_models": [f"{model}@{temperature}" for model, temperature in self._llms],
+                "embedding_models": list(self._embeddings),
+            }
+        return {
+            "http2_enabled": self.http2,
+            "uptime_seconds": round(time.time() - self.created_at, 1),
+            **counters,
+            "sync_pool": self._pool_stats(self.http_client),
+            "async_pool": self._pool_stats(self.http_async_client),
+            **model_clients,
+            "upstream": {
+                "chat": self.chat_scheduler.stats(),
+                "embeddings": self.embedding_scheduler.stats(),
+            },
+        }
+
+    async def aclose(self) -> None:
+        """Close both HTTP clients"""
+        self.http_client.close()
+        await self.http_async_client.aclose()
+
+
+_client_pool: Optional[ClientPool] = None
+_client_pool_lock = threading.Lock()
+
+
+def get_client_pool() -> ClientPool:
+    """Get the process-wide client pool, creating it on first use"""
+    global _client_pool
+    with _client_pool_lock:
+        if _client_pool is None:
+            _client_pool = ClientPool()
+        return _client_pool
+
+
+def peek_client_pool() -> Optional[ClientPool]:
+    """Get the process-wide client pool only if it has already been created"""
+    return _client_pool
+
+
+async def close_client_pool() -> None:
+    """Close the process-wide client pool if it was created"""
+    global _client_pool
+    with _client_pool_lock:
+        pool, _client_pool = _client_pool, None
+    if pool is not None:
+        await pool.aclose()
@@ -0,0 +1,290 @@
+"""
+Local code pre-analysis.
+
+Detects the language of a snippet (``ast`` for Python, lexical signatures
+for other languages) and computes cyclomatic complexity and size metrics
+deterministically, so the LLM only has to write suggestions and an
+explanation.
+"""
+
+import ast
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# (language, [(pattern, weight)]); distinctive signatures weigh more
+LANGUAGE_SIGNATURES: List[Tuple[str, List[Tuple[str, int]]]] = [
+    ("Python", [
+        (r"^\s*def \w+\(.*\)\s*(->\s*[^:]+)?:\s*$", 3),
+        (r"^\s*from [\w.]+ import ", 3),
+        (r"^\s*import [\w.]+(\s+as \w+)?\s*$", 1),
+        (r"^\s*class \w+(\(.*\))?:\s*$", 3),
+        (r"^\s*elif .*:\s*$", 3),
+        (r"\bself\.", 1),
+        (r"__name__|__init__", 2),
+        (r"\bprint\(", 1),
+    ]),
+    ("JavaScript", [
+        (r"\b(const|let|var) \w+\s*=", 2),
+        (r"\bfunction\s*\w*\s*\(", 2),
+        (r"=>", 1),
+        (r"console\.log\(", 3),
+        (r"\brequire\(['\"]", 3),
+        (r"\bmodule\.exports\b|\bexport (default )?", 2),
+        (r"===|!==", 2),
+        (r"\bdocument\.|\bwindow\.", 2),
+    ]),
+    ("TypeScript", [
+        (r"\b(const|let) \w+\s*:\s*\w+", 3),
+        (r"\(\s*\w+\s*:\s*(string|number|boolean|any|unknown)\b", 3),
+        (r"\binterface \w+\s*\{", 3),
+        (r"^\s*type \w+\s*=", 3),
+        (r"\bexport (default )?", 1),
+        (r"=>", 1),
+        (r"console\.log\(", 1),
+    ]),
+    ("Java", [
+        (r"\bpublic\s+(static\s+)?(final\s+)?(class|void|int|String|boolean)\b", 3),
+        (r"System\.out\.print", 3),
+        (r"^\s*import java\.", 3),
+        (r"@Override", 2),
+        (r"String\[\]\s+\w+", 2),
+        (r"\bprivate\s+(final\s+)?\w+\s+\w+\s*[;=]", 2),
+    ]),
+    ("C#", [
+        (r"^\s*using System", 3),
+        (r"\bnamespace [\w.]+", 2),
+        (r"Console\.Write(Line)?\(", 3),
+        (r"\{\s*get;\s*(set;)?\s*\}", 3),
+        (r"\bvar \w+\s*=\s*new\b", 2),
+    ]),
+    ("C++", [
+        (r"#include\s*<\w+>", 3),
+        (r"\bstd::", 3),
+        (r"\bcout\s*<<|\bcin\s*>>", 3),
+        (r"\btemplate\s*<", 3),
+        (r"\bint main\s*\(", 1),
+    ]),
+    ("C", [
+        (r"#include\s*<\w+\.h>", 3),
+        (r"\bprintf\(|\bscanf\(", 2),
+        (r"\bmalloc\(|\bfree\(", 2),
+        (r"\bint main\s*\(", 1),
+        (r"\bstruct \w+\s*\{", 1),
+    ]),
+    ("Go", [
+        (r"^package \w+", 3),
+        (r"\bfunc (\(\w+ \*?\w+\) )?\w+\s*\(", 3),
+        (r":=", 1),
+        (r"\bfmt\.", 3),
+    ]),
+    ("Rust", [
+        (r"\bfn \w+\s*(<[^>]*>)?\s*\(", 3),
+        (r"\blet mut\b", 3),
+        (r"\w+!\(", 1),
+        (r"\bimpl\b|\bpub fn\b", 3),
+        (r"&str\b|&mut\b", 2),
+    ]),
+    ("Ruby", [
+        (r"^\s*def \w+[?!]?(\(.*\))?\s*$", 2),
+        (r"^\s*end\s*$", 2),
+        (r"\bputs\b", 2),
+        (r"\.each( do|\s*\{)", 3),
+        (r"^\s*require ['\"]", 2),
+    ]),
+    ("PHP", [
+        (r"<\?php", 5),
+        (r"\$\w+\s*=", 1),
+        (r"\becho\b", 1),
+        (r"\$this->", 3),
+        (r"function \w+\s*\(\$", 3),
+    ]),
+    ("Shell", [
+        (r"^#!/(usr/)?bin/(env )?(ba|z)?sh", 5),
+        (r"^\s*(fi|done|esac)\s*$", 3),
+        (r"^\s*if \[\[? ", 3),
+        (r"^\s*echo\b", 1),
+        (r"\$\{\w+\}", 1),
+    ]),
+    ("SQL", [
+        (r"(?i)\bselect\b[\s\S]+?\bfrom\b", 3),
+        (r"(?i)\binsert\s+into\b", 3),
+        (r"(?i)\bcreate\s+table\b", 3),
+        (r"(?i)\bupdate\s+\w+\s+set\b", 3),
+        (r"(?i)\bwhere\b", 1),
+    ]),
+    ("HTML", [
+        (r"(?i)<!DOCTYPE html>|<html", 5),
+        (r"</(div|span|p|body|head|ul|li|a)>", 3),
+    ]),
+]
+
+HASH_COMMENT_LANGUAGES = {"Python", "Ruby", "Shell"}
+BRANCH_KEYWORDS = re.compile(r"\b(if|elif|elsif|unless|for|foreach|while|until|case|catch|rescue|except)\b")
+SQL_BRANCH_KEYWORDS = re.compile(r"(?i)\b(when|and|or)\b")
+STRING_LITERAL = re.compile(r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|`(?:\\.|[^`\\])*`')
+FUNCTION_DEFINITION = re.compile(
+    r"\b(def|function|func|fn)\s+\w+|^\s*(public|private|protected|static|\w+)[\w<>\[\],\s*&]*\s\**\w+\s*\([^;{)]*\)\s*\{",
+    re.MULTILINE,
+)
+
+
+def _parse_python(code: str) -> Optional[ast.AST]:
+    try:
+        return ast.parse(code)
+    # Deeply nested input exhausts the parser's recursion limit or memory instead of raising SyntaxError
+    except (SyntaxError, ValueError, RecursionError, MemoryError):
+        return None
+
+
+def _parses_as_python(code: str) -> bool:
+    return _parse_python(code) is not None
+
+
+def detect_language(code: str) -> str:
+    """Detect the programming language of a snippet"""
+    scores = {}
+    for language, signatures in LANGUAGE_SIGNATURES:
+        scores[language] = sum(
+            weight for pattern, weight in signatures
+            if re.search(pattern, code, re.MULTILINE)
+        )
+    if _parses_as_python(code):
+        scores["Python"] += 2
+
+    # Ties go to the language listed first
+    language = max(scores, key=scores.get)
+    return language if scores[language] > 0 else "Unknown"
+
+
+def _strip_comments_and_strings(code: str, language: str) -> str:
+    code = STRING_LITERAL.sub('""', code)
+    if language in HASH_COMMENT_LANGUAGES:
+        return re.sub(r"#.*", "", code)
+    if language == "SQL":
+        return re.sub(r"--.*", "", code)
+    if language == "HTML":
+        return re.sub(r"<!--[\s\S]*?-->", "", code)
+    code = re.sub(r"/\*[\s\S]*?\*/", "", code)
+    return re.sub(r"(?<!:)//.*", "", code)
+
+
+def _line_counts(code: str, language: str) -> Dict[str, int]:
+    lines = code.splitlines()
+    stripped = _strip_comments_and_strings(code, language).splitlines()
+    blank = sum(1 for line in lines if not line.strip())
+    code_lines = sum(1 for line in stripped if line.strip())
+    return {
+        "lines": len(lines),
+        "code_lines": code_lines,
+        "comment_lines": max(len(lines) - blank - code_lines, 0),
+        "blank_lines": blank,
+    }
+
+
+class _PythonComplexity(ast.NodeVisitor):
+    """Count decision points, definitions and nesting in a Python syntax tree"""
+
+    BRANCHES = (ast.If, ast.For, ast.AsyncFor, ast.While, ast.IfExp, ast.ExceptHandler, ast.Assert)
+    BLOCKS = (ast.If, ast.For, ast.AsyncFor, ast.While, ast.With, ast.AsyncWith, ast.Try,
+              ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+    def __init__(self):
+        self.decisions = 0
+        self.functions = 0
+        self.classes = 0
+        self.depth = 0
+        self.max_depth = 0
+
+    def generic_visit(self, node):
+        if isinstance(node, self.BRANCHES):
+            self.decisions += 1
+        elif isinstance(node, ast.BoolOp):
+            self.decisions += len(node.values) - 1
+        elif isinstance(node, ast.comprehension):
+            self.decisions += 1 + len(node.ifs)
+        elif hasattr(ast, "match_case") and isinstance(node, ast.match_case):
+            self.decisions += 1
+
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            self.functions += 1
+        elif isinstance(node, ast.ClassDef):
+            self.classes += 1
+
+        if isinstance(node, self.BLOCKS):
+            self.depth += 1
+            self.max_depth = max(self.max_depth, self.depth)
+            super().generic_visit(node)
+            self.depth -= 1
+        else:
+            super().generic_visit(node)
+
+
+def _python_metrics(tree: ast.AST) -> Dict[str, int]:
+    visitor = _PythonComplexity()
+    visitor.visit(tree)
+    return {
+        "cyclomatic_complexity": 1 + visitor.decisions,
+        "functions": visitor.functions,
+        "classes": visitor.classes,
+        "max_nesting": visitor.max_depth,
+    }
+
+
+def _lexical_metrics(code: str, language: str) -> Dict[str, int]:
+    body = _strip_comments_and_strings(code, language)
+    decisions = len(BRANCH_KEYWORDS.findall(body)) + body.count("&&") + body.count("||")
+    decisions += len(re.findall(r"\s\?\s", body))
+    if language == "SQL":
+        decisions = len(SQL_BRANCH_KEYWORDS.findall(body))
+
+    # Brace depth for C-like languages, indentation depth otherwise
+    if "{" in body:
+        depth = max_depth = 0
+        for char in body:
+            if char == "{":
+                depth += 1
+                max_depth = max(max_depth, depth)
+            elif char == "}":
+                depth = max(depth - 1, 0)
+    else:
+        indents = [len(line) - len(line.lstrip()) for line in body.splitlines() if line.strip()]
+        unit = min((indent for indent in indents if indent), default=0)
+        max_depth = max(indents, default=0) // unit if unit else 0
+
+    return {
+        "cyclomatic_complexity": 1 + decisions,
+        "functions": len(FUNCTION_DEFINITION.findall(body)),
+        "classes": len(re.findall(r"\b(class|struct)\s+\w+", body)),
+        "max_nesting": max_depth,
+    }
+
+
+def complexity_level(metrics: Dict[str, int]) -> str:
+    """Map metrics to the simple / moderate / complex scale used by the API"""
+    complexity = metrics["cyclomatic_complexity"]
+    if complexity > 15 or metrics["max_nesting"] > 4 or metrics["code_lines"] > 300:
+        return "complex"
+    if complexity <= 5 and metrics["max_nesting"] <= 2 and metrics["code_lines"] <= 40:
+        return "simple"
+    return "moderate"
+
+
+def analyze_code(code: str) -> Dict[str, Any]:
+    """Return the detected language, complexity level and metrics for a snippet"""
+    language = detect_language(code)
+    metrics = None
+    tree = _parse_python(code) if language == "Python" else None
+    if tree is not None:
+        try:
+            metrics = _python_metrics(tree)
+        except RecursionError:
+            # A tree that parsed can still be too deep for the visitor
+            metrics = None
+    if metrics is None:
+        metrics = _lexical_metrics(code, language)
+    metrics.update(_line_counts(code, language))
+    return {
+        "language": language,
+        "complexity": complexity_level(metrics),
+        "metrics": metrics,
+    }
@@ -5,6 +5,7 @@ from langchain.prompts import ChatPromptTemplate
 from langchain.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
 from typing import List
+from chains import ChainRegistry
 
 # Load environment variables
 load_dotenv()
@@ -16,53 +17,45 @@ class CodeAnalysis(BaseModel):
     suggestions: List[str] = Field(description="List of improvement suggestions")
     explanation: str = Field(description="Brief explanation of what the code does")
 
-def create_code_assistant():
-    """Create a code analysis assistant"""
+# Prompts and parsers are built once per process and shared by every chain
+ANALYSIS_PARSER = PydanticOutputParser(pydantic_object=CodeAnalysis)
+
+ANALYSIS_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are an expert code reviewer and programmer. 
+    Analyze the provided code and provide insights about:
+    1. Programming language
+    2. Code complexity
+    3. Improvement suggestions
+    4. What the code does
     
-    llm = ChatOpenAI(
+    {format_instructions}"""),
+    ("user", "Analyze this code:\n{code}")
+]).partial(format_instructions=ANALYSIS_PARSER.get_format_instructions())
+
+GENERATION_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are an expert programmer. Generate clean, well-documented code based on the user's requirements."),
+    ("user", "Generate code for: {requirement}")
+])
+
+def create_llm(temperature: float):
+    """Create an OpenAI chat model"""
+    return ChatOpenAI(
         model_name="gpt-3.5-turbo",
-        temperature=0.1,
+        temperature=temperature,
         openai_api_key=os.getenv("OPENAI_API_KEY")
     )
-    
-    # Create output parser
-    parser = PydanticOutputParser(pydantic_object=CodeAnalysis)
-    
-    # Create prompt template
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", """You are an expert code reviewer and programmer. 
-        Analyze the provided code and provide insights about:
-        1. Programming language
-        2. Code complexity
-        3. Improvement suggestions
-        4. What the code does
-        
-        {format_instructions}"""),
-        ("user", "Analyze this code:\n{code}")
-    ])
-    
-    # Create chain
-    chain = prompt | llm | parser
-    
-    return chain
+
+code_chains = ChainRegistry()
+code_chains.register("analysis", lambda llm: ANALYSIS_PROMPT | llm | ANALYSIS_PARSER, default_llm=lambda: create_llm(0.1))
+code_chains.register("generation", lambda llm: GENERATION_PROMPT | llm, default_llm=lambda: create_llm(0.7))
+
+def create_code_assistant():
+    """Create a code analysis assistant"""
+    return code_chains.get("analysis")
 
 def code_generation_assistant():
     """Create a code generation assistant"""
-    
-    llm = ChatOpenAI(
-        model_name="gpt-3.5-turbo",
-        temperature=0.7,
-        openai_api_key=os.getenv("OPENAI_API_KEY")
-    )
-    
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are an expert programmer. Generate clean, well-documented code based on the user's requirements."),
-        ("user", "Generate code for: {requirement}")
-    ])
-    
-    chain = prompt | llm
-    
-    return chain
+    return code_chains.get("generation")
 
 def interactive_code_assistant():
     """Interactive code assistant session"""
@@ -92,10 +85,7 @@ def interactive_code_assistant():
             
             if code.strip():
                 try:
-                    result = analysis_chain.invoke({
-                        "code": code,
-                        "format_instructions": analysis_chain.parser.get_format_instructions()
-                    })
+                    result = analysis_chain.invoke({"code": code})
                     
                     print(f"\n🔍 Analysis Results:")
                     print(f"Language: {result.language}")
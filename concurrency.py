@@ -0,0 +1,83 @@
+"""
+Helpers for keeping blocking work off the event loop.
+
+Components that only offer a synchronous API (file I/O, text splitting, FAISS
+index construction) run on a bounded thread pool, and each endpoint gets its
+own concurrency limit so one slow endpoint cannot starve the others.
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Optional
+
+DEFAULT_ENDPOINT_CONCURRENCY = 256
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SYNC_WORKER_THREADS", "16")),
+    thread_name_prefix="sync-worker",
+)
+
+
+async def run_sync(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run a blocking callable on the bounded worker pool and await its result"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await loop.run_in_executor(_executor, call)
+
+
+class EndpointLimiter:
+    """Per-endpoint concurrency limits backed by asyncio semaphores
+
+    The limit for an endpoint is read from ``ENDPOINT_CONCURRENCY_<NAME>``
+    (e.g. ``ENDPOINT_CONCURRENCY_CHAT``), falling back to
+    ``ENDPOINT_CONCURRENCY`` and then to the default.
+    """
+
+    def __init__(self, default_limit: Optional[int] = None):
+        self.default_limit = default_limit or int(
+            os.getenv("ENDPOINT_CONCURRENCY", str(DEFAULT_ENDPOINT_CONCURRENCY))
+        )
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._limits: Dict[str, int] = {}
+        self._in_flight: Dict[str, int] = {}
+        # The dicts change on the event loop, but stats() is also read from worker threads (metrics scrapes)
+        self._lock = threading.Lock()
+
+    def get_limit(self, endpoint: str) -> int:
+        """Return the configured limit for an endpoint"""
+        with self._lock:
+            if endpoint not in self._limits:
+                env_name = "ENDPOINT_CONCURRENCY_" + endpoint.upper().replace("-", "_")
+                self._limits[endpoint] = int(os.getenv(env_name, str(self.default_limit)))
+            return self._limits[endpoint]
+
+    @asynccontextmanager
+    async def limit(self, endpoint: str):
+        """Wait for a free slot on an endpoint, holding it for the duration of the block"""
+        semaphore = self._semaphores.get(endpoint)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.get_limit(endpoint))
+            with self._lock:
+                semaphore = self._semaphores.setdefault(endpoint, semaphore)
+        async with semaphore:
+            with self._lock:
+                self._in_flight[endpoint] = self._in_flight.get(endpoint, 0) + 1
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self._in_flight[endpoint] -= 1
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Return in-flight counts and limits per endpoint"""
+        with self._lock:
+            return {
+                endpoint: {"in_flight": self._in_flight.get(endpoint, 0), "limit": self._limits[endpoint]}
+                for endpoint in self._semaphores
+            }
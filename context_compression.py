@@ -0,0 +1,149 @@
+"""
+Post-retrieval context compression.
+
+Before retrieved chunks are "stuffed" into the QA prompt they are reranked
+against the question, filtered for redundancy with maximal marginal
+relevance (MMR), and cut down to the sentences that share terms with the
+question until a token budget is reached. Everything runs locally on the
+chunk vectors already stored in the index and on the BM25 statistics, so
+no extra model or embeddings call is made.
+"""
+
+import os
+import re
+from typing import Callable, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+from chat_memory import count_tokens
+from hybrid_retrieval import tokenize
+
+COMPRESSION_ENABLED = os.getenv("RETRIEVAL_COMPRESSION", "0") == "1"
+COMPRESSION_TOKEN_BUDGET = int(os.getenv("COMPRESSION_TOKEN_BUDGET", "400"))
+COMPRESSION_CANDIDATES = int(os.getenv("COMPRESSION_CANDIDATES", "8"))
+COMPRESSION_MMR_LAMBDA = float(os.getenv("COMPRESSION_MMR_LAMBDA", "0.7"))
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def _unit_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def maximal_marginal_relevance(relevance: np.ndarray, vectors: Optional[np.ndarray], k: int, mmr_lambda: float) -> List[int]:
+    """Pick k items balancing relevance against similarity to items already picked"""
+    order = list(np.argsort(-relevance, kind="stable"))
+    if vectors is None or len(order) <= 1:
+        return order[:k]
+    similarity = _unit_rows(vectors) @ _unit_rows(vectors).T
+    selected = [order[0]]
+    remaining = order[1:]
+    while remaining and len(selected) < k:
+        scores = [
+            mmr_lambda * relevance[item] - (1 - mmr_lambda) * max(similarity[item, chosen] for chosen in selected)
+            for item in remaining
+        ]
+        best = remaining[int(np.argmax(scores))]
+        selected.append(best)
+        remaining.remove(best)
+    return selected
+
+
+class ContextCompressor:
+    """Rerank, MMR-filter and sentence-extract retrieved chunks under a token budget"""
+
+    def __init__(
+        self,
+        token_budget: int = COMPRESSION_TOKEN_BUDGET,
+        candidates: int = COMPRESSION_CANDIDATES,
+        mmr_lambda: float = COMPRESSION_MMR_LAMBDA,
+    ):
+        self.token_budget = token_budget
+        self.candidates = candidates
+        self.mmr_lambda = mmr_lambda
+
+    @staticmethod
+    def _term_score(terms: List[str], query_terms: set, idf: Callable[[str], float]) -> float:
+        return sum(idf(term) for term in set(terms) & query_terms)
+
+    def compress(
+        self,
+        query: str,
+        documents: List[Document],
+        chunk_vectors: Optional[np.ndarray],
+        query_vector: Optional[List[float]],
+        k: int,
+        idf: Callable[[str], float],
+    ) -> List[Document]:
+        """Return at most k compressed documents whose text fits the token budget
+
+        Each returned document records ``chunk_tokens`` (the full chunk) and
+        ``context_tokens`` (what is sent to the model) in its metadata, plus
+        ``baseline_tokens``: the full text of the k best candidates, which the
+        uncompressed path would have sent instead. ``documents`` must be in
+        retrieval order.
+        """
+        if not documents:
+            return []
+        baseline_tokens = sum(count_tokens(document.page_content) for document in documents[:k])
+        query_terms = set(tokenize(query))
+
+        # Rerank by cosine similarity to the question, or by weighted term overlap without a question vector
+        if chunk_vectors is not None and query_vector is not None:
+            query_unit = _unit_rows(np.asarray([query_vector], dtype=np.float32))[0]
+            relevance = _unit_rows(chunk_vectors) @ query_unit
+        else:
+            relevance = np.asarray([
+                self._term_score(tokenize(document.page_content), query_terms, idf) for document in documents
+            ], dtype=np.float32)
+            if relevance.max() > 0:
+                relevance /= relevance.max()
+        chosen = maximal_marginal_relevance(relevance, chunk_vectors, k, self.mmr_lambda)
+
+        # Score every sentence of the chosen chunks, then keep the best until the budget is spent
+        sentences = []
+        for rank, item in enumerate(chosen):
+            for position, sentence in enumerate(SENTENCE_BOUNDARY.split(documents[item].page_content)):
+                if sentence.strip():
+                    score = self._term_score(tokenize(sentence), query_terms, idf)
+                    # Ties favour more relevant chunks, then earlier sentences
+                    sentences.append((-score, rank, position, item, sentence.strip(), count_tokens(sentence)))
+        sentences.sort()
+
+        kept = {item: [] for item in chosen}
+        spent = 0
+        for _, _, position, item, sentence, tokens in sentences:
+            if spent + tokens > self.token_budget:
+                continue
+            kept[item].append((position, sentence))
+            spent += tokens
+
+        compressed = []
+        for item in chosen:
+            if not kept[item]:
+                continue
+            document = documents[item]
+            text = " ".join(sentence for _, sentence in sorted(kept[item]))
+            compressed.append(Document(
+                page_content=text,
+                metadata={
+                    **document.metadata,
+                    "chunk_tokens": count_tokens(document.page_content),
+                    "context_tokens": count_tokens(text),
+                    "baseline_tokens": baseline_tokens,
+                },
+            ))
+        return compressed
+
+
+def compression_report(documents: List[Document]) -> Optional[dict]:
+    """Sum the prompt tokens saved by compression, against the k chunks the uncompressed path would have sent"""
+    if not documents or any("baseline_tokens" not in document.metadata for document in documents):
+        return None
+    # Chunks dropped by reranking, MMR or the budget count too
+    before = documents[0].metadata["baseline_tokens"]
+    after = sum(document.metadata["context_tokens"] for document in documents)
+    return {"chunk_tokens": before, "context_tokens": after, "tokens_saved": before - after}
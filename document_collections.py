@@ -0,0 +1,441 @@
+"""
+Persistent named document collections.
+
+Each collection is an on-disk FAISS index plus a manifest of which chunks
+belong to which document. Writes never rewrite the index: the chunks of an
+upsert are appended as a small segment file, and the chunks of replaced or
+deleted documents are listed as deleted in the manifest. Once the segments
+and deletions pending reach a share of the index (or there are too many
+segments), they are compacted into a new generation of the index.
+
+For queries, collections are loaded lazily with the compacted index
+memory-mapped read-only and shared between workers; pending segments are
+searched alongside it and deleted chunks are skipped. Only a bounded number
+of collections stay loaded at once. A collection whose index type calls for
+a compressed or partitioned index gets one built at compaction, used for
+queries.
+"""
+
+import fcntl
+import json
+import os
+import pickle
+import re
+import shutil
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from vector_index import describe_index, resolve_index_type, update_index
+from vectorstore_cache import load_shared_vectorstore, read_index_mmap
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+
+INDEX_NAME = "index"
+SEARCH_INDEX_NAME = "search"
+SEGMENT_DIR = "segments"
+MANIFEST_FILE = "collection.json"
+COLLECTION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class CollectionError(Exception):
+    """Base class for collection errors"""
+
+
+class CollectionNotFound(CollectionError):
+    """Raised when a collection does not exist"""
+
+
+class CollectionExists(CollectionError):
+    """Raised when creating a collection that already exists"""
+
+
+def check_unique_ids(document_ids: List[str]) -> None:
+    """Reject a batch that names a document more than once, since each copy would replace the other"""
+    duplicates = sorted(document_id for document_id, count in Counter(document_ids).items() if count > 1)
+    if duplicates:
+        raise CollectionError(f"Duplicate document IDs in one request: {', '.join(duplicates)}")
+
+
+class CollectionStore:
+    """Manage collections under a directory, loading their indexes on demand"""
+
+    def __init__(self, root_dir: str, max_loaded: int = 8, compact_segments: int = 16, compact_ratio: float = 0.2):
+        self.root_dir = root_dir
+        self.max_loaded = max_loaded
+        # Compact once there are more segments than this, or pending chunks exceed this share of the index
+        self.compact_segments = compact_segments
+        self.compact_ratio = compact_ratio
+        os.makedirs(root_dir, exist_ok=True)
+        # name -> (read-only vector store, manifest mtime when loaded), in LRU order
+        self._loaded: "OrderedDict[str, tuple]" = OrderedDict()
+        self._loaded_lock = threading.Lock()
+        self._write_locks: Dict[str, threading.Lock] = {}
+
+    def _path(self, name: str) -> str:
+        if not COLLECTION_NAME_PATTERN.match(name):
+            raise CollectionError("Collection names may only contain letters, digits, '-' and '_'")
+        return os.path.join(self.root_dir, name)
+
+    @contextmanager
+    def _write_lock(self, name: str, create: bool = False):
+        """Serialize writers to a collection within this process and across workers"""
+        path = self._path(name)
+        if not create and not os.path.isdir(path):
+            raise CollectionNotFound(f"Collection '{name}' not found")
+        with self._loaded_lock:
+            thread_lock = self._write_locks.setdefault(name, threading.Lock())
+        with thread_lock:
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, ".lock"), "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_manifest(self, name: str) -> Dict[str, Any]:
+        path = os.path.join(self._path(name), MANIFEST_FILE)
+        if not os.path.exists(path):
+            raise CollectionNotFound(f"Collection '{name}' not found")
+        with open(path) as f:
+            return json.load(f)
+
+    def _write_manifest(self, name: str, manifest: Dict[str, Any]) -> None:
+        manifest["updated_at"] = time.time()
+        path = os.path.join(self._path(name), MANIFEST_FILE)
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, path)
+
+    def _base_names(self, manifest: Dict[str, Any]) -> Tuple[str, str]:
+        """File names of the compacted index and its search index (unnumbered for older collections)"""
+        generation = manifest.get("generation")
+        if generation is None:
+            return INDEX_NAME, SEARCH_INDEX_NAME
+        return f"{INDEX_NAME}-{generation}", f"{SEARCH_INDEX_NAME}-{generation}"
+
+    def _segment_path(self, name: str, segment_id: int) -> str:
+        return os.path.join(self._path(name), SEGMENT_DIR, f"{segment_id}.pkl")
+
+    def _write_segment(self, name: str, segment_id: int, segment: Dict[str, Any]) -> None:
+        path = self._segment_path(name, segment_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(segment, f)
+        os.replace(path + ".tmp", path)
+
+    def _read_segment(self, name: str, segment_id: int) -> Dict[str, Any]:
+        # Only segments written by this store are ever loaded from this directory
+        with open(self._segment_path(name, segment_id), "rb") as f:
+            return pickle.load(f)
+
+    def _prepare_write(self, manifest: Dict[str, Any]) -> Dict[str, Any]:
+        """Fill in the write-log fields, which collections created before them lack"""
+        manifest.setdefault("base_chunks", sum(len(chunk_ids) for chunk_ids in manifest["documents"].values()))
+        manifest.setdefault("segments", [])
+        manifest.setdefault("deleted", [])
+        manifest.setdefault("next_segment", 0)
+        return manifest
+
+    def _needs_compaction(self, manifest: Dict[str, Any]) -> bool:
+        pending = sum(segment["chunks"] for segment in manifest["segments"]) + len(manifest["deleted"])
+        if not pending:
+            return False
+        return len(manifest["segments"]) > self.compact_segments or pending > self.compact_ratio * manifest["base_chunks"]
+
+    def _gather(self, name: str, manifest: Dict[str, Any]):
+        """Live chunk IDs, documents and vectors of a collection, in index order
+
+        Also returns how many leading vectors keep their positions in the
+        compacted index: all of them if none were deleted from it, else none.
+        """
+        import faiss
+        import numpy as np
+
+        path = self._path(name)
+        index_name, _ = self._base_names(manifest)
+        deleted = set(manifest.get("deleted", []))
+        chunk_ids: List[str] = []
+        documents: Dict[str, Any] = {}
+        blocks = []
+        unchanged = 0
+        if os.path.exists(os.path.join(path, f"{index_name}.faiss")):
+            index = faiss.read_index(os.path.join(path, f"{index_name}.faiss"))
+            with open(os.path.join(path, f"{index_name}.pkl"), "rb") as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+            keep = [position for position in range(index.ntotal) if index_to_docstore_id[position] not in deleted]
+            blocks.append(index.reconstruct_n(0, index.ntotal)[keep])
+            unchanged = index.ntotal if len(keep) == index.ntotal else 0
+            for position in keep:
+                chunk_id = index_to_docstore_id[position]
+                chunk_ids.append(chunk_id)
+                documents[chunk_id] = docstore.search(chunk_id)
+        for segment in manifest.get("segments", []):
+            for chunk_id, document, vector in self._segment_entries(name, segment["id"], deleted):
+                chunk_ids.append(chunk_id)
+                documents[chunk_id] = document
+                blocks.append(vector[None, :])
+        vectors = np.vstack(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+        return chunk_ids, documents, vectors, unchanged
+
+    def _segment_entries(self, name: str, segment_id: int, deleted: set):
+        """(chunk ID, document, vector) of the chunks in a segment that have not been deleted since"""
+        from langchain_core.documents import Document
+
+        segment = self._read_segment(name, segment_id)
+        for chunk_id, text, metadata, vector in zip(segment["ids"], segment["texts"], segment["metadatas"], segment["vectors"]):
+            if chunk_id not in deleted:
+                yield chunk_id, Document(page_content=text, metadata=metadata), vector
+
+    def _compact(self, name: str, manifest: Dict[str, Any]) -> List[str]:
+        """Merge the segments into a new generation of the index, without the deleted chunks
+
+        The new files get new names and the manifest switches to them in one
+        write, so a crash leaves the previous generation in use, and readers
+        that have memory-mapped the old files keep valid pages until they
+        reload. Returns the files that the new generation replaces.
+        """
+        import faiss
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+
+        path = self._path(name)
+        old_index, old_search = self._base_names(manifest)
+        chunk_ids, documents, vectors, unchanged = self._gather(name, manifest)
+        replaced = [os.path.join(path, f"{old_index}.faiss"), os.path.join(path, f"{old_index}.pkl"), os.path.join(path, f"{old_search}.faiss")]
+        replaced.extend(self._segment_path(name, segment["id"]) for segment in manifest["segments"])
+
+        manifest["generation"] = manifest.get("generation", -1) + 1
+        index_name, search_name = self._base_names(manifest)
+        manifest.update(base_chunks=len(chunk_ids), segments=[], deleted=[], index=None)
+        if not chunk_ids:
+            return replaced
+
+        index = faiss.IndexFlatL2(vectors.shape[1])
+        index.add(vectors)
+        faiss.write_index(index, os.path.join(path, f"{index_name}.faiss"))
+        with open(os.path.join(path, f"{index_name}.pkl"), "wb") as f:
+            pickle.dump((InMemoryDocstore(documents), dict(enumerate(chunk_ids))), f)
+        # The flat index stays the source of the vectors; queries use a search index when the type calls for one
+        resolved = resolve_index_type(manifest.get("settings", {}).get("index_type"), len(chunk_ids))
+        if resolved == "flat":
+            manifest["index"] = describe_index(index)
+        else:
+            # The previous search index keeps its training unless the collection has outgrown it
+            old_search_path = os.path.join(path, f"{old_search}.faiss")
+            previous = faiss.read_index(old_search_path) if os.path.exists(old_search_path) else None
+            search_index = update_index(previous, vectors, unchanged, resolved)
+            faiss.write_index(search_index, os.path.join(path, f"{search_name}.faiss"))
+            manifest["index"] = describe_index(search_index)
+        return replaced
+
+    def _commit(self, name: str, manifest: Dict[str, Any]) -> None:
+        """Write the manifest after a change, compacting first once enough changes are pending"""
+        replaced = self._compact(name, manifest) if self._needs_compaction(manifest) else []
+        self._write_manifest(name, manifest)
+        for path in replaced:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._unload(name)
+
+    def _unload(self, name: str) -> None:
+        with self._loaded_lock:
+            self._loaded.pop(name, None)
+
+    def create(self, name: str, embedding_model: str, **settings: Any) -> Dict[str, Any]:
+        """Create an empty collection"""
+        path = self._path(name)
+        with self._write_lock(name, create=True):
+            if os.path.exists(os.path.join(path, MANIFEST_FILE)):
+                raise CollectionExists(f"Collection '{name}' already exists")
+            manifest = {
+                "name": name,
+                "embedding_model": embedding_model,
+                "settings": settings,
+                "created_at": time.time(),
+                "documents": {},
+            }
+            self._write_manifest(name, manifest)
+        return self.describe(name)
+
+    def delete(self, name: str) -> None:
+        """Delete a collection and its index"""
+        path = self._path(name)
+        with self._write_lock(name):
+            if not os.path.exists(os.path.join(path, MANIFEST_FILE)):
+                raise CollectionNotFound(f"Collection '{name}' not found")
+            self._unload(name)
+            shutil.rmtree(path)
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(os.path.join(self._path(name), MANIFEST_FILE))
+
+    def manifest(self, name: str) -> Dict[str, Any]:
+        """Return the stored manifest of a collection"""
+        return self._read_manifest(name)
+
+    def describe(self, name: str) -> Dict[str, Any]:
+        """Summarize a collection without loading its index"""
+        manifest = self._read_manifest(name)
+        with self._loaded_lock:
+            loaded = name in self._loaded
+        return {
+            "name": name,
+            "embedding_model": manifest["embedding_model"],
+            "settings": manifest.get("settings", {}),
+            "index": manifest.get("index"),
+            "segments": len(manifest.get("segments", [])),
+            "document_count": len(manifest["documents"]),
+            "chunk_count": sum(len(chunk_ids) for chunk_ids in manifest["documents"].values()),
+            "loaded": loaded,
+            "created_at": manifest["created_at"],
+            "updated_at": manifest["updated_at"],
+        }
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Summarize all collections"""
+        names = sorted(
+            entry for entry in os.listdir(self.root_dir)
+            if os.path.exists(os.path.join(self.root_dir, entry, MANIFEST_FILE))
+        )
+        return [self.describe(name) for name in names]
+
+    def _open(self, name: str, manifest: Dict[str, Any], embeddings) -> Optional["FAISS"]:
+        """Build the read-only view of a collection: the shared index, minus deleted chunks, plus the segments"""
+        import faiss
+        import numpy as np
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+        from langchain_community.vectorstores import FAISS
+
+        path = self._path(name)
+        index_name, search_name = self._base_names(manifest)
+        deleted = set(manifest.get("deleted", []))
+        vectorstore = None
+        if os.path.exists(os.path.join(path, f"{index_name}.faiss")):
+            vectorstore = load_shared_vectorstore(path, embeddings, index_name)
+            search_path = os.path.join(path, f"{search_name}.faiss")
+            if os.path.exists(search_path):
+                # Same positions as the flat index, so the docstore mapping applies unchanged
+                vectorstore.index = read_index_mmap(search_path)
+            if deleted:
+                # Deleted chunks stay in the shared index until compaction; retrieval skips unmapped positions
+                mapping = vectorstore.index_to_docstore_id
+                removed = [position for position, chunk_id in mapping.items() if chunk_id in deleted]
+                vectorstore.docstore.delete([mapping.pop(position) for position in removed])
+
+        entries = [
+            entry
+            for segment in manifest.get("segments", [])
+            for entry in self._segment_entries(name, segment["id"], deleted)
+        ]
+        if not entries:
+            return vectorstore if vectorstore is not None and vectorstore.index_to_docstore_id else None
+
+        vectors = np.vstack([vector for _, _, vector in entries]).astype(np.float32)
+        recent = faiss.IndexFlatL2(vectors.shape[1])
+        recent.add(vectors)
+        if vectorstore is None:
+            start = 0
+            vectorstore = FAISS(embeddings, recent, InMemoryDocstore(), {})
+        else:
+            # Search the shared index and the recent chunks together, numbering positions across both
+            start = vectorstore.index.ntotal
+            shards = faiss.IndexShards(vectors.shape[1], False, True)
+            shards.add_shard(vectorstore.index)
+            shards.add_shard(recent)
+            vectorstore.index = shards
+        vectorstore.docstore.add({chunk_id: document for chunk_id, document, _ in entries})
+        for offset, (chunk_id, _, _) in enumerate(entries):
+            vectorstore.index_to_docstore_id[start + offset] = chunk_id
+        return vectorstore
+
+    def load(self, name: str, embeddings) -> Optional["FAISS"]:
+        """Return a read-only vector store for queries, memory-mapping the index on first use"""
+        path = self._path(name)
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        try:
+            manifest_mtime = os.path.getmtime(manifest_path)
+        except FileNotFoundError:
+            self._unload(name)
+            raise CollectionNotFound(f"Collection '{name}' not found")
+
+        # Reuse the loaded index unless another process has modified the collection
+        with self._loaded_lock:
+            if name in self._loaded and self._loaded[name][1] == manifest_mtime:
+                self._loaded.move_to_end(name)
+                return self._loaded[name][0]
+
+        try:
+            vectorstore = self._open(name, self._read_manifest(name), embeddings)
+        except FileNotFoundError:
+            # A compaction in another process replaced the files after the manifest was read
+            manifest_mtime = os.path.getmtime(manifest_path)
+            vectorstore = self._open(name, self._read_manifest(name), embeddings)
+        if vectorstore is None:
+            return None
+
+        with self._loaded_lock:
+            self._loaded[name] = (vectorstore, manifest_mtime)
+            self._loaded.move_to_end(name)
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+        return vectorstore
+
+    def vectors(self, name: str):
+        """Exact vectors of the live chunks of a collection, in index order"""
+        _, _, vectors, _ = self._gather(name, self._read_manifest(name))
+        return vectors
+
+    def upsert(self, name: str, documents: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Replace or add documents given their pre-computed chunks and vectors
+
+        Each document is ``{"id", "chunks", "vectors", "metadata"}``; chunks of
+        a document that already exists are deleted before the new ones are added.
+        Document IDs must be unique within one call. The new chunks are written
+        as one segment and replaced chunks are marked deleted, so a write costs
+        the size of the change rather than of the collection.
+        """
+        import numpy as np
+
+        check_unique_ids([document["id"] for document in documents])
+        with self._write_lock(name):
+            manifest = self._prepare_write(self._read_manifest(name))
+            segment_id = manifest["next_segment"]
+            segment: Dict[str, list] = {"ids": [], "texts": [], "metadatas": [], "vectors": []}
+            removed = []
+            for document in documents:
+                removed.extend(manifest["documents"].get(document["id"], []))
+                # Numbered by segment, so a replacement never reuses the IDs of chunks awaiting compaction
+                chunk_ids = [f"{document['id']}:{segment_id}:{i}" for i in range(len(document["chunks"]))]
+                metadata = {**document.get("metadata", {}), "document_id": document["id"]}
+                segment["ids"].extend(chunk_ids)
+                segment["texts"].extend(document["chunks"])
+                segment["metadatas"].extend(dict(metadata) for _ in chunk_ids)
+                segment["vectors"].extend(document["vectors"])
+                manifest["documents"][document["id"]] = chunk_ids
+
+            if segment["ids"]:
+                segment["vectors"] = np.asarray(segment["vectors"], dtype=np.float32)
+                self._write_segment(name, segment_id, segment)
+                manifest["segments"].append({"id": segment_id, "chunks": len(segment["ids"])})
+                manifest["next_segment"] = segment_id + 1
+            manifest["deleted"].extend(removed)
+            self._commit(name, manifest)
+        return {"documents": len(documents), "chunks_added": len(segment["ids"]), "chunks_removed": len(removed)}
+
+    def delete_document(self, name: str, document_id: str) -> int:
+        """Remove one document's chunks from a collection"""
+        with self._write_lock(name):
+            manifest = self._prepare_write(self._read_manifest(name))
+            if document_id not in manifest["documents"]:
+                raise CollectionNotFound(f"Document '{document_id}' not found in collection '{name}'")
+            chunk_ids = manifest["documents"].pop(document_id)
+            manifest["deleted"].extend(chunk_ids)
+            self._commit(name, manifest)
+        return len(chunk_ids)
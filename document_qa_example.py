@@ -1,11 +1,13 @@
 import os
 from dotenv import load_dotenv
 from langchain.document_loaders import TextLoader
-from langchain.text_splitter import CharacterTextSplitter
 from langchain.embeddings import OpenAIEmbeddings
 from langchain.vectorstores import FAISS
 from langchain.chains import RetrievalQA
 from langchain.chat_models import ChatOpenAI
+from embedding_backends import get_local_embeddings
+from embedding_cache import cache_embeddings
+from text_splitting import create_token_splitter
 
 # Load environment variables
 load_dotenv()
@@ -48,15 +50,16 @@ def setup_document_qa():
     loader = TextLoader(doc_path)
     documents = loader.load()
     
-    # Split documents into chunks
-    text_splitter = CharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200
-    )
+    # Split documents into token-sized chunks on headings, paragraphs and sentences
+    text_splitter = create_token_splitter()
     texts = text_splitter.split_documents(documents)
     
-    # Create embeddings and vector store
-    embeddings = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
+    # Create embeddings (OpenAI cached per chunk on disk, or local with EMBEDDING_BACKEND=hashing) and vector store
+    backend = os.getenv("EMBEDDING_BACKEND", "openai")
+    if backend == "openai":
+        embeddings = cache_embeddings(OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY")))
+    else:
+        embeddings = get_local_embeddings(backend)
     vectorstore = FAISS.from_documents(texts, embeddings)
     
     # Create QA chain
@@ -0,0 +1,148 @@
+"""
+Local embedding backends.
+
+Retrieval normally embeds every chunk and every question with the OpenAI
+embeddings API. A local backend computes vectors on the CPU instead, so a
+deployment can index and retrieve without any network call:
+
+- ``hashing``: hashing-trick term-frequency vectors over words, word bigrams
+  and character n-grams. Stateless and deterministic, so the same text gets
+  the same vector in every process and on every host, and no model files are
+  needed.
+
+Backends are LangChain ``Embeddings`` with a ``model`` name that identifies
+their vector space; cache keys and collection manifests record it, so
+vectors from different backends or settings never mix. More backends (for
+example a small ONNX model) can be added with ``register_local_backend``.
+"""
+
+import math
+import os
+import threading
+import zlib
+from collections import Counter
+from typing import Callable, Dict, List
+
+from langchain_core.embeddings import Embeddings
+
+from concurrency import run_sync
+from hybrid_retrieval import tokenize
+
+HASHING_DIMENSIONS = int(os.getenv("HASHING_EMBEDDING_DIMENSIONS", "1024"))
+HASHING_CHAR_NGRAMS = int(os.getenv("HASHING_EMBEDDING_CHAR_NGRAMS", "3"))
+HASHING_CHAR_WEIGHT = float(os.getenv("HASHING_EMBEDDING_CHAR_WEIGHT", "0.3"))
+HASHING_BATCH_SIZE = int(os.getenv("HASHING_EMBEDDING_BATCH_SIZE", "256"))
+
+
+class HashingEmbeddings(Embeddings):
+    """Signed hashing-trick vectors of sublinear term frequencies, L2-normalized
+
+    Terms are hashed with CRC32 rather than ``hash()``, which is salted per
+    process. There is no IDF weighting: it would make a chunk's vector depend
+    on the rest of the corpus, while vectors are cached per chunk and stored
+    in indexes. Hybrid retrieval's BM25 side supplies the IDF signal.
+    """
+
+    def __init__(
+        self,
+        dimensions: int = HASHING_DIMENSIONS,
+        char_ngrams: int = HASHING_CHAR_NGRAMS,
+        char_weight: float = HASHING_CHAR_WEIGHT,
+        batch_size: int = HASHING_BATCH_SIZE,
+    ):
+        self.dimensions = dimensions
+        self.char_ngrams = char_ngrams
+        self.char_weight = char_weight
+        self.batch_size = batch_size
+        self.model = f"hashing-tf-d{dimensions}-c{char_ngrams}-w{char_weight:g}"
+        self._lock = threading.Lock()
+        self.texts_embedded = 0
+
+    def _terms(self, text: str) -> Dict[str, float]:
+        """Weighted terms of a text: words and word bigrams, plus character n-grams of each word"""
+        tokens = tokenize(text)
+        counts = Counter(tokens)
+        counts.update(f"{first} {second}" for first, second in zip(tokens, tokens[1:]))
+        weights = {term: 1.0 + math.log(count) for term, count in counts.items()}
+        if self.char_ngrams and self.char_weight:
+            n = self.char_ngrams
+            grams = Counter(
+                padded[i:i + n]
+                for padded in (f"<{token}>" for token in tokens)
+                for i in range(len(padded) - n + 1)
+            )
+            for gram, count in grams.items():
+                # Prefixed so that a gram never collides with a word of the same spelling
+                weights["#" + gram] = self.char_weight * (1.0 + math.log(count))
+        return weights
+
+    def _embed_batch(self, texts: List[str]):
+        import numpy as np
+
+        positions: List[int] = []
+        values: List[float] = []
+        for row, text in enumerate(texts):
+            offset = row * self.dimensions
+            for term, weight in self._terms(text).items():
+                code = zlib.crc32(term.encode("utf-8"))
+                positions.append(offset + code % self.dimensions)
+                # The top bit picks the sign, so collisions cancel out on average instead of adding up
+                values.append(-weight if code & 0x80000000 else weight)
+        matrix = np.bincount(
+            np.asarray(positions, dtype=np.int64),
+            weights=np.asarray(values, dtype=np.float64),
+            minlength=len(texts) * self.dimensions,
+        ).astype(np.float64, copy=False).reshape(len(texts), self.dimensions)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1.0, norms)
+        return matrix.astype(np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch(texts[start:start + self.batch_size]).tolist())
+        with self._lock:
+            self.texts_embedded += len(texts)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Large batches are CPU work; keep them off the event loop
+        if len(texts) > 1:
+            return await run_sync(self.embed_documents, texts)
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self.embed_query(text)
+
+    def stats(self) -> Dict[str, object]:
+        return {"model": self.model, "backend": "hashing", "texts_embedded": self.texts_embedded}
+
+
+_factories: Dict[str, Callable[[], Embeddings]] = {"hashing": HashingEmbeddings}
+_instances: Dict[str, Embeddings] = {}
+_instances_lock = threading.Lock()
+
+
+def register_local_backend(name: str, factory: Callable[[], Embeddings]) -> None:
+    """Make a local backend selectable by name; the factory is called once per process"""
+    with _instances_lock:
+        _factories[name] = factory
+        _instances.pop(name, None)
+
+
+def local_backends() -> List[str]:
+    """Names of the registered local backends"""
+    return sorted(_factories)
+
+
+def get_local_embeddings(name: str) -> Embeddings:
+    """Get the shared instance of a local backend"""
+    with _instances_lock:
+        if name not in _instances:
+            if name not in _factories:
+                raise ValueError(f"Unknown embedding backend '{name}'; expected openai or one of {', '.join(local_backends())}")
+            _instances[name] = _factories[name]()
+        return _instances[name]
@@ -0,0 +1,296 @@
+"""
+Persistent per-chunk embedding cache.
+
+Embeddings are stored in a local SQLite file keyed by embedding model and a
+hash of the chunk text, so overlapping documents only pay to embed the chunks
+that have never been seen before. Vectors that go unused are evicted by age
+and by a size limit.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from concurrency import run_sync
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "embeddings.sqlite3")
+
+
+def hash_text(text: str) -> str:
+    """Hash chunk text for use as a cache key"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _encode_vector(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _decode_vector(blob: bytes) -> List[float]:
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class SQLiteEmbeddingStore:
+    """Float32 embedding vectors stored in SQLite, keyed by (model, text hash)
+
+    Vectors unused for ``max_age`` seconds are deleted, and the least recently
+    used vectors go once there are more than ``max_vectors``. Deleted pages are
+    reused, so the file stops growing at about the size limit.
+    """
+
+    # SQLite limits the number of bound parameters per statement
+    _LOOKUP_BATCH = 500
+    # Last-use times are only rewritten when they are this stale, so cache hits rarely write
+    _TOUCH_INTERVAL = 3600.0
+    # Seconds between eviction passes, and between recounts of the cached vectors
+    _EVICT_INTERVAL = 60.0
+    _COUNT_TTL = 60.0
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_vectors: Optional[int] = None, max_age: Optional[float] = None):
+        self.path = path
+        self.max_vectors = max_vectors
+        self.max_age = max_age
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._last_evict = 0.0
+        self._counts: Dict[Optional[str], Tuple[int, float]] = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (model, text_hash)
+            )
+            """
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(embeddings)")]
+        if "last_used" not in columns:
+            # Caches written before eviction existed; their vectors count as the least recently used
+            self._conn.execute("ALTER TABLE embeddings ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    def get_many(self, model: str, text_hashes: List[str]) -> Dict[str, List[float]]:
+        """Return cached vectors for the given hashes (missing hashes are omitted)"""
+        found: Dict[str, List[float]] = {}
+        now = time.time()
+        stale: List[str] = []
+        with self._lock:
+            for start in range(0, len(text_hashes), self._LOOKUP_BATCH):
+                batch = text_hashes[start:start + self._LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector, last_used FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                for text_hash, blob, last_used in rows:
+                    found[text_hash] = _decode_vector(blob)
+                    if now - last_used > self._TOUCH_INTERVAL:
+                        stale.append(text_hash)
+            if stale:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, text_hash) for text_hash in stale],
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, List[float]]) -> None:
+        """Insert or replace vectors for the given hashes"""
+        if not vectors:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(model, text_hash, _encode_vector(vector), now) for text_hash, vector in vectors.items()],
+            )
+            if now - self._last_evict >= self._EVICT_INTERVAL:
+                self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        """Delete expired vectors, then the least recently used ones over the size limit"""
+        self._last_evict = now
+        deleted = 0
+        if self.max_age is not None:
+            deleted += self._conn.execute(
+                "DELETE FROM embeddings WHERE last_used < ?", (now - self.max_age,)
+            ).rowcount
+        if self.max_vectors is not None:
+            excess = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_vectors
+            if excess > 0:
+                deleted += self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN "
+                    "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                ).rowcount
+        if deleted:
+            self.evictions += deleted
+            self._counts.clear()
+
+    def record_lookup(self, hits: int, misses: int) -> None:
+        """Add to the hit and miss counters"""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def counters(self) -> Dict[str, int]:
+        """Return the hit and miss counters across all models"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def stats(self, model: Optional[str] = None) -> Dict[str, Any]:
+        """Return counters, the cached vector count (optionally for one model) and the eviction limits"""
+        return {
+            **self.counters(),
+            "cached_vectors": self.count(model),
+            "evictions": self.evictions,
+            "max_vectors": self.max_vectors,
+            "max_age": self.max_age,
+        }
+
+    def count(self, model: Optional[str] = None) -> int:
+        """Return the number of cached vectors, optionally for one model
+
+        The count is recomputed at most once a minute, so frequent metric scrapes never scan the table.
+        """
+        now = time.time()
+        with self._lock:
+            cached = self._counts.get(model)
+            if cached is not None and now - cached[1] < self._COUNT_TTL:
+                return cached[0]
+            if model is None:
+                count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            else:
+                count = self._conn.execute(
+                    "SELECT COUNT(*) FROM embeddings WHERE model = ?", (model,)
+                ).fetchone()[0]
+            self._counts[model] = (count, now)
+            return count
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends cache misses to the provider, in batches"""
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        store: SQLiteEmbeddingStore,
+        model: str,
+        batch_size: int = 256,
+    ):
+        self.underlying = underlying
+        self.store = store
+        self.model = model
+        self.batch_size = batch_size
+
+    def _lookup(self, texts: List[str]):
+        hashes = [hash_text(text) for text in texts]
+        found = self.store.get_many(self.model, list(set(hashes)))
+
+        # Embed each missing text once, even if it repeats within the request
+        missing: Dict[str, str] = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in found and text_hash not in missing:
+                missing[text_hash] = text
+
+        self.store.record_lookup(len(texts) - len(missing), len(missing))
+        return hashes, found, missing
+
+    def _batches(self, missing: Dict[str, str]):
+        items = list(missing.items())
+        for start in range(0, len(items), self.batch_size):
+            yield items[start:start + self.batch_size]
+
+    def _store_batch(self, batch, vectors) -> Dict[str, List[float]]:
+        # Round fresh vectors to float32 so cached and uncached results match exactly
+        new_vectors = {
+            text_hash: _decode_vector(_encode_vector(vector))
+            for (text_hash, _), vector in zip(batch, vectors)
+        }
+        self.store.put_many(self.model, new_vectors)
+        return new_vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents, reusing cached vectors where available"""
+        hashes, found, missing = self._lookup(texts)
+        for batch in self._batches(missing):
+            vectors = self.underlying.embed_documents([text for _, text in batch])
+            found.update(self._store_batch(batch, vectors))
+        return [found[text_hash] for text_hash in hashes]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Async variant of embed_documents; SQLite access runs on the worker pool"""
+        hashes, found, missing = await run_sync(self._lookup, texts)
+        for batch in self._batches(missing):
+            vectors = await self.underlying.aembed_documents([text for _, text in batch])
+            found.update(await run_sync(self._store_batch, batch, vectors))
+        return [found[text_hash] for text_hash in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query, reusing a cached vector for repeated queries"""
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Async variant of embed_query"""
+        return (await self.aembed_documents([text]))[0]
+
+    def stats(self) -> dict:
+        """Return cache counters for monitoring"""
+        return {"model": self.model, **self.store.stats(self.model)}
+
+
+_stores: Dict[str, SQLiteEmbeddingStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_embedding_store(path: Optional[str] = None) -> SQLiteEmbeddingStore:
+    """Get the process-wide embedding store for a path"""
+    path = path or os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH)
+    with _stores_lock:
+        if path not in _stores:
+            max_vectors = int(os.getenv("EMBEDDING_CACHE_MAX_VECTORS", "500000"))
+            max_age = float(os.getenv("EMBEDDING_CACHE_MAX_AGE", str(30 * 24 * 3600)))
+            _stores[path] = SQLiteEmbeddingStore(path, max_vectors or None, max_age or None)
+        return _stores[path]
+
+
+def peek_embedding_store(path: Optional[str] = None) -> Optional[SQLiteEmbeddingStore]:
+    """Get the process-wide embedding store for a path only if it has already been opened"""
+    path = path or os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH)
+    with _stores_lock:
+        return _stores.get(path)
+
+
+def cache_embeddings(
+    embeddings: Embeddings,
+    model: Optional[str] = None,
+    path: Optional[str] = None,
+) -> CachedEmbeddings:
+    """Wrap an embeddings instance with the shared on-disk cache"""
+    model = model or getattr(embeddings, "model", type(embeddings).__name__)
+    return CachedEmbeddings(
+        embeddings,
+        get_embedding_store(path),
+        model=model,
+        batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "256")),
+    )
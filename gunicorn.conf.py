@@ -0,0 +1,63 @@
+"""
+Gunicorn settings for running the API in production.
+
+Used by ``python start_api.py --production`` and usable directly with
+``gunicorn -c gunicorn.conf.py api_app:app``. The app is imported once in the
+master before the workers are forked, so they share its code and read-only
+data copy-on-write. With more than one worker, per-process state moves to
+files on this host so every worker sees the same sessions, coalesced calls,
+metrics and vector indexes. Persisted indexes are memory-mapped read-only,
+so the workers share one physical copy of the vectors.
+"""
+
+import glob
+import multiprocessing
+import os
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(4, multiprocessing.cpu_count()))))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.getenv("PRELOAD_APP", "1") != "0"
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+max_requests = int(os.getenv("MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "0"))
+loglevel = os.getenv("LOG_LEVEL", "info")
+accesslog = "-"
+reload = False
+
+# Shared locations for state that would otherwise be private to each worker
+SHARED_STATE_DEFAULTS = {
+    "SESSION_BACKEND": "sqlite",
+    "VECTORSTORE_CACHE_DIR": os.path.join(".cache", "vectorstores"),
+    "SINGLE_FLIGHT_DIR": os.path.join(".cache", "single-flight"),
+    "PROMETHEUS_MULTIPROC_DIR": os.path.join(".cache", "prometheus"),
+}
+
+if workers > 1:
+    for name, value in SHARED_STATE_DEFAULTS.items():
+        os.environ.setdefault(name, value)
+
+# Multiprocess metrics must start from an empty directory on every launch
+if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+    for path in glob.glob(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "*.db")):
+        os.remove(path)
+
+
+def when_ready(server):
+    """Import the endpoint groups in the master so that preloaded workers share them instead of each importing its own"""
+    if preload_app:
+        import importlib
+        from api_app import ENDPOINT_GROUPS
+        for modules in ENDPOINT_GROUPS.values():
+            for module in modules:
+                importlib.import_module(module)
+
+
+def child_exit(server, worker):
+    """Drop the live gauges of a worker that has exited"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
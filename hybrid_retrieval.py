@@ -0,0 +1,207 @@
+"""
+Hybrid BM25 + vector retrieval.
+
+A BM25 inverted index is built over the chunks of a FAISS store when the
+store is created and kept alongside it. Retrieval can use either index alone
+or fuse both rankings with reciprocal rank fusion (RRF). Lexical-only
+retrieval never embeds the query, so it makes no embeddings API call.
+"""
+
+import math
+import os
+import re
+import threading
+import weakref
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from concurrency import run_sync
+from vector_index import reconstruct_vector
+
+RETRIEVAL_MODES = ("hybrid", "vector", "lexical")
+DEFAULT_RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "4"))
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", "20"))
+RRF_K = int(os.getenv("RETRIEVAL_RRF_K", "60"))
+
+# Identifiers such as "ERR-1042", "os.path" or "foo_bar" stay whole; their parts are indexed too
+TOKEN_PATTERN = re.compile(r"[a-z0-9_]+(?:[.\-:/][a-z0-9_]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it its of on or "
+    "that the this to was what when where which who why will with you".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase terms for BM25, keeping compound identifiers and their parts"""
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        parts = re.split(r"[.\-:/]", token)
+        if len(parts) > 1:
+            terms.extend(part for part in parts if part and part not in STOPWORDS)
+    return terms
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of texts, stored as an inverted index
+
+    ``positions`` gives each text's position in the vector index when they
+    are not simply 0..n-1, so that both rankings name chunks the same way.
+    """
+
+    def __init__(self, texts: List[str], k1: float = 1.5, b: float = 0.75, positions: Optional[List[int]] = None):
+        self.k1 = k1
+        self.b = b
+        self.positions = np.arange(len(texts)) if positions is None else np.asarray(positions, dtype=np.int64)
+        postings: Dict[str, Dict[int, int]] = {}
+        lengths = []
+        for position, text in enumerate(texts):
+            terms = tokenize(text)
+            lengths.append(len(terms))
+            for term, count in Counter(terms).items():
+                postings.setdefault(term, {})[position] = count
+
+        self.doc_count = len(texts)
+        self.doc_lengths = np.asarray(lengths, dtype=np.float32)
+        self.avg_length = float(self.doc_lengths.mean()) if texts else 0.0
+        # term -> (positions, term frequencies, idf)
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray, float]] = {}
+        for term, documents in postings.items():
+            frequency = len(documents)
+            self.postings[term] = (
+                np.fromiter(documents.keys(), dtype=np.int32, count=frequency),
+                np.fromiter(documents.values(), dtype=np.float32, count=frequency),
+                math.log(1 + (self.doc_count - frequency + 0.5) / (frequency + 0.5)),
+            )
+
+    def idf(self, term: str) -> float:
+        """Inverse document frequency of a term (0 for unseen terms)"""
+        return self.postings[term][2] if term in self.postings else 0.0
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Return (position, score) of the top-k texts for a query"""
+        if not self.doc_count:
+            return []
+        scores = np.zeros(self.doc_count, dtype=np.float32)
+        length_norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / (self.avg_length or 1.0))
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            positions, frequencies, idf = self.postings[term]
+            scores[positions] += idf * frequencies * (self.k1 + 1) / (frequencies + length_norm[positions])
+
+        matched = np.flatnonzero(scores)
+        if not len(matched):
+            return []
+        top = matched[np.argsort(-scores[matched], kind="stable")[:k]]
+        return [(int(self.positions[row]), float(scores[row])) for row in top]
+
+
+_lexical_indexes: "weakref.WeakKeyDictionary[Any, BM25Index]" = weakref.WeakKeyDictionary()
+_lexical_lock = threading.Lock()
+
+
+def get_lexical_index(vectorstore) -> BM25Index:
+    """Get the BM25 index kept alongside a FAISS store, building it on first use"""
+    with _lexical_lock:
+        index = _lexical_indexes.get(vectorstore)
+    if index is None:
+        # Collections leave the positions of deleted chunks unmapped until they are compacted
+        positions = sorted(vectorstore.index_to_docstore_id)
+        texts = [
+            vectorstore.docstore.search(vectorstore.index_to_docstore_id[position]).page_content
+            for position in positions
+        ]
+        index = BM25Index(texts, positions=positions)
+        with _lexical_lock:
+            index = _lexical_indexes.setdefault(vectorstore, index)
+    return index
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = RRF_K) -> List[int]:
+    """Fuse ranked position lists, scoring each item by the sum of 1 / (k + rank)"""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, position in enumerate(ranking, start=1):
+            scores[position] = scores.get(position, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda position: -scores[position])
+
+
+class HybridRetriever(BaseRetriever):
+    """Retrieve chunks from a FAISS store by vector similarity, BM25, or both fused with RRF"""
+
+    vectorstore: Any
+    mode: str = DEFAULT_RETRIEVAL_MODE
+    k: int = RETRIEVAL_K
+    fetch_k: int = RETRIEVAL_FETCH_K
+    # Optional context_compression.ContextCompressor applied to the fused candidates
+    compressor: Optional[Any] = None
+
+    def _lexical_ranking(self, query: str) -> List[int]:
+        return [position for position, _ in get_lexical_index(self.vectorstore).search(query, self.fetch_k)]
+
+    def _vector_ranking(self, vector: List[float]) -> List[int]:
+        query = np.asarray([vector], dtype=np.float32)
+        if getattr(self.vectorstore, "_normalize_L2", False):
+            query /= np.linalg.norm(query) or 1.0
+        index, mapped = self.vectorstore.index, self.vectorstore.index_to_docstore_id
+        # Fetch extra candidates to make up for unmapped (deleted) positions
+        unmapped = index.ntotal - len(mapped)
+        _, positions = index.search(query, min(self.fetch_k + unmapped, index.ntotal))
+        return [int(position) for position in positions[0] if position >= 0 and int(position) in mapped][:self.fetch_k]
+
+    def _chunk_vectors(self, positions: List[int]) -> Optional[np.ndarray]:
+        try:
+            return np.vstack([reconstruct_vector(self.vectorstore.index, position) for position in positions])
+        except RuntimeError:
+            # Some index types cannot reconstruct stored vectors
+            return None
+
+    def _fuse(self, query: str, lexical: List[int], vector: List[int], embedding: Optional[List[float]] = None) -> List[Document]:
+        if self.mode == "lexical":
+            ranking = lexical
+        elif self.mode == "vector":
+            ranking = vector
+        else:
+            ranking = reciprocal_rank_fusion([vector, lexical])
+        docstore, ids = self.vectorstore.docstore, self.vectorstore.index_to_docstore_id
+        if self.compressor is None:
+            return [docstore.search(ids[position]) for position in ranking[:self.k]]
+
+        candidates = ranking[:max(self.compressor.candidates, self.k)]
+        return self.compressor.compress(
+            query,
+            [docstore.search(ids[position]) for position in candidates],
+            self._chunk_vectors(candidates) if candidates else None,
+            embedding,
+            self.k,
+            get_lexical_index(self.vectorstore).idf,
+        )
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        lexical = self._lexical_ranking(query) if self.mode != "vector" else []
+        vector, embedding = [], None
+        if self.mode != "lexical":
+            embedding = self.vectorstore.embedding_function.embed_query(query)
+            vector = self._vector_ranking(embedding)
+        return self._fuse(query, lexical, vector, embedding)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        lexical = await run_sync(self._lexical_ranking, query) if self.mode != "vector" else []
+        vector, embedding = [], None
+        if self.mode != "lexical":
+            embedding = await self.vectorstore.embedding_function.aembed_query(query)
+            vector = await run_sync(self._vector_ranking, embedding)
+        if self.compressor is not None:
+            return await run_sync(self._fuse, query, lexical, vector, embedding)
+        return self._fuse(query, lexical, vector, embedding)
@@ -0,0 +1,483 @@
+"""
+Background jobs for indexing documents that are too large to index within a request.
+
+Submitting a job stores it in a SQLite queue and returns its id at once.
+Every API worker runs a small job runner that claims queued jobs from the
+shared database. Jobs are spread over the workers and survive a restart: a
+running job whose worker stops heartbeating is put back in the queue.
+
+- Splitting and FAISS index building are CPU-bound and run on a process pool
+- Embedding runs on the event loop in batches, and the reported progress
+  counts the chunks embedded so far
+- Finished indexes are written to disk in the ``save_local`` layout and
+  loaded memory-mapped by whichever worker answers questions about them
+"""
+
+import asyncio
+import json
+import multiprocessing
+import os
+import pickle
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from concurrency import run_sync
+from observability import current_route
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+
+JOB_STATES = ("queued", "running", "succeeded", "failed")
+
+# Called with a claimed job and a progress reporter; returns the job result
+JobHandler = Callable[[Dict[str, Any], Callable[[Dict[str, Any]], Awaitable[None]]], Awaitable[Dict[str, Any]]]
+
+
+class RetryJob(Exception):
+    """Raised by a handler to put its job back in the queue after a delay"""
+
+    def __init__(self, message: str, delay: float):
+        super().__init__(message)
+        self.delay = delay
+
+
+def split_for_index(document_text: str, chunk_tokens: int, chunk_overlap_tokens: int) -> Tuple[List[str], Dict[str, int]]:
+    """Split a document into deduplicated chunks plus chunk/token stats (runs in a job process)"""
+    from text_splitting import create_token_splitter, split_text
+    return split_text(document_text, create_token_splitter(chunk_tokens, chunk_overlap_tokens))
+
+
+def write_index(path: str, texts: List[str], metadatas: List[Dict[str, Any]], vectors) -> int:
+    """Build a FAISS index of the configured type over the vectors and save it with its docstore (runs in a job process)
+
+    The files match what ``FAISS.save_local`` writes, so the index loads with
+    ``load_shared_vectorstore``. It is written under a temporary name and
+    renamed into place, so readers never see a partial index.
+    """
+    import faiss
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_core.documents import Document
+    from vector_index import build_index
+
+    index = build_index(vectors)
+    ids = [str(uuid.uuid4()) for _ in texts]
+    docstore = InMemoryDocstore({
+        doc_id: Document(page_content=text, metadata=metadata)
+        for doc_id, text, metadata in zip(ids, texts, metadatas)
+    })
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(temp_path, exist_ok=True)
+    faiss.write_index(index, os.path.join(temp_path, "index.faiss"))
+    with open(os.path.join(temp_path, "index.pkl"), "wb") as f:
+        pickle.dump((docstore, dict(enumerate(ids))), f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(temp_path, path)
+    return index.ntotal
+
+
+class JobStore:
+    """Job queue in a SQLite file shared by all workers on a host"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect()
+        # A preloading server (gunicorn --preload) forks after this store is created; never share the connection
+        os.register_at_fork(after_in_child=self._connect)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                dedupe_key TEXT,
+                payload TEXT NOT NULL,
+                progress TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                owner TEXT,
+                run_after REAL NOT NULL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                updated_at REAL NOT NULL,
+                finished_at REAL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, run_after)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_dedupe_key ON jobs (dedupe_key)")
+        self._conn.commit()
+
+    def _connect(self) -> None:
+        """Open this process's connection to the database"""
+        self._lock = threading.Lock()
+        # Autocommit mode, so claims can take the write lock with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+
+    @staticmethod
+    def _view(row: sqlite3.Row, include_payload: bool = False) -> Dict[str, Any]:
+        """Public fields of a job row"""
+        job = {
+            "job_id": row["job_id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "dedupe_key": row["dedupe_key"],
+            "progress": json.loads(row["progress"]),
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "attempts": row["attempts"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+        }
+        if include_payload:
+            job["payload"] = json.loads(row["payload"])
+        return job
+
+    def submit(self, kind: str, payload: Dict[str, Any], dedupe_key: Optional[str] = None,
+               progress: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Queue a job, or return the queued, running or finished job with the same dedupe key"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if dedupe_key is not None:
+                    row = self._conn.execute(
+                        "SELECT * FROM jobs WHERE dedupe_key = ? AND status != 'failed' ORDER BY created_at DESC LIMIT 1",
+                        (dedupe_key,),
+                    ).fetchone()
+                    if row is not None:
+                        self._conn.execute("COMMIT")
+                        return self._view(row)
+                job_id = uuid.uuid4().hex
+                self._conn.execute(
+                    "INSERT INTO jobs (job_id, kind, status, dedupe_key, payload, progress, run_after, created_at, updated_at) "
+                    "VALUES (?, ?, 'queued', ?, ?, ?, ?, ?, ?)",
+                    (job_id, kind, dedupe_key, json.dumps(payload), json.dumps(progress or {}), now, now, now),
+                )
+                row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self._view(row)
+
+    def claim(self, owner: str) -> Optional[Dict[str, Any]]:
+        """Mark the oldest runnable job as running for owner and return it with its payload"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT job_id FROM jobs WHERE status = 'queued' AND run_after <= ? ORDER BY created_at LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'running', owner = ?, attempts = attempts + 1, "
+                    "started_at = ?, updated_at = ? WHERE job_id = ?",
+                    (owner, now, now, row["job_id"]),
+                )
+                row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (row["job_id"],)).fetchone()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self._view(row, include_payload=True)
+
+    def heartbeat(self, job_id: str, owner: str, progress: Optional[Dict[str, Any]] = None) -> None:
+        """Record that owner is still working on a job, optionally with new progress"""
+        with self._lock:
+            if progress is None:
+                self._conn.execute(
+                    "UPDATE jobs SET updated_at = ? WHERE job_id = ? AND owner = ? AND status = 'running'",
+                    (time.time(), job_id, owner),
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE jobs SET progress = ?, updated_at = ? WHERE job_id = ? AND owner = ? AND status = 'running'",
+                    (json.dumps(progress), time.time(), job_id, owner),
+                )
+
+    def finish(self, job_id: str, owner: str, status: str, result: Optional[Dict[str, Any]] = None,
+               error: Optional[str] = None) -> None:
+        """Mark a job owned by owner as succeeded or failed"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, updated_at = ? "
+                "WHERE job_id = ? AND owner = ? AND status = 'running'",
+                (status, json.dumps(result) if result is not None else None, error, now, now, job_id, owner),
+            )
+
+    def requeue(self, job_id: str, owner: str, delay: float = 0.0, count_attempt: bool = True) -> None:
+        """Put a job owned by owner back in the queue, runnable after delay seconds"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', owner = NULL, run_after = ?, updated_at = ?, "
+                "attempts = attempts - ? WHERE job_id = ? AND owner = ? AND status = 'running'",
+                (now + delay, now, 0 if count_attempt else 1, job_id, owner),
+            )
+
+    def recover(self, lease_seconds: float, max_attempts: int) -> int:
+        """Requeue running jobs whose worker stopped heartbeating; fail those out of attempts"""
+        now = time.time()
+        stale = now - lease_seconds
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                failed = self._conn.execute(
+                    "UPDATE jobs SET status = 'failed', owner = NULL, error = ?, finished_at = ?, updated_at = ? "
+                    "WHERE status = 'running' AND updated_at < ? AND attempts >= ?",
+                    (f"Worker stopped after {max_attempts} attempts", now, now, stale, max_attempts),
+                ).rowcount
+                requeued = self._conn.execute(
+                    "UPDATE jobs SET status = 'queued', owner = NULL, run_after = ?, updated_at = ? "
+                    "WHERE status = 'running' AND updated_at < ?",
+                    (now, now, stale),
+                ).rowcount
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return failed + requeued
+
+    def purge(self, retention_seconds: float) -> List[str]:
+        """Delete finished jobs older than the retention; returns the dedupe keys no job refers to anymore"""
+        cutoff = time.time() - retention_seconds
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id, dedupe_key FROM jobs WHERE status IN ('succeeded', 'failed') AND finished_at < ?",
+                (cutoff,),
+            ).fetchall()
+            self._conn.executemany("DELETE FROM jobs WHERE job_id = ?", [(row["job_id"],) for row in rows])
+            keys = {row["dedupe_key"] for row in rows if row["dedupe_key"]}
+            return [
+                key for key in keys
+                if self._conn.execute("SELECT 1 FROM jobs WHERE dedupe_key = ? LIMIT 1", (key,)).fetchone() is None
+            ]
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job without its payload, or None if it is unknown or purged"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._view(row) if row is not None else None
+
+    def list(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Return the most recently submitted jobs, newest first"""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [self._view(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        """Return the number of jobs in each state"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {state: 0 for state in JOB_STATES} | {status: count for status, count in rows}
+
+
+class JobRunner:
+    """Claim jobs from a JobStore and run them, a bounded number at a time per worker"""
+
+    def __init__(
+        self,
+        store: JobStore,
+        index_dir: str,
+        concurrency: int = 2,
+        processes: int = 2,
+        lease_seconds: float = 60,
+        max_attempts: int = 3,
+        retention_seconds: float = 86400,
+        poll_interval: float = 1.0,
+        enabled: bool = True,
+    ):
+        self.store = store
+        self.index_dir = index_dir
+        self.concurrency = concurrency
+        self.processes = processes
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self.poll_interval = poll_interval
+        self.enabled = enabled
+        self._handlers: Dict[str, JobHandler] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        self._loop_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        os.makedirs(self.index_dir, exist_ok=True)
+
+    @property
+    def owner(self) -> str:
+        # Read per call: preloaded workers are forked after the runner is created
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def register(self, kind: str, handler: JobHandler) -> None:
+        """Run handler for every job of this kind"""
+        self._handlers[kind] = handler
+
+    def index_path(self, key: str) -> str:
+        """Directory holding the index built for key"""
+        return os.path.join(self.index_dir, key)
+
+    def has_index(self, key: str) -> bool:
+        return os.path.isfile(os.path.join(self.index_path(key), "index.faiss"))
+
+    def load_index(self, key: str, embeddings) -> Optional["FAISS"]:
+        """Load a finished index memory-mapped read-only, or None if there is none"""
+        from vectorstore_cache import load_shared_vectorstore
+        if not self.has_index(key):
+            return None
+        return load_shared_vectorstore(self.index_path(key), embeddings)
+
+    async def submit(self, kind: str, payload: Dict[str, Any], dedupe_key: Optional[str] = None,
+                     progress: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Queue a job and wake this worker's runner so it can claim it straight away"""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job = await run_sync(self.store.submit, kind, payload, dedupe_key, progress)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def run_in_process(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Run a CPU-bound, picklable top-level function on the job process pool"""
+        with self._executor_lock:
+            if self._executor is None:
+                # Spawned, not forked: the API process has threads and open connections
+                self._executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("spawn"))
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def start(self) -> None:
+        """Start claiming jobs in the background (call from the running event loop)"""
+        if self.enabled and self._loop_task is None:
+            self._wakeup = asyncio.Event()
+            self._loop_task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        """Stop claiming jobs and hand running ones back to the queue for another worker"""
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        for task in list(self._running.values()):
+            task.cancel()
+        await asyncio.gather(*self._running.values(), return_exceptions=True)
+        if self._executor is not None:
+            await run_sync(self._executor.shutdown, wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def _loop(self) -> None:
+        housekeeping_at = 0.0
+        while True:
+            try:
+                if time.monotonic() >= housekeeping_at:
+                    await run_sync(self._housekeeping)
+                    housekeeping_at = time.monotonic() + self.lease_seconds / 2
+                while len(self._running) < self.concurrency:
+                    job = await run_sync(self.store.claim, self.owner)
+                    if job is None:
+                        break
+                    task = asyncio.create_task(self._run(job))
+                    self._running[job["job_id"]] = task
+                    task.add_done_callback(lambda _, job_id=job["job_id"]: self._running.pop(job_id, None))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # The database may be briefly locked by another worker; try again next poll
+                pass
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _housekeeping(self) -> None:
+        """Requeue jobs abandoned by stopped workers and drop expired jobs with their indexes"""
+        self.store.recover(self.lease_seconds, self.max_attempts)
+        for key in self.store.purge(self.retention_seconds):
+            shutil.rmtree(self.index_path(key), ignore_errors=True)
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        job_id, owner = job["job_id"], self.owner
+        current_route.set(f"job {job['kind']}")
+
+        async def heartbeat():
+            while True:
+                await asyncio.sleep(self.lease_seconds / 3)
+                await run_sync(self.store.heartbeat, job_id, owner)
+
+        async def report(progress: Dict[str, Any]) -> None:
+            await run_sync(self.store.heartbeat, job_id, owner, progress)
+
+        beating = asyncio.create_task(heartbeat())
+        try:
+            handler = self._handlers.get(job["kind"])
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {job['kind']}")
+            result = await handler(job, report)
+        except asyncio.CancelledError:
+            # Shutting down: the job did not fail, so give its attempt back
+            await run_sync(self.store.requeue, job_id, owner, 0.0, False)
+            raise
+        except RetryJob as e:
+            if job["attempts"] >= self.max_attempts:
+                await run_sync(self.store.finish, job_id, owner, "failed", None, str(e))
+                self.failed += 1
+            else:
+                await run_sync(self.store.requeue, job_id, owner, e.delay)
+        except Exception as e:
+            await run_sync(self.store.finish, job_id, owner, "failed", None, f"{type(e).__name__}: {e}")
+            self.failed += 1
+        else:
+            await run_sync(self.store.finish, job_id, owner, "succeeded", result)
+            self.completed += 1
+        finally:
+            beating.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue counts and this worker's runner state"""
+        return {
+            "enabled": self.enabled,
+            "jobs": self.store.counts(),
+            "running_here": len(self._running),
+            "concurrency": self.concurrency,
+            "processes": self.processes,
+            "completed_here": self.completed,
+            "failed_here": self.failed,
+        }
+
+
+def create_job_runner() -> JobRunner:
+    """Create the job queue and runner configured by JOBS_* environment variables"""
+    store = JobStore(os.getenv("JOBS_DB", os.path.join(".cache", "jobs.sqlite3")))
+    return JobRunner(
+        store,
+        index_dir=os.getenv("JOBS_INDEX_DIR", os.path.join(".cache", "job-indexes")),
+        concurrency=int(os.getenv("JOBS_CONCURRENCY", "2")),
+        processes=int(os.getenv("JOBS_PROCESSES", "2")),
+        lease_seconds=float(os.getenv("JOBS_LEASE_SECONDS", "60")),
+        max_attempts=int(os.getenv("JOBS_MAX_ATTEMPTS", "3")),
+        retention_seconds=float(os.getenv("JOBS_RETENTION", "86400")),
+        poll_interval=float(os.getenv("JOBS_POLL_INTERVAL", "1.0")),
+        enabled=os.getenv("JOBS_ENABLED", "1") != "0",
+    )
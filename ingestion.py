@@ -0,0 +1,203 @@
+"""
+In-memory document ingestion.
+
+Request payloads become ``Document`` objects directly, with no temporary
+files. Large documents can be sent as multipart uploads: the body is parsed
+as it streams in, split into chunks incrementally, and chunks are embedded
+in batches while the rest of the upload is still arriving.
+"""
+
+import asyncio
+import codecs
+import hashlib
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:
+    from multipart.multipart import MultipartParser, parse_options_header
+
+UPLOAD_MAX_BYTES = int(os.getenv("DOCUMENT_UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_FIELD_MAX_BYTES = 64 * 1024
+EMBED_BATCH_CHUNKS = int(os.getenv("UPLOAD_EMBED_BATCH_CHUNKS", "32"))
+EMBED_MAX_IN_FLIGHT = int(os.getenv("UPLOAD_EMBED_MAX_IN_FLIGHT", "4"))
+
+
+class UploadError(ValueError):
+    """Raised for malformed or oversized uploads"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def documents_from_chunks(chunks: List[str], source: str = "request") -> List[Document]:
+    """Build chunk documents straight from request text"""
+    return [Document(page_content=chunk, metadata={"source": source}) for chunk in chunks]
+
+
+class IncrementalSplitter:
+    """Split text that arrives in pieces, emitting chunks as soon as they are final
+
+    Text is buffered until it exceeds a window of several chunks, then cut at
+    the last separator and handed to the wrapped splitter. The remainder stays
+    buffered, so memory is bounded by the window rather than the document.
+    An optional deduplicator drops chunks already seen earlier in the stream.
+    """
+
+    def __init__(self, text_splitter, chunk_size: int, separator: str = "\n\n", window_chunks: int = 8, deduplicator=None):
+        self.text_splitter = text_splitter
+        self.deduplicator = deduplicator
+        self.separator = separator
+        self.window = chunk_size * window_chunks
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """Add text and return any chunks that can no longer change"""
+        self._buffer += text
+        if len(self._buffer) < self.window:
+            return []
+        cut = self._buffer.rfind(self.separator, 0, len(self._buffer))
+        if cut <= 0:
+            if len(self._buffer) < self.window * 2:
+                return []
+            # No separator in a very long run; cut it to keep memory bounded
+            cut = self.window
+        ready, self._buffer = self._buffer[:cut], self._buffer[cut:]
+        return self._split(ready)
+
+    def finish(self) -> List[str]:
+        """Split and return whatever is still buffered"""
+        ready, self._buffer = self._buffer, ""
+        return self._split(ready) if ready.strip() else []
+
+    def _split(self, text: str) -> List[str]:
+        chunks = self.text_splitter.split_text(text)
+        return self.deduplicator.filter(chunks) if self.deduplicator is not None else chunks
+
+
+class StreamingUpload:
+    """Result of a streamed multipart document upload"""
+
+    def __init__(self):
+        self.fields: Dict[str, str] = {}
+        self.filename: Optional[str] = None
+        self.chunks: List[str] = []
+        self.vectors: List[List[float]] = []
+        self.content_hash = ""
+        self.bytes_received = 0
+
+
+async def ingest_multipart_upload(request, embeddings, splitter: IncrementalSplitter, file_field: str = "file") -> StreamingUpload:
+    """Parse a multipart upload as it streams in, splitting and embedding the file part incrementally"""
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise UploadError("Expected a multipart/form-data upload")
+
+    upload = StreamingUpload()
+    digest = hashlib.sha256()
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    # Parser callbacks are synchronous, so they only collect bytes; the loop below processes them
+    part: Dict[str, Any] = {}
+    file_data: List[bytes] = []
+    field_data: List[bytes] = []
+    header_name: List[bytes] = []
+    header_value: List[bytes] = []
+
+    def on_part_begin():
+        part.clear()
+        part["headers"] = {}
+        field_data.clear()
+
+    def on_header_field(data: bytes, start: int, end: int):
+        header_name.append(data[start:end])
+
+    def on_header_value(data: bytes, start: int, end: int):
+        header_value.append(data[start:end])
+
+    def on_header_end():
+        part["headers"][b"".join(header_name).lower()] = b"".join(header_value)
+        header_name.clear()
+        header_value.clear()
+
+    def on_headers_finished():
+        _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["name"] = options.get(b"name", b"").decode("utf-8", errors="replace")
+        part["is_file"] = part["name"] == file_field
+        if part["is_file"] and b"filename" in options:
+            upload.filename = options[b"filename"].decode("utf-8", errors="replace")
+
+    def on_part_data(data: bytes, start: int, end: int):
+        if part.get("is_file"):
+            file_data.append(data[start:end])
+        else:
+            field_data.append(data[start:end])
+            if sum(len(piece) for piece in field_data) > UPLOAD_FIELD_MAX_BYTES:
+                raise UploadError(f"Form field '{part.get('name')}' is too large", status_code=413)
+
+    def on_part_end():
+        if not part.get("is_file"):
+            upload.fields[part.get("name", "")] = b"".join(field_data).decode("utf-8", errors="replace")
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    pending: List[str] = []
+    in_flight: List[Tuple[int, asyncio.Task]] = []
+    embedded: Dict[int, List[List[float]]] = {}
+
+    async def flush(force: bool = False):
+        # Start embedding full batches while the upload continues
+        while pending and (force or len(pending) >= EMBED_BATCH_CHUNKS):
+            batch = pending[:EMBED_BATCH_CHUNKS]
+            del pending[:EMBED_BATCH_CHUNKS]
+            start = len(upload.chunks)
+            upload.chunks.extend(batch)
+            in_flight.append((start, asyncio.create_task(embeddings.aembed_documents(batch))))
+            while len(in_flight) > EMBED_MAX_IN_FLIGHT:
+                oldest_start, task = in_flight.pop(0)
+                embedded[oldest_start] = await task
+
+    try:
+        async for body_chunk in request.stream():
+            upload.bytes_received += len(body_chunk)
+            if upload.bytes_received > UPLOAD_MAX_BYTES:
+                raise UploadError(f"Upload exceeds {UPLOAD_MAX_BYTES} bytes", status_code=413)
+            parser.write(body_chunk)
+            if file_data:
+                data = b"".join(file_data)
+                file_data.clear()
+                digest.update(data)
+                pending.extend(splitter.feed(decoder.decode(data)))
+                await flush()
+        parser.finalize()
+
+        pending.extend(splitter.feed(decoder.decode(b"", final=True)))
+        pending.extend(splitter.finish())
+        await flush(force=True)
+        for start, task in in_flight:
+            embedded[start] = await task
+    except BaseException:
+        for _, task in in_flight:
+            task.cancel()
+        raise
+
+    if upload.filename is None and not upload.chunks:
+        raise UploadError(f"Missing file field '{file_field}'")
+
+    for start in sorted(embedded):
+        upload.vectors.extend(embedded[start])
+    upload.content_hash = digest.hexdigest()
+    return upload
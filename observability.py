@@ -0,0 +1,308 @@
+"""
+Prometheus metrics and per-stage latency tracing.
+
+An ASGI middleware times every request per route and labels the work done
+while serving it with that route. Stages inside a request (splitting,
+embedding, FAISS build, retrieval, the LLM call) are recorded as spans:
+explicitly with ``stage()`` around local work, and through a LangChain
+callback handler for LLM and retriever runs, which also counts token usage.
+Cache and session gauges are read from the existing stats objects when
+``/metrics`` is scraped. Spans are also exported to OpenTelemetry when an
+OTLP endpoint is configured.
+"""
+
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from starlette.routing import Match, Route
+
+METRICS_PREFIX = os.getenv("METRICS_PREFIX", "langchain_api")
+# Model calls routinely take seconds, so the buckets reach well past the client default
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+REQUEST_LATENCY = Histogram(
+    f"{METRICS_PREFIX}_request_duration_seconds",
+    "HTTP request latency by route",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    f"{METRICS_PREFIX}_requests_in_progress",
+    "HTTP requests currently being served",
+    ["route"],
+    multiprocess_mode="livesum",
+)
+STAGE_LATENCY = Histogram(
+    f"{METRICS_PREFIX}_stage_duration_seconds",
+    "Latency of one stage of request handling",
+    ["route", "stage"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    f"{METRICS_PREFIX}_stage_errors_total",
+    "Stages that raised an error",
+    ["route", "stage"],
+)
+LLM_TOKENS = Counter(
+    f"{METRICS_PREFIX}_llm_tokens_total",
+    "Tokens reported by the model provider",
+    ["route", "model", "kind"],
+)
+
+# Route template of the request being served, e.g. "/document-qa"
+current_route: contextvars.ContextVar[str] = contextvars.ContextVar("current_route", default="none")
+
+
+class _Tracing:
+    """OpenTelemetry tracer, set up only when an OTLP endpoint is configured"""
+
+    tracer = None
+
+    @classmethod
+    def setup(cls) -> None:
+        if cls.tracer is not None or not os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+            return
+        try:
+            from opentelemetry import trace
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        except ImportError as e:
+            raise ImportError(
+                "OTEL_EXPORTER_OTLP_ENDPOINT is set but OpenTelemetry is not installed: "
+                "pip install opentelemetry-sdk opentelemetry-exporter-otlp-proto-http"
+            ) from e
+
+        # The exporter reads OTEL_EXPORTER_OTLP_* itself (endpoint, headers, timeout)
+        provider = TracerProvider(resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", "langchain-api")}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        trace.set_tracer_provider(provider)
+        cls.tracer = trace.get_tracer("langchain-api")
+
+    @classmethod
+    def start_span(cls, name: str, attributes: Optional[Dict[str, Any]] = None):
+        if cls.tracer is None:
+            return None
+        return cls.tracer.start_span(name, attributes=attributes)
+
+    @classmethod
+    @contextmanager
+    def span(cls, name: str, attributes: Optional[Dict[str, Any]] = None) -> Iterator[None]:
+        if cls.tracer is None:
+            yield
+            return
+        with cls.tracer.start_as_current_span(name, attributes=attributes):
+            yield
+
+
+def tracing_enabled() -> bool:
+    """Whether spans are exported to OpenTelemetry"""
+    return _Tracing.tracer is not None
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a stage of the current request, e.g. ``with stage("faiss_build"): ...``"""
+    route = current_route.get()
+    started = time.perf_counter()
+    try:
+        with _Tracing.span(f"stage {name}", {"http.route": route, "stage": name}):
+            yield
+    except BaseException:
+        STAGE_ERRORS.labels(route, name).inc()
+        raise
+    finally:
+        STAGE_LATENCY.labels(route, name).observe(time.perf_counter() - started)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Record LLM and retriever runs as stages and count token usage"""
+
+    # Cheap enough to run on the event loop instead of a thread per callback
+    run_inline = True
+
+    def __init__(self):
+        # run_id -> (stage, route, model, start time, OpenTelemetry span)
+        self._runs: Dict[UUID, Tuple[str, str, str, float, Any]] = {}
+
+    def _start(self, run_id: UUID, stage_name: str, model: str = "") -> None:
+        route = current_route.get()
+        span = _Tracing.start_span(f"stage {stage_name}", {"http.route": route, "stage": stage_name, "model": model})
+        self._runs[run_id] = (stage_name, route, model, time.perf_counter(), span)
+
+    def _end(self, run_id: UUID, error: bool = False) -> Optional[Tuple[str, str]]:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return None
+        stage_name, route, model, started, span = run
+        STAGE_LATENCY.labels(route, stage_name).observe(time.perf_counter() - started)
+        if error:
+            STAGE_ERRORS.labels(route, stage_name).inc()
+        if span is not None:
+            span.end()
+        return route, model
+
+    @staticmethod
+    def _model_name(serialized: Optional[Dict[str, Any]], kwargs: Dict[str, Any]) -> str:
+        params = kwargs.get("invocation_params") or {}
+        constructor = (serialized or {}).get("kwargs", {})
+        model = params.get("model_name") or params.get("model") or constructor.get("model_name") or constructor.get("model")
+        return str(model or "unknown")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs) -> None:
+        self._start(run_id, "llm", self._model_name(serialized, kwargs))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs) -> None:
+        self._start(run_id, "llm", self._model_name(serialized, kwargs))
+
+    def on_llm_end(self, response, *, run_id, **kwargs) -> None:
+        ended = self._end(run_id)
+        if ended is None:
+            return
+        route, model = ended
+        prompt_tokens = completion_tokens = 0
+        # Prefer per-message usage metadata; fall back to the provider's token_usage block
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    completion_tokens += usage.get("output_tokens", 0)
+        if not prompt_tokens and not completion_tokens:
+            token_usage = (response.llm_output or {}).get("token_usage") or {}
+            prompt_tokens = token_usage.get("prompt_tokens", 0)
+            completion_tokens = token_usage.get("completion_tokens", 0)
+        if prompt_tokens:
+            LLM_TOKENS.labels(route, model, "prompt").inc(prompt_tokens)
+        if completion_tokens:
+            LLM_TOKENS.labels(route, model, "completion").inc(completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs) -> None:
+        self._end(run_id, error=True)
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs) -> None:
+        self._start(run_id, "retrieval")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs) -> None:
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs) -> None:
+        self._end(run_id, error=True)
+
+
+metrics_callback_handler = MetricsCallbackHandler()
+
+_metrics_callback_var: contextvars.ContextVar[Optional[MetricsCallbackHandler]] = contextvars.ContextVar(
+    "metrics_callback_handler", default=metrics_callback_handler
+)
+_callbacks_lock = threading.Lock()
+_callbacks_installed = False
+
+
+def install_langchain_callbacks() -> None:
+    """Attach the handler to every LangChain run, wherever the chain or model was built
+
+    Importing the tracer hook pulls in LangSmith, so this runs when the first
+    model is requested rather than at import.
+    """
+    global _callbacks_installed
+    with _callbacks_lock:
+        if _callbacks_installed:
+            return
+        from langchain_core.tracers.context import register_configure_hook
+        register_configure_hook(_metrics_callback_var, inheritable=True)
+        _callbacks_installed = True
+
+
+class StatsCollector:
+    """Expose gauges computed from stats objects at scrape time"""
+
+    def __init__(self):
+        self._gauges: Dict[str, Tuple[str, Tuple[str, ...], Callable[[], Dict[Tuple[str, ...], float]]]] = {}
+
+    def add(self, name: str, documentation: str, labels: Tuple[str, ...], read: Callable[[], Dict[Tuple[str, ...], float]]) -> None:
+        """Register a gauge; ``read`` returns {label values: value}"""
+        self._gauges[f"{METRICS_PREFIX}_{name}"] = (documentation, labels, read)
+
+    def collect(self):
+        for name, (documentation, labels, read) in self._gauges.items():
+            family = GaugeMetricFamily(name, documentation, labels=list(labels))
+            for label_values, value in read().items():
+                family.add_metric(list(label_values), value)
+            yield family
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Render all metrics in the Prometheus text format, merging workers in multiprocess mode"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        # Scrape-time gauges describe the worker that served the scrape
+        registry.register(stats_collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each request by route template and exposing it to stages"""
+
+    def __init__(self, app):
+        self.app = app
+        self._route_cache: Dict[Tuple[str, str], str] = {}
+        _Tracing.setup()
+
+    def _route(self, scope) -> str:
+        key = (scope["method"], scope["path"])
+        route = self._route_cache.get(key)
+        if route is None:
+            route = "unmatched"
+            exact = False
+            for candidate in scope["app"].router.routes:
+                match, _ = candidate.matches(scope)
+                if match == Match.FULL:
+                    route = getattr(candidate, "path", "unmatched")
+                    exact = isinstance(candidate, Route) and "{" not in route
+                    break
+            # Only plain routes without path parameters are cached: a Mount matches every path under its prefix
+            if exact:
+                self._route_cache[key] = route
+        return route
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = self._route(scope)
+        token = current_route.set(route)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        REQUESTS_IN_PROGRESS.labels(route).inc()
+        try:
+            with _Tracing.span(f"{scope['method']} {route}", {"http.method": scope["method"], "http.route": route}):
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_PROGRESS.labels(route).dec()
+            REQUEST_LATENCY.labels(scope["method"], route, str(status["code"])).observe(time.perf_counter() - started)
+            current_route.reset(token)
@@ -0,0 +1,176 @@
+"""
+Exact and semantic response cache for deterministic endpoints.
+
+The exact tier is keyed by endpoint, model, temperature and the normalized
+prompt inputs. The optional semantic tier reuses a cached answer when a new
+question's embedding is within a cosine-similarity threshold of a cached
+question asked in the same scope (for example, the same document).
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so formatting-only differences share a cache entry"""
+    return " ".join(text.split())
+
+
+def normalize_code(code: str) -> str:
+    """Normalize line endings and trailing whitespace while keeping indentation"""
+    lines = [line.rstrip() for line in code.replace("\r\n", "\n").split("\n")]
+    return "\n".join(lines).strip("\n")
+
+
+def _env_set(name: str, default: str) -> set:
+    return {item.strip() for item in os.getenv(name, default).split(",") if item.strip()}
+
+
+class ResponseCache:
+    """LRU response cache with an exact tier and a per-scope semantic tier"""
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl_seconds: Optional[float] = 86400,
+        similarity_threshold: float = 0.95,
+        enabled_endpoints: Optional[set] = None,
+        semantic_endpoints: Optional[set] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.enabled_endpoints = enabled_endpoints or set()
+        self.semantic_endpoints = semantic_endpoints or set()
+        self._entries: "OrderedDict[str, Tuple[Any, float, Optional[str]]]" = OrderedDict()
+        # scope -> (entry keys, matrix of unit-length question embeddings)
+        self._vectors: Dict[str, Tuple[List[str], np.ndarray]] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def is_enabled(self, endpoint: str) -> bool:
+        return endpoint in self.enabled_endpoints
+
+    def is_semantic(self, endpoint: str) -> bool:
+        return self.is_enabled(endpoint) and endpoint in self.semantic_endpoints
+
+    @staticmethod
+    def make_key(endpoint: str, model: str, temperature: float, **inputs: Any) -> str:
+        """Build an exact-match key from the endpoint, model settings and (normalized) inputs"""
+        payload = json.dumps(
+            {"endpoint": endpoint, "model": model, "temperature": temperature, "inputs": inputs},
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _record(self, endpoint: str, outcome: str) -> None:
+        counters = self._stats.setdefault(endpoint, {"hits": 0, "semantic_hits": 0, "misses": 0})
+        counters[outcome] += 1
+
+    def _remove(self, key: str) -> None:
+        _, _, scope = self._entries.pop(key)
+        if scope is not None and scope in self._vectors:
+            keys, matrix = self._vectors[scope]
+            if key in keys:
+                position = keys.index(key)
+                keys.pop(position)
+                matrix = np.delete(matrix, position, axis=0)
+                if keys:
+                    self._vectors[scope] = (keys, matrix)
+                else:
+                    del self._vectors[scope]
+
+    def _lookup(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.ttl_seconds is not None and time.time() - entry[1] > self.ttl_seconds:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def get(self, endpoint: str, key: str) -> Optional[Any]:
+        """Return the exact-match cached value, or None"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self._record(endpoint, "hits")
+            return value
+
+    def search(self, endpoint: str, scope: str, vector: List[float]) -> Optional[Tuple[Any, float]]:
+        """Return (value, similarity) for the most similar cached question in scope"""
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        with self._lock:
+            if scope not in self._vectors:
+                return None
+            keys, matrix = self._vectors[scope]
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.similarity_threshold:
+                return None
+            value = self._lookup(keys[best])
+            if value is None:
+                return None
+            self._record(endpoint, "semantic_hits")
+            return value, similarity
+
+    def miss(self, endpoint: str) -> None:
+        """Count a cache miss for an endpoint"""
+        with self._lock:
+            self._record(endpoint, "misses")
+
+    def put(self, key: str, value: Any, scope: Optional[str] = None, vector: Optional[List[float]] = None) -> None:
+        """Cache a value, optionally indexing its question embedding for semantic lookup"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if vector is None:
+                scope = None
+            self._entries[key] = (value, time.time(), scope)
+            if scope is not None:
+                row = np.asarray(vector, dtype=np.float32)
+                row /= np.linalg.norm(row) or 1.0
+                keys, matrix = self._vectors.get(scope, ([], np.empty((0, row.shape[0]), dtype=np.float32)))
+                keys.append(key)
+                self._vectors[scope] = (keys, np.vstack([matrix, row]))
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self) -> Dict[str, Any]:
+        """Return per-endpoint hit and miss counters"""
+        with self._lock:
+            endpoints = {}
+            for endpoint, counters in self._stats.items():
+                total = sum(counters.values())
+                endpoints[endpoint] = {
+                    **counters,
+                    "hit_ratio": round((counters["hits"] + counters["semantic_hits"]) / total, 4) if total else 0.0,
+                }
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "enabled_endpoints": sorted(self.enabled_endpoints),
+                "semantic_endpoints": sorted(self.semantic_endpoints),
+                "endpoints": endpoints,
+            }
+
+
+def create_response_cache() -> ResponseCache:
+    """Create the response cache configured by RESPONSE_CACHE_* environment variables"""
+    return ResponseCache(
+        max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000")),
+        ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL", "86400")),
+        similarity_threshold=float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95")),
+        enabled_endpoints=_env_set("RESPONSE_CACHE_ENDPOINTS", "code_analyze,document_qa"),
+        semantic_endpoints=_env_set("RESPONSE_CACHE_SEMANTIC_ENDPOINTS", ""),
+    )
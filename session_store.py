@@ -0,0 +1,476 @@
+"""
+Bounded chat session storage.
+
+Sessions are stored as compact, JSON-serializable message history rather than
+live chain objects. The in-memory backend serves a single worker; the SQLite
+and Redis backends let several uvicorn workers share the same sessions.
+All backends enforce a maximum session count, an idle TTL, LRU eviction and
+a byte budget.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+_MESSAGE_TYPES = {
+    "human": HumanMessage,
+    "ai": AIMessage,
+    "system": SystemMessage,
+}
+
+
+def messages_to_records(messages: List[BaseMessage]) -> List[Dict[str, str]]:
+    """Convert LangChain messages to compact {"type", "content"} records"""
+    return [{"type": message.type, "content": message.content} for message in messages]
+
+
+def messages_from_records(records: List[Dict[str, str]]) -> List[BaseMessage]:
+    """Convert compact records back into LangChain messages"""
+    return [_MESSAGE_TYPES[record["type"]](content=record["content"]) for record in records]
+
+
+SessionUpdate = Callable[[Optional[Dict[str, Any]]], Optional[Dict[str, Any]]]
+
+
+def _serialize(record: Dict[str, Any]) -> str:
+    return json.dumps(record, separators=(",", ":"))
+
+
+class SessionStore:
+    """Interface for session backends; records are JSON-serializable dicts"""
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def peek(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Read a session without refreshing its last-access time"""
+        raise NotImplementedError
+
+    def set(self, session_id: str, record: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def update(self, session_id: str, update: SessionUpdate) -> Optional[Dict[str, Any]]:
+        """Atomically replace a session with ``update(current)``; nothing is written if it returns None"""
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    def keys(self) -> List[str]:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+
+class MemorySessionStore(SessionStore):
+    """Per-process session store with LRU eviction"""
+
+    def __init__(self, max_sessions: int = 1000, ttl_seconds: Optional[float] = 3600, max_bytes: Optional[int] = None):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _remove(self, session_id: str) -> None:
+        data, _ = self._sessions.pop(session_id)
+        self._total_bytes -= len(data)
+
+    def _expire(self) -> None:
+        if self.ttl_seconds is None:
+            return
+        cutoff = time.time() - self.ttl_seconds
+        # Entries are in access order, so expired sessions are at the front
+        while self._sessions:
+            session_id, (_, last_access) = next(iter(self._sessions.items()))
+            if last_access >= cutoff:
+                break
+            self._remove(session_id)
+            self.evictions += 1
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._expire()
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            self._sessions[session_id] = (entry[0], time.time())
+            self._sessions.move_to_end(session_id)
+            return json.loads(entry[0])
+
+    def peek(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            return json.loads(entry[0]) if entry is not None else None
+
+    def _store(self, session_id: str, data: str) -> None:
+        if session_id in self._sessions:
+            self._remove(session_id)
+        self._sessions[session_id] = (data, time.time())
+        self._total_bytes += len(data)
+        self._expire()
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions
+            or (self.max_bytes is not None and self._total_bytes > self.max_bytes)
+        ):
+            self._remove(next(iter(self._sessions)))
+            self.evictions += 1
+
+    def set(self, session_id: str, record: Dict[str, Any]) -> None:
+        data = _serialize(record)
+        with self._lock:
+            self._store(session_id, data)
+
+    def update(self, session_id: str, update: SessionUpdate) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._expire()
+            entry = self._sessions.get(session_id)
+            record = update(json.loads(entry[0]) if entry is not None else None)
+            if record is not None:
+                self._store(session_id, _serialize(record))
+            return record
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            if session_id in self._sessions:
+                self._remove(session_id)
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            self._expire()
+            return list(self._sessions.keys())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "total_bytes": self._total_bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+
+class SQLiteSessionStore(SessionStore):
+    """Session store in a SQLite file shared by all workers on a host"""
+
+    def __init__(self, path: str, max_sessions: int = 1000, ttl_seconds: Optional[float] = 3600, max_bytes: Optional[int] = None):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect()
+        # A preloading server (gunicorn --preload) forks after this store is created; never share the connection
+        os.register_at_fork(after_in_child=self._connect)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)")
+        self._conn.commit()
+
+    def _connect(self) -> None:
+        """Open this process's connection to the database"""
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+
+    def _expire(self) -> None:
+        if self.ttl_seconds is not None:
+            self._conn.execute(
+                "DELETE FROM sessions WHERE last_access < ?", (time.time() - self.ttl_seconds,)
+            )
+
+    def _evict(self) -> None:
+        """Delete least recently used sessions until count and byte limits hold"""
+        count, total_bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions"
+        ).fetchone()
+        if count > self.max_sessions:
+            self._conn.execute(
+                "DELETE FROM sessions WHERE session_id IN "
+                "(SELECT session_id FROM sessions ORDER BY last_access LIMIT ?)",
+                (count - self.max_sessions,),
+            )
+        if self.max_bytes is not None and total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT session_id, size FROM sessions ORDER BY last_access"
+            ).fetchall()
+            total_bytes = sum(size for _, size in rows)
+            # Never evict the most recently written session
+            for session_id, size in rows[:-1]:
+                if total_bytes <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                total_bytes -= size
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            now = time.time()
+            row = self._conn.execute(
+                "SELECT data, last_access FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE sessions SET last_access = ? WHERE session_id = ?", (now, session_id)
+            )
+            self._conn.commit()
+            return json.loads(row[0])
+
+    def peek(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def set(self, session_id: str, record: Dict[str, Any]) -> None:
+        data = _serialize(record)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, size, last_access) VALUES (?, ?, ?, ?)",
+                (session_id, data, len(data), time.time()),
+            )
+            self._expire()
+            self._evict()
+            self._conn.commit()
+
+    def update(self, session_id: str, update: SessionUpdate) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            # The write lock is taken before the read, so other workers cannot interleave a write
+            self._conn.commit()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._conn.execute(
+                    "SELECT data, last_access FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                current = None
+                if row is not None and (self.ttl_seconds is None or now - row[1] <= self.ttl_seconds):
+                    current = json.loads(row[0])
+                record = update(current)
+                if record is not None:
+                    data = _serialize(record)
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO sessions (session_id, data, size, last_access) VALUES (?, ?, ?, ?)",
+                        (session_id, data, len(data), now),
+                    )
+                    self._expire()
+                    self._evict()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
+            return record
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            self._expire()
+            self._conn.commit()
+            return [row[0] for row in self._conn.execute("SELECT session_id FROM sessions ORDER BY last_access")]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions"
+            ).fetchone()
+        return {
+            "backend": "sqlite",
+            "sessions": count,
+            "total_bytes": total_bytes,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class RedisSessionStore(SessionStore):
+    """Session store on any Redis-protocol server, shared across workers and hosts
+
+    Session data is kept in ``<prefix>data:<id>`` keys with the idle TTL applied
+    by Redis. A sorted set of last-access times and a hash of record sizes
+    drive LRU eviction against the session count and byte limits.
+    """
+
+    def __init__(self, url: str, max_sessions: int = 1000, ttl_seconds: Optional[float] = 3600, max_bytes: Optional[int] = None, prefix: str = "langchain-api:sessions:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError(
+                "The redis session backend requires the redis package: pip install redis"
+            ) from e
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self._access_key = prefix + "access"
+        self._sizes_key = prefix + "sizes"
+
+    def _data_key(self, session_id: str) -> str:
+        return f"{self.prefix}data:{session_id}"
+
+    def _forget(self, pipe, session_ids: List[str]) -> None:
+        if not session_ids:
+            return
+        pipe.delete(*[self._data_key(session_id) for session_id in session_ids])
+        pipe.zrem(self._access_key, *session_ids)
+        pipe.hdel(self._sizes_key, *session_ids)
+
+    def _expire(self) -> None:
+        if self.ttl_seconds is None:
+            return
+        expired = self._client.zrangebyscore(self._access_key, 0, time.time() - self.ttl_seconds)
+        pipe = self._client.pipeline()
+        self._forget(pipe, expired)
+        pipe.execute()
+
+    def _evict(self, current_session_id: str) -> None:
+        count = self._client.zcard(self._access_key)
+        victims = []
+        if count > self.max_sessions:
+            victims = self._client.zrange(self._access_key, 0, count - self.max_sessions - 1)
+        if self.max_bytes is not None:
+            sizes = {key: int(value) for key, value in self._client.hgetall(self._sizes_key).items()}
+            total_bytes = sum(size for key, size in sizes.items() if key not in victims)
+            if total_bytes > self.max_bytes:
+                for session_id in self._client.zrange(self._access_key, 0, -1):
+                    if total_bytes <= self.max_bytes:
+                        break
+                    if session_id in victims or session_id == current_session_id:
+                        continue
+                    victims.append(session_id)
+                    total_bytes -= sizes.get(session_id, 0)
+        pipe = self._client.pipeline()
+        self._forget(pipe, victims)
+        pipe.execute()
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        data = self._client.get(self._data_key(session_id))
+        if data is None:
+            return None
+        pipe = self._client.pipeline()
+        pipe.zadd(self._access_key, {session_id: time.time()})
+        if self.ttl_seconds is not None:
+            pipe.expire(self._data_key(session_id), int(self.ttl_seconds))
+        pipe.execute()
+        return json.loads(data)
+
+    def peek(self, session_id: str) -> Optional[Dict[str, Any]]:
+        data = self._client.get(self._data_key(session_id))
+        return json.loads(data) if data is not None else None
+
+    def set(self, session_id: str, record: Dict[str, Any]) -> None:
+        data = _serialize(record)
+        pipe = self._client.pipeline()
+        if self.ttl_seconds is not None:
+            pipe.set(self._data_key(session_id), data, ex=int(self.ttl_seconds))
+        else:
+            pipe.set(self._data_key(session_id), data)
+        pipe.zadd(self._access_key, {session_id: time.time()})
+        pipe.hset(self._sizes_key, session_id, len(data))
+        pipe.execute()
+        self._expire()
+        self._evict(session_id)
+
+    def update(self, session_id: str, update: SessionUpdate) -> Optional[Dict[str, Any]]:
+        from redis.exceptions import WatchError
+
+        data_key = self._data_key(session_id)
+        with self._client.pipeline() as pipe:
+            while True:
+                try:
+                    # Optimistic locking: the transaction fails if another writer touched the key after WATCH
+                    pipe.watch(data_key)
+                    data = pipe.get(data_key)
+                    record = update(json.loads(data) if data is not None else None)
+                    if record is None:
+                        pipe.unwatch()
+                        return None
+                    data = _serialize(record)
+                    pipe.multi()
+                    if self.ttl_seconds is not None:
+                        pipe.set(data_key, data, ex=int(self.ttl_seconds))
+                    else:
+                        pipe.set(data_key, data)
+                    pipe.zadd(self._access_key, {session_id: time.time()})
+                    pipe.hset(self._sizes_key, session_id, len(data))
+                    pipe.execute()
+                    break
+                except WatchError:
+                    continue
+        self._expire()
+        self._evict(session_id)
+        return record
+
+    def delete(self, session_id: str) -> None:
+        pipe = self._client.pipeline()
+        self._forget(pipe, [session_id])
+        pipe.execute()
+
+    def keys(self) -> List[str]:
+        self._expire()
+        return self._client.zrange(self._access_key, 0, -1)
+
+    def stats(self) -> Dict[str, Any]:
+        sizes = self._client.hvals(self._sizes_key)
+        return {
+            "backend": "redis",
+            "sessions": self._client.zcard(self._access_key),
+            "total_bytes": sum(int(size) for size in sizes),
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+        }
+
+
+def create_session_store() -> SessionStore:
+    """Create the session store configured by SESSION_* environment variables"""
+    backend = os.getenv("SESSION_BACKEND", "memory").lower()
+    max_sessions = int(os.getenv("SESSION_MAX_COUNT", "1000"))
+    ttl_seconds = float(os.getenv("SESSION_TTL", "3600"))
+    max_bytes = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+
+    if backend == "memory":
+        return MemorySessionStore(max_sessions, ttl_seconds, max_bytes)
+    if backend == "sqlite":
+        path = os.getenv("SESSION_SQLITE_PATH", os.path.join(".cache", "sessions.sqlite3"))
+        return SQLiteSessionStore(path, max_sessions, ttl_seconds, max_bytes)
+    if backend == "redis":
+        url = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+        return RedisSessionStore(url, max_sessions, ttl_seconds, max_bytes)
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
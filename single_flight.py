@@ -0,0 +1,176 @@
+"""
+Single-flight coalescing of identical in-flight calls.
+
+Concurrent calls with the same key share one execution: the first caller
+starts the work and later callers await the same task. With a shared
+directory configured, workers also coordinate through a fixed set of lock
+files, one per stripe of keys, and a SQLite table of recent results, so a duplicate arriving at another
+worker waits for the first one instead of repeating the call.
+"""
+
+import asyncio
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from concurrency import run_sync
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls by key, in-process and optionally across workers"""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        shared_dir: Optional[str] = None,
+        result_ttl: float = 5.0,
+        wait_timeout: float = 120.0,
+        poll_interval: float = 0.05,
+        lock_stripes: int = 256,
+    ):
+        self.enabled = enabled
+        self.shared_dir = shared_dir
+        self.result_ttl = result_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.lock_stripes = max(1, lock_stripes)
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._local = threading.local()
+        self.leaders = 0
+        self.coalesced = 0
+        self.shared_hits = 0
+
+        if self.shared_dir:
+            os.makedirs(self.shared_dir, exist_ok=True)
+            with self._connect() as connection:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(os.path.join(self.shared_dir, "results.sqlite3"), timeout=30)
+            self._local.connection = connection
+        return connection
+
+    def _read_result(self, key: str) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT value FROM results WHERE key = ? AND created_at > ?",
+            (key, time.time() - self.result_ttl),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _write_result(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (key, value, now))
+            connection.execute("DELETE FROM results WHERE created_at < ?", (now - self.result_ttl,))
+
+    async def _acquire_file_lock(self, key: str):
+        """Take the key's lock stripe, returning (file, waited) or (None, True) on timeout"""
+        # Keys are request hashes; a lock file each would pile up forever, so keys share a fixed set of stripes
+        stripe = zlib.crc32(key.encode("utf-8")) % self.lock_stripes
+        lock_file = open(os.path.join(self.shared_dir, f"stripe-{stripe}.lock"), "w")
+        deadline = time.monotonic() + self.wait_timeout
+        waited = False
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock_file, waited
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    lock_file.close()
+                    return None, True
+                waited = True
+                await asyncio.sleep(self.poll_interval)
+
+    async def _run_shared(
+        self,
+        key: str,
+        func: Callable[[], Awaitable[Any]],
+        encode: Callable[[Any], Any],
+        decode: Callable[[Any], Any],
+    ) -> Any:
+        # A worker that just finished the same call left its result behind
+        stored = await run_sync(self._read_result, key)
+        if stored is not None:
+            self.shared_hits += 1
+            return decode(json.loads(stored))
+
+        lock_file, waited = await self._acquire_file_lock(key)
+        try:
+            if waited:
+                stored = await run_sync(self._read_result, key)
+                if stored is not None:
+                    self.shared_hits += 1
+                    return decode(json.loads(stored))
+            value = await func()
+            await run_sync(self._write_result, key, json.dumps(encode(value)))
+            return value
+        finally:
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+    async def do(
+        self,
+        key: Optional[str],
+        func: Callable[[], Awaitable[Any]],
+        encode: Optional[Callable[[Any], Any]] = None,
+        decode: Optional[Callable[[Any], Any]] = None,
+        local_only: bool = False,
+    ) -> Tuple[Any, bool]:
+        """Run func once per key among concurrent callers; returns (value, shared)
+
+        A key of None, or a disabled coalescer, runs func directly. Results
+        cross workers only when a shared directory is configured and
+        ``local_only`` is false; ``encode`` and ``decode`` convert them to
+        and from JSON-compatible values.
+        """
+        if key is None or not self.enabled:
+            return await func(), False
+
+        task = self._tasks.get(key)
+        if task is not None:
+            self.coalesced += 1
+            # Shield so a disconnecting caller does not cancel the work others await
+            return await asyncio.shield(task), True
+
+        if self.shared_dir and not local_only:
+            work = self._run_shared(key, func, encode or (lambda value: value), decode or (lambda value: value))
+        else:
+            work = func()
+        task = asyncio.ensure_future(work)
+        self._tasks[key] = task
+        task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        self.leaders += 1
+        return await asyncio.shield(task), False
+
+    def stats(self) -> Dict[str, Any]:
+        """Return coalescing counters"""
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._tasks),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "shared_hits": self.shared_hits,
+            "cross_worker": bool(self.shared_dir),
+        }
+
+
+def create_single_flight() -> SingleFlight:
+    """Create the coalescer configured by SINGLE_FLIGHT_* environment variables"""
+    return SingleFlight(
+        enabled=os.getenv("SINGLE_FLIGHT", "1") == "1",
+        shared_dir=os.getenv("SINGLE_FLIGHT_DIR") or None,
+        result_ttl=float(os.getenv("SINGLE_FLIGHT_RESULT_TTL", "5")),
+        wait_timeout=float(os.getenv("SINGLE_FLIGHT_WAIT_TIMEOUT", "120")),
+        lock_stripes=int(os.getenv("SINGLE_FLIGHT_LOCK_STRIPES", "256")),
+    )
@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
 """
 LangChain API Server Startup Script
+
+Runs a single auto-reloading server for development. With --production (or
+APP_ENV=production) it starts gunicorn with several uvicorn workers, the app
+preloaded before fork and no reload; see gunicorn.conf.py.
 """
 
+import argparse
 import os
 import sys
 import uvicorn
@@ -21,8 +26,29 @@ def check_environment():
     print("✅ Environment check passed")
     return True
 
+def run_production(workers=None):
+    """Replace this process with a gunicorn master running uvicorn workers"""
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        print("❌ Error: production mode requires gunicorn (pip install gunicorn)")
+        sys.exit(1)
+    
+    if workers:
+        os.environ["WEB_CONCURRENCY"] = str(workers)
+    config = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py")
+    print(f"Starting gunicorn with {os.getenv('WEB_CONCURRENCY', 'default')} workers...")
+    sys.stdout.flush()
+    os.execvp(sys.executable, [sys.executable, "-m", "gunicorn", "--config", config, "api_app:app"])
+
 def main():
     """Main startup function"""
+    parser = argparse.ArgumentParser(description="Start the LangChain API server")
+    parser.add_argument("--production", action="store_true", help="Run gunicorn with several workers and no reload")
+    parser.add_argument("--workers", type=int, help="Worker processes in production mode (default: WEB_CONCURRENCY or min(4, CPUs))")
+    args = parser.parse_args()
+    production = args.production or os.getenv("APP_ENV", "").lower() == "production"
+    
     print("🚀 Starting LangChain API Server...")
     print("=" * 50)
     
@@ -30,6 +56,9 @@ def main():
     if not check_environment():
         sys.exit(1)
     
+    if production:
+        run_production(args.workers)
+    
     print("\n📋 Available endpoints:")
     print("  • http://localhost:8000/          - Health check")
     print("  • http://localhost:8000/ui        - Web UI")
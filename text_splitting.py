@@ -0,0 +1,172 @@
+"""
+Token-aware document splitting with duplicate removal.
+
+Documents are split recursively on structure (Markdown headings, code
+fences, paragraphs, lines, sentences, words), and chunk sizes are measured
+in tokens rather than characters. Exact and near-duplicate chunks (SimHash)
+are dropped before anything is embedded, and the chunks and tokens that
+are actually embedded are counted so chunk sizes can be tuned.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from typing import TYPE_CHECKING, Any, Dict, List, Set, Tuple
+
+from chat_memory import count_tokens
+
+if TYPE_CHECKING:
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+DEDUP_NEAR_DUPLICATES = os.getenv("DEDUP_NEAR_DUPLICATES", "1") == "1"
+NEAR_DUPLICATE_DISTANCE = int(os.getenv("NEAR_DUPLICATE_DISTANCE", "3"))
+
+# Coarsest boundaries first: headings, code fences, paragraphs, lines, sentences, words
+STRUCTURE_SEPARATORS = [
+    r"\n(?=#{1,6} )",
+    r"\n(?=```)",
+    r"\n\n",
+    r"\n",
+    r"(?<=[.!?]) ",
+    r" ",
+    r"",
+]
+
+_WORD = re.compile(r"\w+")
+
+
+def create_token_splitter(chunk_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> "RecursiveCharacterTextSplitter":
+    """Create a structure-aware recursive splitter whose chunk sizes are in tokens"""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    return RecursiveCharacterTextSplitter(
+        separators=STRUCTURE_SEPARATORS,
+        is_separator_regex=True,
+        keep_separator=True,
+        chunk_size=chunk_tokens,
+        chunk_overlap=overlap_tokens,
+        length_function=count_tokens,
+    )
+
+
+def splitter_settings(chunk_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Dict[str, Any]:
+    """Settings that shape the chunks, for use in index cache keys"""
+    return {
+        "splitter": "token-recursive",
+        "chunk_tokens": chunk_tokens,
+        "overlap_tokens": overlap_tokens,
+        "near_duplicates": DEDUP_NEAR_DUPLICATES,
+        "near_duplicate_distance": NEAR_DUPLICATE_DISTANCE,
+    }
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over word trigrams"""
+    words = _WORD.findall(text.lower())
+    shingles = [" ".join(words[i:i + 3]) for i in range(max(len(words) - 2, 1))]
+    weights = [0] * 64
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+class ChunkDeduplicator:
+    """Drop exact and near-duplicate chunks, remembering what it has already seen
+
+    Near duplicates are found by SimHash Hamming distance. The 64-bit hash is
+    split into ``distance + 1`` bands, so any pair within the distance shares
+    at least one band exactly and only those candidates are compared.
+    """
+
+    def __init__(self, near_duplicates: bool = DEDUP_NEAR_DUPLICATES, max_distance: int = NEAR_DUPLICATE_DISTANCE):
+        self.near_duplicates = near_duplicates
+        self.max_distance = max_distance
+        self._bands = max_distance + 1
+        self._band_bits = 64 // self._bands
+        self._exact: Set[str] = set()
+        self._band_index: Dict[Tuple[int, int], List[int]] = {}
+        self.duplicates = 0
+        self.near_duplicates_removed = 0
+
+    def _band_keys(self, fingerprint: int) -> List[Tuple[int, int]]:
+        mask = (1 << self._band_bits) - 1
+        return [(band, fingerprint >> (band * self._band_bits) & mask) for band in range(self._bands)]
+
+    def _is_near_duplicate(self, fingerprint: int) -> bool:
+        for key in self._band_keys(fingerprint):
+            for other in self._band_index.get(key, ()):
+                if bin(fingerprint ^ other).count("1") <= self.max_distance:
+                    return True
+        return False
+
+    def filter(self, chunks: List[str]) -> List[str]:
+        """Return the chunks that are not duplicates of earlier ones"""
+        kept = []
+        for chunk in chunks:
+            digest = hashlib.sha1(" ".join(chunk.lower().split()).encode("utf-8")).hexdigest()
+            if digest in self._exact:
+                self.duplicates += 1
+                continue
+            self._exact.add(digest)
+            if self.near_duplicates:
+                fingerprint = simhash(chunk)
+                if self._is_near_duplicate(fingerprint):
+                    self.near_duplicates_removed += 1
+                    continue
+                for key in self._band_keys(fingerprint):
+                    self._band_index.setdefault(key, []).append(fingerprint)
+            kept.append(chunk)
+        return kept
+
+
+def chunk_stats(chunks: List[str], deduplicator: ChunkDeduplicator) -> Dict[str, int]:
+    """Chunk and token counts for the chunks of one document that will be embedded"""
+    return {
+        "chunks": len(chunks),
+        "tokens_embedded": sum(count_tokens(chunk) for chunk in chunks),
+        "duplicates_removed": deduplicator.duplicates,
+        "near_duplicates_removed": deduplicator.near_duplicates_removed,
+    }
+
+
+def split_text(text: str, splitter=None) -> Tuple[List[str], Dict[str, int]]:
+    """Split text into deduplicated chunks and report what will be embedded"""
+    splitter = splitter or create_token_splitter()
+    deduplicator = ChunkDeduplicator()
+    chunks = deduplicator.filter(splitter.split_text(text))
+    stats = chunk_stats(chunks, deduplicator)
+    ingestion_stats.record(stats)
+    return chunks, stats
+
+
+class IngestionStats:
+    """Running totals of chunks and tokens embedded across documents"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {"documents": 0, "chunks": 0, "tokens_embedded": 0, "duplicates_removed": 0, "near_duplicates_removed": 0}
+
+    def record(self, stats: Dict[str, int]) -> None:
+        with self._lock:
+            self.totals["documents"] += 1
+            for name, value in stats.items():
+                self.totals[name] += value
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            totals = dict(self.totals)
+        documents = totals["documents"]
+        return {
+            **totals,
+            "avg_chunks_per_document": round(totals["chunks"] / documents, 1) if documents else 0.0,
+            "avg_tokens_per_chunk": round(totals["tokens_embedded"] / totals["chunks"], 1) if totals["chunks"] else 0.0,
+            **splitter_settings(),
+        }
+
+
+ingestion_stats = IngestionStats()
@@ -0,0 +1,422 @@
+"""
+Shared scheduler for upstream model calls.
+
+Every chat and embeddings request to the model provider goes through a
+scheduler that holds requests-per-minute and tokens-per-minute token buckets.
+Waiting calls are admitted in priority order (interactive, then default, then
+batch). Once too many calls are queued, or a call has waited too long, new
+work is shed with ``UpstreamUnavailable`` and a Retry-After hint instead of
+piling onto an overloaded provider. Rate-limit and transient errors are
+retried with jittered exponential backoff that honours Retry-After. A 429
+also pauses admissions and halves the refill rate, which then recovers as
+calls succeed.
+"""
+
+import asyncio
+import email.utils
+import heapq
+import itertools
+import math
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+if TYPE_CHECKING:
+    import httpx
+
+T = TypeVar("T")
+
+PRIORITIES = {"interactive": 0, "default": 1, "batch": 2}
+
+# Priority of the upstream calls made while serving the current request
+request_priority: ContextVar[str] = ContextVar("upstream_priority", default="default")
+
+# Floor for the adaptive refill rate after repeated 429s
+MIN_RATE_SCALE = 0.1
+
+
+def set_request_priority(level: str) -> None:
+    """Set the priority of upstream calls made by the current request"""
+    if level not in PRIORITIES:
+        raise ValueError(f"Unknown priority '{level}'; expected one of {', '.join(PRIORITIES)}")
+    request_priority.set(level)
+
+
+class UpstreamUnavailable(Exception):
+    """The scheduler shed a call, or the provider kept rate limiting it"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allowance of ``per_minute`` units that refills continuously (0 disables the limit)"""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float, scale: float) -> None:
+        if self.per_minute:
+            self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute / 60 * scale)
+        self.updated = now
+
+    def delay(self, amount: float, scale: float) -> float:
+        """Seconds until ``amount`` units are available"""
+        if not self.per_minute:
+            return 0.0
+        # A call larger than the whole bucket only waits for a full bucket
+        missing = min(amount, self.per_minute) - self.level
+        return max(0.0, missing / (self.per_minute / 60 * scale))
+
+    def consume(self, amount: float) -> None:
+        if self.per_minute:
+            self.level -= amount
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    sequence: int
+    # Wakes the waiting coroutine or thread; safe to call from any thread
+    wake: Callable[[], None] = field(compare=False)
+    done: bool = field(default=False, compare=False)
+
+
+def _retry_after(response: Optional["httpx.Response"]) -> Optional[float]:
+    """Seconds the provider asked us to wait, from retry-after-ms or Retry-After"""
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def classify_error(error: BaseException) -> Tuple[bool, Optional[float], bool]:
+    """Return (retryable, retry_after, rate_limited) for an upstream error"""
+    # The SDK is already loaded by whoever made the call; importing it here keeps this module cheap
+    import openai
+
+    if isinstance(error, openai.RateLimitError):
+        # An exhausted quota will not recover by waiting
+        if getattr(error, "code", None) == "insufficient_quota":
+            return False, None, False
+        return True, _retry_after(error.response), True
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True, None, False
+    if isinstance(error, openai.APIStatusError) and (error.status_code >= 500 or error.status_code in (408, 409)):
+        return True, _retry_after(error.response), False
+    return False, None, False
+
+
+class UpstreamScheduler:
+    """Token-bucket admission, priority queueing, retries and load shedding for one upstream API"""
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        max_queue: int = 256,
+        max_wait: float = 30.0,
+        max_retries: int = 4,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+    ):
+        self.name = name
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._scale = 1.0
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self._queue: List[_Waiter] = []
+        self._sequence = itertools.count()
+        self._waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failures = 0
+        self.wait_seconds = 0.0
+
+    # Admission
+
+    def _admission_delay(self, tokens: int, requests: int) -> float:
+        """Seconds until the call fits both buckets; takes the allowance when it fits now"""
+        with self._lock:
+            now = time.monotonic()
+            self._requests.refill(now, self._scale)
+            self._tokens.refill(now, self._scale)
+            delay = max(
+                self._blocked_until - now,
+                self._requests.delay(requests, self._scale),
+                self._tokens.delay(tokens, self._scale),
+            )
+            if delay > 0:
+                return delay
+            self._requests.consume(requests)
+            self._tokens.consume(tokens)
+            self.admitted += 1
+            return 0.0
+
+    def _retry_after_estimate(self) -> float:
+        """Rough time for the current queue to drain at the current request rate; the caller holds the lock"""
+        rate = self._requests.per_minute / 60 * self._scale
+        return max(1.0, math.ceil(self._waiting / rate)) if rate else 1.0
+
+    def _shed(self, reason: str) -> UpstreamUnavailable:
+        with self._lock:
+            self.shed += 1
+            retry_after = self._retry_after_estimate()
+        return UpstreamUnavailable(f"Upstream {self.name} {reason}", retry_after)
+
+    def _head(self) -> Optional[_Waiter]:
+        while self._queue and self._queue[0].done:
+            heapq.heappop(self._queue)
+        return self._queue[0] if self._queue else None
+
+    def _enqueue(self, priority: str, wake: Callable[[], None]) -> _Waiter:
+        """Join the shared priority queue, or shed the call if it is full"""
+        with self._lock:
+            full = bool(self.max_queue) and self._waiting >= self.max_queue
+            if not full:
+                waiter = _Waiter(PRIORITIES[priority], next(self._sequence), wake)
+                heapq.heappush(self._queue, waiter)
+                self._waiting += 1
+        if full:
+            raise self._shed("queue is full")
+        return waiter
+
+    def _is_head(self, waiter: _Waiter) -> bool:
+        with self._lock:
+            return self._head() is waiter
+
+    def _dequeue(self, waiter: _Waiter, started: float, admitted: bool) -> None:
+        """Leave the queue and wake the waiter that is now at its head"""
+        with self._lock:
+            waiter.done = True
+            self._waiting -= 1
+            if admitted:
+                self.wait_seconds += time.monotonic() - started
+            head = self._head()
+        if head is not None:
+            head.wake()
+
+    def _next_timeout(self, waiter: _Waiter, tokens: int, requests: int, started: float) -> Optional[float]:
+        """Seconds to wait before checking again (0 once admitted), or shed the call"""
+        timeout = None
+        if self._is_head(waiter):
+            timeout = self._admission_delay(tokens, requests)
+            if timeout == 0:
+                return 0.0
+        if self.max_wait:
+            remaining = started + self.max_wait - time.monotonic()
+            if remaining <= 0:
+                raise self._shed("wait exceeded")
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return timeout
+
+    async def acquire(self, tokens: int, priority: Optional[str] = None, requests: int = 1) -> None:
+        """Wait in priority order until the buckets admit the call, or shed it"""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = self._enqueue(priority or request_priority.get(), lambda: loop.call_soon_threadsafe(event.set))
+        started = time.monotonic()
+        admitted = False
+        try:
+            while True:
+                # Cleared before checking, so a wake-up that arrives meanwhile is not lost
+                event.clear()
+                timeout = self._next_timeout(waiter, tokens, requests, started)
+                if timeout == 0:
+                    admitted = True
+                    return
+                # Woken early when this waiter becomes the head of the queue
+                try:
+                    await asyncio.wait_for(event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._dequeue(waiter, started, admitted)
+
+    def acquire_blocking(self, tokens: int, requests: int = 1, priority: Optional[str] = None) -> None:
+        """Blocking variant of acquire for synchronous callers; waits in the same priority queue"""
+        event = threading.Event()
+        waiter = self._enqueue(priority or request_priority.get(), event.set)
+        started = time.monotonic()
+        admitted = False
+        try:
+            while True:
+                event.clear()
+                timeout = self._next_timeout(waiter, tokens, requests, started)
+                if timeout == 0:
+                    admitted = True
+                    return
+                event.wait(timeout)
+        finally:
+            self._dequeue(waiter, started, admitted)
+
+    def settle(self, estimated: int, actual: Optional[int]) -> None:
+        """Correct the token bucket once the real usage of a call is known"""
+        if actual is None:
+            return
+        with self._lock:
+            self._tokens.consume(actual - estimated)
+
+    # Outcomes
+
+    def _succeeded(self) -> None:
+        with self._lock:
+            self._scale = min(1.0, self._scale + 0.05)
+
+    def _failed(self, error: BaseException, attempt: int) -> Optional[float]:
+        """Backoff before the next attempt, or None to re-raise the error"""
+        retryable, retry_after, rate_limited = classify_error(error)
+        give_up = not retryable or attempt >= self.max_retries
+        with self._lock:
+            if rate_limited:
+                self.rate_limited += 1
+                # Back off everyone, not just this call, and refill more slowly until calls succeed
+                self._scale = max(MIN_RATE_SCALE, self._scale / 2)
+                if retry_after:
+                    self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+            if give_up:
+                self.failures += 1
+                estimate = self._retry_after_estimate()
+            else:
+                self.retries += 1
+        if give_up:
+            if rate_limited:
+                raise UpstreamUnavailable(
+                    f"Upstream {self.name} is rate limiting requests", retry_after or estimate
+                ) from error
+            return None
+        backoff = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        return retry_after + random.uniform(0, self.backoff_base) if retry_after else backoff
+
+    # Calls
+
+    async def acall(self, func: Callable[[], Awaitable[T]], tokens: int, priority: Optional[str] = None, requests: int = 1) -> T:
+        """Run an upstream call with admission control and retries"""
+        for attempt in itertools.count():
+            await self.acquire(tokens, priority, requests)
+            try:
+                result = await func()
+            except Exception as error:
+                delay = self._failed(error, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self._succeeded()
+            return result
+
+    def call(self, func: Callable[[], T], tokens: int, requests: int = 1) -> T:
+        """Synchronous variant of acall"""
+        for attempt in itertools.count():
+            self.acquire_blocking(tokens, requests)
+            try:
+                result = func()
+            except Exception as error:
+                delay = self._failed(error, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self._succeeded()
+            return result
+
+    async def astream(self, open_stream: Callable[[], AsyncIterator[T]], tokens: int, priority: Optional[str] = None) -> AsyncIterator[T]:
+        """Stream an upstream response; only failures before the first item are retried"""
+        for attempt in itertools.count():
+            await self.acquire(tokens, priority)
+            received = False
+            try:
+                async for item in open_stream():
+                    received = True
+                    yield item
+            except Exception as error:
+                if received:
+                    raise
+                delay = self._failed(error, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self._succeeded()
+            return
+
+    def stream(self, open_stream: Callable[[], Iterator[T]], tokens: int) -> Iterator[T]:
+        """Synchronous variant of astream"""
+        for attempt in itertools.count():
+            self.acquire_blocking(tokens)
+            received = False
+            try:
+                for item in open_stream():
+                    received = True
+                    yield item
+            except Exception as error:
+                if received:
+                    raise
+                delay = self._failed(error, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self._succeeded()
+            return
+
+    def stats(self) -> Dict[str, Any]:
+        """Return limits, queue depth and outcome counters"""
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "requests_per_minute": self._requests.per_minute,
+                "tokens_per_minute": self._tokens.per_minute,
+                "rate_scale": round(self._scale, 3),
+                "paused_seconds": round(max(0.0, self._blocked_until - now), 2),
+                "queued": self._waiting,
+                "max_queue": self.max_queue,
+                "admitted": self.admitted,
+                "shed": self.shed,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "failures": self.failures,
+                "avg_wait_ms": round(self.wait_seconds / self.admitted * 1000, 1) if self.admitted else 0.0,
+            }
+
+
+def create_upstream_scheduler(name: str, requests_per_minute: int, tokens_per_minute: int) -> UpstreamScheduler:
+    """Create a scheduler for one upstream API, configured by UPSTREAM_* environment variables"""
+    prefix = f"UPSTREAM_{name.upper()}"
+    return UpstreamScheduler(
+        name,
+        requests_per_minute=float(os.getenv(f"{prefix}_RPM", str(requests_per_minute))),
+        tokens_per_minute=float(os.getenv(f"{prefix}_TPM", str(tokens_per_minute))),
+        max_queue=int(os.getenv("UPSTREAM_MAX_QUEUE", "256")),
+        max_wait=float(os.getenv("UPSTREAM_MAX_WAIT", "30")),
+        max_retries=int(os.getenv("UPSTREAM_MAX_RETRIES", "4")),
+        backoff_base=float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5")),
+        backoff_max=float(os.getenv("UPSTREAM_BACKOFF_MAX", "30")),
+    )
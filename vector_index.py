@@ -0,0 +1,252 @@
+"""
+FAISS index types for document stores.
+
+A flat index stores every vector as float32 (6 KB per 1536-dim chunk) and
+scans all of them per query. For large corpora, smaller or faster index
+types trade a little recall for memory and latency:
+
+- ``sq8``: 8-bit scalar quantization, 4x smaller, still a full scan
+- ``pq``: product quantization, about 32x smaller, a full scan of the codes
+- ``ivf``: an inverted file with a trained coarse quantizer; each query
+  scans only the ``nprobe`` nearest lists
+- ``ivf_sq8`` / ``ivf_pq``: IVF over scalar- or product-quantized vectors
+- ``hnsw``: a graph index, fast and accurate but larger than flat
+
+``auto`` keeps small corpora exact and moves to IVF and then IVF-PQ as the
+corpus grows. Types that need training fall back to a simpler one when
+there are too few vectors to train them well. Query-time settings (nprobe,
+efSearch) are applied whenever an index is built or loaded.
+"""
+
+import math
+import os
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+if TYPE_CHECKING:
+    import faiss
+    from langchain_community.vectorstores import FAISS
+
+INDEX_TYPES = ("auto", "flat", "sq8", "pq", "ivf", "ivf_sq8", "ivf_pq", "hnsw")
+DEFAULT_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "auto")
+AUTO_IVF_MIN_VECTORS = int(os.getenv("VECTOR_INDEX_AUTO_IVF_MIN", "20000"))
+AUTO_PQ_MIN_VECTORS = int(os.getenv("VECTOR_INDEX_AUTO_PQ_MIN", "1000000"))
+NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", "16"))
+EF_SEARCH = int(os.getenv("VECTOR_INDEX_EF_SEARCH", "64"))
+HNSW_M = int(os.getenv("VECTOR_INDEX_HNSW_M", "32"))
+PQ_DIMS_PER_CODE = int(os.getenv("VECTOR_INDEX_PQ_DIMS_PER_CODE", "8"))
+TRAIN_SAMPLE = int(os.getenv("VECTOR_INDEX_TRAIN_SAMPLE", "50000"))
+
+# k-means wants about 39 training points per centroid; PQ trains 256 centroids per sub-quantizer
+MIN_POINTS_PER_CENTROID = 39
+PQ_MIN_VECTORS = MIN_POINTS_PER_CENTROID * 256
+
+
+def index_settings() -> Dict[str, Any]:
+    """Settings that shape a built index, for cache keys"""
+    return {
+        "index_type": DEFAULT_INDEX_TYPE,
+        "auto_ivf_min": AUTO_IVF_MIN_VECTORS,
+        "auto_pq_min": AUTO_PQ_MIN_VECTORS,
+        "hnsw_m": HNSW_M,
+        "pq_dims_per_code": PQ_DIMS_PER_CODE,
+    }
+
+
+def ivf_lists(count: int) -> int:
+    """Number of IVF lists for a corpus: about 4 * sqrt(n), with enough points to train each"""
+    return max(1, min(int(4 * math.sqrt(count)), count // MIN_POINTS_PER_CENTROID))
+
+
+def pq_subquantizers(dimension: int) -> int:
+    """Largest divisor of the dimension up to dimension / PQ_DIMS_PER_CODE (192 one-byte codes for 1536 dims)"""
+    for m in range(max(1, dimension // PQ_DIMS_PER_CODE), 0, -1):
+        if dimension % m == 0:
+            return m
+    return 1
+
+
+def resolve_index_type(index_type: Optional[str], count: int) -> str:
+    """Pick the concrete index type for a corpus of count vectors"""
+    index_type = index_type or DEFAULT_INDEX_TYPE
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}'; expected one of {', '.join(INDEX_TYPES)}")
+    if index_type == "auto":
+        if count >= AUTO_PQ_MIN_VECTORS:
+            index_type = "ivf_pq"
+        elif count >= AUTO_IVF_MIN_VECTORS:
+            index_type = "ivf_sq8"
+        else:
+            index_type = "flat"
+    # Too few vectors to train the requested type well
+    if index_type.startswith("ivf") and ivf_lists(count) < 2:
+        index_type = {"ivf": "flat", "ivf_sq8": "sq8", "ivf_pq": "pq"}[index_type]
+    if index_type in ("pq", "ivf_pq") and count < PQ_MIN_VECTORS:
+        index_type = "sq8" if index_type == "pq" else "ivf_sq8"
+    return index_type
+
+
+def factory_string(index_type: str, count: int, dimension: int) -> str:
+    """faiss.index_factory description of a concrete index type"""
+    # "np" skips polysemous training, which is slow and only helps Hamming-filtered search
+    return {
+        "flat": "Flat",
+        "sq8": "SQ8",
+        "pq": f"PQ{pq_subquantizers(dimension)}np",
+        "ivf": f"IVF{ivf_lists(count)},Flat",
+        "ivf_sq8": f"IVF{ivf_lists(count)},SQ8",
+        "ivf_pq": f"IVF{ivf_lists(count)},PQ{pq_subquantizers(dimension)}np",
+        "hnsw": f"HNSW{HNSW_M}",
+    }[index_type]
+
+
+def configure_search(index: "faiss.Index", nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> "faiss.Index":
+    """Apply the query-time settings of IVF and HNSW indexes; other types are returned unchanged"""
+    import faiss
+
+    try:
+        faiss.extract_index_ivf(index).nprobe = nprobe or NPROBE
+    except RuntimeError:
+        pass
+    hnsw = getattr(faiss.downcast_index(index), "hnsw", None)
+    if hnsw is not None:
+        hnsw.efSearch = ef_search or EF_SEARCH
+    return index
+
+
+def build_index(vectors, index_type: Optional[str] = None) -> "faiss.Index":
+    """Build an L2 index of the resolved type over the vectors, training it on a sample if needed"""
+    import faiss
+    import numpy as np
+
+    matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dimension = matrix.shape
+    resolved = resolve_index_type(index_type, count)
+    if resolved == "flat":
+        index = faiss.IndexFlatL2(dimension)
+    else:
+        index = faiss.index_factory(dimension, factory_string(resolved, count, dimension), faiss.METRIC_L2)
+    if not index.is_trained:
+        sample = matrix
+        if count > TRAIN_SAMPLE:
+            sample = matrix[np.random.default_rng(0).choice(count, TRAIN_SAMPLE, replace=False)]
+        index.train(sample)
+    index.add(matrix)
+    if resolved.startswith("ivf"):
+        # Lets retrieval reconstruct stored vectors for context compression
+        faiss.extract_index_ivf(index).make_direct_map()
+    return configure_search(index)
+
+
+def needs_retraining(index: "faiss.Index", count: int) -> bool:
+    """Whether an IVF index's lists no longer suit a corpus of count vectors (off by more than 2x)"""
+    import faiss
+
+    try:
+        nlist = faiss.extract_index_ivf(index).nlist
+    except RuntimeError:
+        return False
+    return not nlist / 2 <= ivf_lists(count) <= nlist * 2
+
+
+def update_index(index: Optional["faiss.Index"], vectors, unchanged: int, index_type: Optional[str] = None) -> "faiss.Index":
+    """Bring a built index up to date with vectors whose first ``unchanged`` rows it already holds
+
+    New vectors are added to the trained index. When earlier vectors have
+    gone, positions shift, so the index is emptied and refilled with the
+    quantizers it has already trained. It is trained again only when the
+    resolved type changes or its IVF lists no longer suit the corpus size,
+    and an HNSW graph, which cannot drop vectors, is rebuilt.
+    """
+    import numpy as np
+
+    matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+    resolved = resolve_index_type(index_type, len(matrix))
+    if index is None or index_type_of(index) != resolved or needs_retraining(index, len(matrix)):
+        return build_index(matrix, resolved)
+    if unchanged == index.ntotal:
+        index.add(matrix[unchanged:])
+    elif resolved == "hnsw":
+        return build_index(matrix, resolved)
+    else:
+        index.reset()
+        index.add(matrix)
+    return configure_search(index)
+
+
+def reconstruct_vector(index: "faiss.Index", position: int):
+    """Stored vector at a position, also across the shards of a collection with pending segments"""
+    import faiss
+
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexShards):
+        for shard_number in range(index.count()):
+            shard = index.at(shard_number)
+            if position < shard.ntotal:
+                return reconstruct_vector(shard, position)
+            position -= shard.ntotal
+        raise RuntimeError("Position is out of range")
+    return index.reconstruct(position)
+
+
+def index_type_of(index: "faiss.Index") -> str:
+    """Name the index type of a built or loaded index"""
+    import faiss
+
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        fine = {faiss.IndexIVFFlat: "ivf", faiss.IndexIVFScalarQuantizer: "ivf_sq8", faiss.IndexIVFPQ: "ivf_pq"}
+        return fine.get(type(index), "ivf")
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "sq8"
+    if isinstance(index, faiss.IndexPQ):
+        return "pq"
+    return "flat"
+
+
+def index_bytes(index: "faiss.Index") -> int:
+    """Approximate memory held by an index's vectors and structures"""
+    import faiss
+
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        # Codes plus a stored id and a direct-map entry per vector, and the coarse centroids
+        return index.ntotal * (index.code_size + 16) + index.nlist * index.d * 4
+    if isinstance(index, faiss.IndexHNSW):
+        return index.ntotal * (index.storage.sa_code_size() + index.hnsw.nb_neighbors(0) * 4)
+    try:
+        return index.ntotal * index.sa_code_size()
+    except RuntimeError:
+        return index.ntotal * index.d * 4
+
+
+def describe_index(index: "faiss.Index") -> Dict[str, Any]:
+    """Type, size and memory of an index, for stats endpoints"""
+    return {"type": index_type_of(index), "vectors": index.ntotal, "bytes": index_bytes(index)}
+
+
+def vectorstore_from_embeddings(
+    texts: List[str],
+    vectors,
+    embeddings,
+    metadatas: Optional[List[Dict[str, Any]]] = None,
+    index_type: Optional[str] = None,
+) -> "FAISS":
+    """Build a FAISS vector store over precomputed vectors with the configured index type
+
+    Equivalent to ``FAISS.from_embeddings``, which always builds a flat index.
+    """
+    import uuid
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.documents import Document
+
+    index = build_index(vectors, index_type)
+    ids = [str(uuid.uuid4()) for _ in texts]
+    metadatas = metadatas or [{} for _ in texts]
+    docstore = InMemoryDocstore({
+        doc_id: Document(page_content=text, metadata=metadata)
+        for doc_id, text, metadata in zip(ids, texts, metadatas)
+    })
+    return FAISS(embeddings, index, docstore, dict(enumerate(ids)))
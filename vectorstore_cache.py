@@ -0,0 +1,239 @@
+"""
+Content-addressed cache for built FAISS vector stores.
+
+Vector stores are keyed by a hash of the document text plus the settings that
+shaped the index (splitter, chunk sizes, embedding model), so a repeated
+document skips splitting, embedding and indexing entirely.
+
+With a persistence directory, indexes are written there once and then served
+memory-mapped read-only, so every worker on a host shares one physical copy
+of the vectors through the page cache.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Optional
+
+from concurrency import run_sync
+from vector_index import configure_search, index_bytes
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+
+
+def make_cache_key(text: str, **settings: Any) -> str:
+    """Build a content-addressed key from document text and index settings"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def estimate_vectorstore_bytes(vectorstore: "FAISS") -> int:
+    """Approximate the memory held by a FAISS store (index plus chunk text)"""
+    vector_bytes = index_bytes(vectorstore.index)
+    text_bytes = sum(
+        len(doc.page_content.encode("utf-8"))
+        for doc in vectorstore.docstore._dict.values()
+    )
+    return vector_bytes + text_bytes
+
+
+def read_index_mmap(index_path: str):
+    """Read a FAISS index memory-mapped read-only, or into memory for index types without mmap support
+
+    IVF and HNSW query settings (nprobe, efSearch) are applied to the loaded index.
+    """
+    import faiss
+
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+    try:
+        index = faiss.read_index(index_path, flags)
+    except RuntimeError:
+        index = faiss.read_index(index_path)
+    return configure_search(index)
+
+
+def load_shared_vectorstore(path: str, embeddings, index_name: str = "index") -> "FAISS":
+    """Load a store saved with ``save_local`` with its index memory-mapped read-only"""
+    from langchain_community.vectorstores import FAISS
+
+    index = read_index_mmap(os.path.join(path, f"{index_name}.faiss"))
+    # Only indexes written by this application are ever loaded
+    with open(os.path.join(path, f"{index_name}.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+class _CacheEntry:
+    __slots__ = ("vectorstore", "size_bytes", "created_at")
+
+    def __init__(self, vectorstore: "FAISS", size_bytes: int, created_at: float):
+        self.vectorstore = vectorstore
+        self.size_bytes = size_bytes
+        self.created_at = created_at
+
+
+class VectorStoreCache:
+    """LRU cache of FAISS stores with TTL expiry, a memory budget and optional disk persistence"""
+
+    def __init__(
+        self,
+        max_entries: int = 32,
+        ttl_seconds: Optional[float] = 3600,
+        max_bytes: Optional[int] = 256 * 1024 * 1024,
+        persist_dir: Optional[str] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.persist_dir = persist_dir
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.persist_dir:
+            os.makedirs(self.persist_dir, exist_ok=True)
+
+    def _is_expired(self, created_at: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.persist_dir, key)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._total_bytes -= entry.size_bytes
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until count and byte limits hold"""
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes is not None and self._total_bytes > self.max_bytes)
+        ):
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+
+    def _load_from_disk(self, key: str, embeddings) -> Optional["FAISS"]:
+        path = self._disk_path(key)
+        if not os.path.isdir(path):
+            return None
+        if self._is_expired(os.path.getmtime(path)):
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+        try:
+            return load_shared_vectorstore(path, embeddings)
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+
+    def get(self, key: str, embeddings=None) -> Optional["FAISS"]:
+        """Return a cached vector store, falling back to disk when persistence is enabled"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._is_expired(entry.created_at):
+                    self._remove(key)
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry.vectorstore
+
+        if self.persist_dir and embeddings is not None:
+            vectorstore = self._load_from_disk(key, embeddings)
+            if vectorstore is not None:
+                self.put(key, vectorstore, persist=False)
+                with self._lock:
+                    self.disk_hits += 1
+                return vectorstore
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _persist(self, key: str, vectorstore: "FAISS") -> None:
+        """Save a store under a temporary name and rename it into place
+
+        Other workers never see a partly written index; if one of them
+        persisted the same key first, its copy is kept.
+        """
+        path = self._disk_path(key)
+        temp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        vectorstore.save_local(temp_path)
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            shutil.rmtree(temp_path, ignore_errors=True)
+        # Swap in the memory-mapped index so this worker drops its private copy of the vectors
+        try:
+            vectorstore.index = read_index_mmap(os.path.join(path, "index.faiss"))
+        except RuntimeError:
+            pass
+
+    def put(self, key: str, vectorstore: "FAISS", persist: bool = True) -> None:
+        """Store a vector store, evicting older entries to stay within budget"""
+        if persist and self.persist_dir:
+            self._persist(key, vectorstore)
+        size_bytes = estimate_vectorstore_bytes(vectorstore)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _CacheEntry(vectorstore, size_bytes, time.time())
+            self._total_bytes += size_bytes
+            self._evict()
+
+    def get_or_build(self, key: str, builder: Callable[[], "FAISS"], embeddings=None) -> "FAISS":
+        """Return the cached store for key, building and caching it on a miss"""
+        vectorstore = self.get(key, embeddings)
+        if vectorstore is None:
+            vectorstore = builder()
+            self.put(key, vectorstore)
+        return vectorstore
+
+    async def aget_or_build(
+        self,
+        key: str,
+        builder: Callable[[], Awaitable["FAISS"]],
+        embeddings=None,
+    ) -> "FAISS":
+        """Async variant of get_or_build; disk reads and writes run on the worker pool"""
+        if self.persist_dir:
+            vectorstore = await run_sync(self.get, key, embeddings)
+        else:
+            vectorstore = self.get(key, embeddings)
+        if vectorstore is None:
+            vectorstore = await builder()
+            if self.persist_dir:
+                await run_sync(self.put, key, vectorstore)
+            else:
+                self.put(key, vectorstore)
+        return vectorstore
+
+    def clear(self) -> None:
+        """Drop all in-memory entries (persisted indexes are kept)"""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> dict:
+        """Return cache counters for monitoring"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "total_bytes": self._total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
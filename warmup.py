@@ -0,0 +1,87 @@
+"""
+Background warmup of lazily imported subsystems.
+
+The API module imports only what every request needs, so a worker starts
+answering health checks quickly. Heavy dependencies are imported by the
+endpoints that use them, on first use:
+
+- LangChain chains and memory
+- the OpenAI SDK
+- FAISS
+- text splitters and retrievers
+
+Once the server is up, the warmup imports the same modules ahead of time on
+the worker pool, one endpoint group after another. It then runs setup hooks
+such as creating the shared clients, so the first real request rarely pays
+the import cost. The time taken by each group is recorded, which shows what
+each endpoint group adds to startup.
+"""
+
+import importlib
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from concurrency import run_sync
+
+
+class Warmup:
+    """Import endpoint groups and run setup hooks once, timing each step"""
+
+    def __init__(self, groups: Dict[str, Sequence[str]], enabled: bool = True):
+        self.groups = groups
+        self.enabled = enabled
+        self._hooks: List[Tuple[str, Callable[[], Any]]] = []
+        self.state = "pending" if enabled else "disabled"
+        self.seconds: Dict[str, float] = {}
+        self.error: Optional[str] = None
+        self._stopping = False
+
+    def add_hook(self, name: str, func: Callable[[], Any]) -> None:
+        """Run func after the imports, e.g. to create clients or prebuild chains"""
+        self._hooks.append((name, func))
+
+    def run_blocking(self) -> None:
+        """Import every group and run the hooks, stopping at the first failure"""
+        self.state = "running"
+        steps = [
+            (group, lambda modules=modules: [importlib.import_module(module) for module in modules])
+            for group, modules in self.groups.items()
+        ] + self._hooks
+        try:
+            for name, step in steps:
+                if self._stopping:
+                    self.state = "stopped"
+                    return
+                started = time.perf_counter()
+                step()
+                self.seconds[name] = time.perf_counter() - started
+        except Exception as e:
+            # Endpoints still import what they need on first use
+            self.state = "failed"
+            self.error = f"{name}: {e}"
+            return
+        self.state = "ready"
+
+    async def run(self) -> None:
+        """Warm up on the worker pool without blocking the event loop"""
+        if self.enabled:
+            await run_sync(self.run_blocking)
+
+    def stop(self) -> None:
+        """Skip the remaining steps; the step already running finishes on its own"""
+        self._stopping = True
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the warmup state and the milliseconds spent per group and hook"""
+        return {
+            "state": self.state,
+            "total_ms": round(sum(self.seconds.values()) * 1000, 1),
+            "steps_ms": {name: round(seconds * 1000, 1) for name, seconds in self.seconds.items()},
+            "error": self.error,
+        }
+
+
+def create_warmup(groups: Dict[str, Sequence[str]]) -> Warmup:
+    """Create the warmup configured by the WARMUP environment variable"""
+    return Warmup(groups, enabled=os.getenv("WARMUP", "1") != "0")